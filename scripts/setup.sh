@@ -27,7 +27,7 @@ echo_b "Checking local mounted database path..."
 [ ! -d ${DB_DIR} ] && echo_r "Local database path ${DB_DIR} not existed, creating one" && sudo mkdir -p ${DB_DIR} && sudo chown -R ${USER}:${USER} ${DB_DIR}
 
 echo_b "Checking local Docker image..."
-pull_image "mongo:3.2"
+pull_image "mongo:3.4"
 pull_image "python:3.5"
 pull_image "yeasy/nginx:latest"
 
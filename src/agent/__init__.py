@@ -1,5 +1,6 @@
 from .docker_swarm import get_project, \
     check_daemon, detect_daemon_type, \
+    get_daemon_resources, get_project_usage, \
     get_swarm_node_ip, \
     compose_up, compose_clean, compose_start, compose_stop, compose_restart, \
     setup_container_host, cleanup_host, reset_container_host
@@ -9,7 +9,7 @@ from compose.config.environment import Environment
 from compose.project import OneOffFilter
 from docker import Client
 
-from common import log_handler, LOG_LEVEL
+from common import log_handler, LOG_LEVEL, timed
 from common import \
     HOST_TYPES, \
     CLUSTER_NETWORK, \
@@ -32,7 +32,7 @@ def _clean_chaincode_images(daemon_url, name_prefix, timeout=5):
     :param timeout: Time to wait for the response
     :return: None
     """
-    logger.debug("clean chaincode images with prefix={}".format(name_prefix))
+    logger.debug("clean chaincode images with prefix=%s", name_prefix)
     client = Client(base_url=daemon_url, version="auto", timeout=timeout)
     images = client.images()
     id_removes = [e['Id'] for e in images if e['RepoTags'][0].startswith(
@@ -54,15 +54,15 @@ def _clean_project_containers(daemon_url, name_prefix, timeout=5):
     :param timeout: Time to wait for the response
     :return: None
     """
-    logger.debug("Clean project containers, daemon_url={}, prefix={}".format(
-        daemon_url, name_prefix))
+    logger.debug("Clean project containers, daemon_url=%s, prefix=%s",
+                 daemon_url, name_prefix)
     client = Client(base_url=daemon_url, version="auto", timeout=timeout)
     containers = client.containers(all=True)
     id_removes = [e['Id'] for e in containers if
                   e['Names'][0].split("/")[-1].startswith(name_prefix)]
     for _ in id_removes:
         client.remove_container(_, force=True)
-        logger.debug("Remove container {}".format(_))
+        logger.debug("Remove container %s", _)
 
 
 def start_containers(daemon_url, name_prefix, timeout=5):
@@ -75,8 +75,8 @@ def start_containers(daemon_url, name_prefix, timeout=5):
     :param timeout: Time to wait for the response
     :return: None
     """
-    logger.debug("Get containers, daemon_url={}, prefix={}".format(
-        daemon_url, name_prefix))
+    logger.debug("Get containers, daemon_url=%s, prefix=%s",
+                 daemon_url, name_prefix)
     client = Client(base_url=daemon_url, version="auto", timeout=timeout)
     containers = client.containers(all=True)
     id_cc = [e['Id'] for e in containers if
@@ -103,13 +103,14 @@ def _clean_exited_containers(daemon_url):
                                    filters={"status": "exited"})
     id_removes = [e['Id'] for e in containers]
     for _ in id_removes:
-        logger.debug("exited container to remove, id={}", _)
+        logger.debug("exited container to remove, id=%s", _)
         try:
             client.remove_container(_)
         except Exception as e:
-            logger.error("Exception in clean_exited_containers {}".format(e))
+            logger.error("Exception in clean_exited_containers %s", e)
 
 
+@timed("check_daemon")
 def check_daemon(daemon_url, timeout=5):
     """ Check if the daemon is active
 
@@ -123,13 +124,13 @@ def check_daemon(daemon_url, timeout=5):
         return False
     segs = daemon_url.split(":")
     if len(segs) != 3:
-        logger.error("Invalid daemon url = ", daemon_url)
+        logger.error("Invalid daemon url = %s", daemon_url)
         return False
     try:
         client = Client(base_url=daemon_url, version="auto", timeout=timeout)
         return client.ping() == 'OK'
     except Exception as e:
-        logger.error("Exception in check_daemon {}".format(e))
+        logger.error("Exception in check_daemon %s", e)
         return False
 
 
@@ -146,7 +147,7 @@ def detect_daemon_type(daemon_url, timeout=5):
         return None
     segs = daemon_url.split(":")
     if len(segs) != 3:
-        logger.error("Invalid daemon url = ", daemon_url)
+        logger.error("Invalid daemon url = %s", daemon_url)
         return None
     try:
         client = Client(base_url=daemon_url, version="auto", timeout=timeout)
@@ -160,6 +161,62 @@ def detect_daemon_type(daemon_url, timeout=5):
         return None
 
 
+def get_daemon_resources(daemon_url, timeout=5):
+    """ Get the total resources and container number of the daemon
+
+    Only wait for timeout seconds.
+
+    :param daemon_url: Docker daemon url
+    :param timeout: Time to wait for the response
+    :return: dict of cpus, mem_total (bytes) and containers, or {}
+    """
+    try:
+        client = Client(base_url=daemon_url, version="auto", timeout=timeout)
+        info = client.info()
+        return {
+            'cpus': info.get('NCPU', 0),
+            'mem_total': info.get('MemTotal', 0),
+            'containers': info.get('Containers', 0),
+        }
+    except Exception as e:
+        logger.error("Exception in get_daemon_resources %s", e)
+        return {}
+
+
+def get_project_usage(daemon_url, name_prefix, timeout=5):
+    """ Get the resources used by the containers with the name prefix
+
+    :param daemon_url: Docker daemon url
+    :param name_prefix: container name prefix, e.g., the cluster id
+    :param timeout: Time to wait for the response
+    :return: dict of mem (bytes) and cpu (cores), or {}
+    """
+    try:
+        client = Client(base_url=daemon_url, version="auto", timeout=timeout)
+        containers = client.containers(
+            filters={"name": name_prefix, "status": "running"})
+        mem, cpu = 0, 0.0
+        for c in containers:
+            stats = client.stats(c['Id'], stream=False, decode=True)
+            mem += stats.get('memory_stats', {}).get('usage', 0)
+            cpu_stats, pre_stats = stats.get('cpu_stats', {}), \
+                stats.get('precpu_stats', {})
+            cpu_delta = cpu_stats.get('cpu_usage', {}).get('total_usage', 0) \
+                - pre_stats.get('cpu_usage', {}).get('total_usage', 0)
+            sys_delta = cpu_stats.get('system_cpu_usage', 0) - \
+                pre_stats.get('system_cpu_usage', 0)
+            online = cpu_stats.get('online_cpus') or len(
+                cpu_stats.get('cpu_usage', {}).get('percpu_usage') or [1])
+            if cpu_delta > 0 and sys_delta > 0:
+                cpu += float(cpu_delta) / sys_delta * online
+        if not containers:
+            return {}
+        return {'mem': mem, 'cpu': cpu}
+    except Exception as e:
+        logger.error("Exception in get_project_usage %s", e)
+        return {}
+
+
 def reset_container_host(host_type, daemon_url, timeout=15):
     """ Try to detect the daemon type
 
@@ -201,6 +258,7 @@ def reset_container_host(host_type, daemon_url, timeout=15):
     return setup_container_host(host_type=host_type, daemon_url=daemon_url)
 
 
+@timed("get_swarm_node_ip")
 def get_swarm_node_ip(swarm_url, container_name, timeout=5):
     """
     Detect the host ip where the given container locate in the swarm cluster
@@ -210,8 +268,8 @@ def get_swarm_node_ip(swarm_url, container_name, timeout=5):
     :param timeout: Time to wait for the response
     :return: host ip
     """
-    logger.debug("Detect container={} with swarm_url={}".format(
-        container_name, swarm_url))
+    logger.debug("Detect container=%s with swarm_url=%s",
+                 container_name, swarm_url)
     try:
         client = Client(base_url=swarm_url, version="auto", timeout=timeout)
         info = client.inspect_container(container_name)
@@ -232,10 +290,10 @@ def setup_container_host(host_type, daemon_url, timeout=5):
     :return: True or False
     """
     if not daemon_url or not daemon_url.startswith("tcp://"):
-        logger.error("Invalid daemon_url={}".format(daemon_url))
+        logger.error("Invalid daemon_url=%s", daemon_url)
         return False
     if host_type not in HOST_TYPES:
-        logger.error("Invalid host_type={}".format(host_type))
+        logger.error("Invalid host_type=%s", host_type)
         return False
     try:
         client = Client(base_url=daemon_url, version="auto", timeout=timeout)
@@ -243,15 +301,15 @@ def setup_container_host(host_type, daemon_url, timeout=5):
         for cs_type in CONSENSUS_PLUGINS:
             net_name = CLUSTER_NETWORK + "_{}".format(cs_type)
             if net_name in net_names:
-                logger.warning("Network {} already exists, use it!".format(
-                    net_name))
+                logger.warning("Network %s already exists, use it!",
+                               net_name)
             else:
                 if host_type == HOST_TYPES[0]:  # single
                     client.create_network(net_name, driver='bridge')
                 elif host_type == HOST_TYPES[1]:  # swarm
                     client.create_network(net_name, driver='overlay')
                 else:
-                    logger.error("No-supported host_type={}".format(host_type))
+                    logger.error("No-supported host_type=%s", host_type)
                     return False
     except Exception as e:
         logger.error("Exception happens!")
@@ -271,7 +329,7 @@ def cleanup_host(daemon_url, timeout=5):
     :return:
     """
     if not daemon_url or not daemon_url.startswith("tcp://"):
-        logger.error("Invalid daemon_url={}".format(daemon_url))
+        logger.error("Invalid daemon_url=%s", daemon_url)
         return False
     try:
         client = Client(base_url=daemon_url, version="auto", timeout=timeout)
@@ -279,10 +337,10 @@ def cleanup_host(daemon_url, timeout=5):
         for cs_type in CONSENSUS_PLUGINS:
             net_name = CLUSTER_NETWORK + "_{}".format(cs_type)
             if net_name in net_names:
-                logger.debug("Remove network {}".format(net_name))
+                logger.debug("Remove network %s", net_name)
                 client.remove_network(net_name)
             else:
-                logger.warning("Network {} not exists!".format(net_name))
+                logger.warning("Network %s not exists!", net_name)
     except Exception as e:
         logger.error("Exception happens!")
         logger.error(e)
@@ -332,11 +390,12 @@ def _compose_set_env(name, daemon_url, mapped_ports=SERVICE_PORTS,
         os.environ['SYSLOG_SERVER'] = log_server
 
 
+@timed("compose_up")
 def compose_up(name, host, mapped_ports,
                consensus_plugin=CONSENSUS_PLUGINS[0],
                consensus_mode=CONSENSUS_MODES[0],
                cluster_size=CLUSTER_SIZES[0],
-               timeout=5):
+               timeout=5, span=None):
     """ Compose up a cluster
 
     :param name: The name of the cluster
@@ -346,13 +405,13 @@ def compose_up(name, host, mapped_ports,
     :param consensus_mode: Cluster consensus mode
     :param cluster_size: the size of the cluster
     :param timeout: Docker client timeout value
+    :param span: Span to mark the image pull and compose up phases
     :return: The name list of the started peer containers
     """
     logger.debug(
-        "Compose start: name={}, host={}, mapped_port={}, consensus={}/{},"
-        "size={}".format(
-            name, host.get("name"), mapped_ports, consensus_plugin,
-            consensus_mode, cluster_size))
+        "Compose start: name=%s, host=%s, mapped_port=%s, consensus=%s/%s, "
+        "size=%s", name, host.get("name"), mapped_ports, consensus_plugin,
+        consensus_mode, cluster_size)
     daemon_url, log_type, log_server, log_level = \
         host.get("daemon_url"), host.get("log_type"), host.get("log_server"), \
         host.get("log_level")
@@ -364,19 +423,27 @@ def compose_up(name, host, mapped_ports,
                      log_server)
     try:
         project = get_project(COMPOSE_FILE_PATH + "/" + log_type)
+        if span:  # pull the missing images first to time them apart
+            for service in project.get_services():
+                service.ensure_image_exists()
+            span.mark("image_pull")
         containers = project.up(detached=True, timeout=timeout)
     except Exception as e:
-        logger.warning("Exception when compose start={}".format(e))
+        logger.warning("Exception when compose start=%s", e)
         return {}
+    finally:
+        if span:
+            span.mark("compose_up")
     if not containers or cluster_size != len(containers):
         return {}
     result = {}
     for c in containers:
         result[c.name] = c.id
-    logger.debug("compose started with containers={}".format(result))
+    logger.debug("compose started with containers=%s", result)
     return result
 
 
+@timed("compose_clean")
 def compose_clean(name, daemon_url, consensus_plugin):
     """
     Try best to clean a compose project and clean related containers.
@@ -407,7 +474,7 @@ def compose_clean(name, daemon_url, consensus_plugin):
         logger.error(e)
         # has_exception = True  # may ignore this case
     if has_exception:
-        logger.warning("Exception when cleaning project {}".format(name))
+        logger.warning("Exception when cleaning project %s", name)
         return False
     return True
 
@@ -430,9 +497,9 @@ def compose_start(name, daemon_url, mapped_ports=SERVICE_PORTS,
     :param cluster_size: the size of the cluster
     :return:
     """
-    logger.debug("Compose Start {} with daemon_url={}, mapped_ports={} "
-                 "consensus={}".format(name, daemon_url, mapped_ports,
-                                       consensus_plugin))
+    logger.debug("Compose Start %s with daemon_url=%s, mapped_ports=%s "
+                 "consensus=%s", name, daemon_url, mapped_ports,
+                 consensus_plugin)
 
     _compose_set_env(name, daemon_url, mapped_ports, consensus_plugin,
                      consensus_mode, cluster_size, log_level, log_type,
@@ -443,7 +510,7 @@ def compose_start(name, daemon_url, mapped_ports=SERVICE_PORTS,
         project.start()
         start_containers(daemon_url, name + '-')
     except Exception as e:
-        logger.warning("Exception when compose start={}".format(e))
+        logger.warning("Exception when compose start=%s", e)
         return False
     return True
 
@@ -466,9 +533,9 @@ def compose_restart(name, daemon_url, mapped_ports=SERVICE_PORTS,
     :param cluster_size: the size of the cluster
     :return:
     """
-    logger.debug("Compose restart {} with daemon_url={}, mapped_ports={} "
-                 "consensus={}".format(name, daemon_url, mapped_ports,
-                                       consensus_plugin))
+    logger.debug("Compose restart %s with daemon_url=%s, mapped_ports=%s "
+                 "consensus=%s", name, daemon_url, mapped_ports,
+                 consensus_plugin)
 
     _compose_set_env(name, daemon_url, mapped_ports, consensus_plugin,
                      consensus_mode, cluster_size, log_level, log_type,
@@ -479,7 +546,7 @@ def compose_restart(name, daemon_url, mapped_ports=SERVICE_PORTS,
         project.restart()
         start_containers(daemon_url, name + '-')
     except Exception as e:
-        logger.warning("Exception when compose restart={}".format(e))
+        logger.warning("Exception when compose restart=%s", e)
         return False
     return True
 
@@ -503,11 +570,9 @@ def compose_stop(name, daemon_url, mapped_ports=SERVICE_PORTS,
     :param timeout: Docker client timeout
     :return:
     """
-    logger.debug("Compose stop {} with daemon_url={}, mapped_ports={}, "
-                 "consensus={}, log_type={}".format(name, daemon_url,
-                                                    mapped_ports,
-                                                    consensus_plugin,
-                                                    log_type))
+    logger.debug("Compose stop %s with daemon_url=%s, mapped_ports=%s, "
+                 "consensus=%s, log_type=%s", name, daemon_url, mapped_ports,
+                 consensus_plugin, log_type)
 
     _compose_set_env(name, daemon_url, mapped_ports, consensus_plugin,
                      consensus_mode, cluster_size, log_level, log_type,
@@ -516,7 +581,7 @@ def compose_stop(name, daemon_url, mapped_ports=SERVICE_PORTS,
     try:
         project.stop(timeout=timeout)
     except Exception as e:
-        logger.warning("Exception when compose stop={}".format(e))
+        logger.warning("Exception when compose stop=%s", e)
         return False
     return True
 
@@ -540,8 +605,8 @@ def compose_down(name, daemon_url, mapped_ports=SERVICE_PORTS,
     :param timeout: Docker client timeout
     :return:
     """
-    logger.debug("Compose remove {} with daemon_url={}, "
-                 "consensus={}".format(name, daemon_url, consensus_plugin))
+    logger.debug("Compose remove %s with daemon_url=%s, consensus=%s",
+                 name, daemon_url, consensus_plugin)
     # compose use this
     _compose_set_env(name, daemon_url, mapped_ports, consensus_plugin,
                      consensus_mode, cluster_size, log_level, log_type,
@@ -1,10 +1,12 @@
 
 from .db import db, col_host
 from .response import make_ok_response, make_fail_response, CODE_NOT_FOUND,\
+    json_response, json_dumps, ok_body, fail_body, make_retry_response, \
+    CODE_TOO_MANY_REQUESTS, \
     CODE_BAD_REQUEST, CODE_CONFLICT, CODE_CREATED, CODE_FORBIDDEN, \
     CODE_METHOD_NOT_ALLOWED, CODE_NO_CONTENT, CODE_NOT_ACCEPTABLE, CODE_OK
 
-from .log import log_handler, LOG_LEVEL
+from .log import log_handler, LOG_LEVEL, set_log_id, get_log_id
 from .utils import \
     PEER_SERVICE_PORTS, CA_SERVICE_PORTS, SERVICE_PORTS, \
     COMPOSE_FILE_PATH, \
@@ -14,4 +16,32 @@ from .utils import \
     CLUSTER_NETWORK, \
     CLUSTER_LOG_TYPES, CLUSTER_LOG_LEVEL, \
     SYS_CREATOR, SYS_DELETER, SYS_RESETTING, SYS_USER, \
-    request_debug, request_get, request_json_body
+    RELEASED_TTL_DAYS, RETENTION_CHECK_INTERVAL, POOL_REPLICA, \
+    SCHEDULER_STRATEGY, SCHEDULER_STRATEGIES, SCHEDULER_WARM_BONUS, \
+    SCHEDULER_FAIL_PENALTY, SCHEDULER_FAIL_HALF_LIFE, \
+    CAPACITY_MEM_RATIO, CAPACITY_CPU_RATIO, CAPACITY_NODE_MEM, \
+    CAPACITY_NODE_CPU, CAPACITY_SAMPLES, CAPACITY_MAX, \
+    CAPACITY_CHECK_INTERVAL, \
+    FILLUP_CONCURRENCY, FILLUP_RATE, JOB_STALE_TIMEOUT, \
+    DEMAND_WINDOW, DEMAND_HALF_LIFE, DEMAND_PRIOR, STAT_CACHE_TTL, \
+    COUNTER_SYNC_INTERVAL, SERIES_INTERVAL, SERIES_RAW_TTL, \
+    SERIES_MINUTE_TTL, SERIES_HOUR_TTL, SPAN_WINDOW, \
+    PUSH_INTERVAL, PUSH_KEEPALIVE, PUSH_QUEUE_SIZE, PUSH_MAX_LISTENERS, \
+    COMPRESS_MIN_SIZE, COMPRESS_LEVEL, AIO_AGENT_WORKERS, AIO_DB_WORKERS, \
+    STREAM_MIN_ITEMS, STREAM_CHUNK_ITEMS, ADMIT_RATE, ADMIT_BURST, \
+    ADMIT_USER_RATE, ADMIT_USER_BURST, ADMIT_CONCURRENCY, ADMIT_MAX_USERS, \
+    IDEMPOTENCY_TTL, IDEMPOTENCY_WAIT, IDEMPOTENCY_LEASE, APPLY_BATCH_MAX, \
+    CAPTURE_FILE, request_debug, request_get, request_json_body
+from .cache import DocCache
+from .feed import change_feed
+from .replica import Replica
+from .push import Broadcaster
+from .web import conditional, compress_app, trace_app, admitted, \
+    idempotent, capture_app
+from .ratelimit import TokenBucket
+from .admission import Admission
+from .idempotency import idempotency_store
+from .capture import traffic_capture
+from .span import Span, percentiles
+from .metrics import instrument_app, serve_metrics, timed, \
+    QUEUE_DEPTH, WATCHDOG_CYCLE
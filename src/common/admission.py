@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from threading import BoundedSemaphore, Lock
+
+from .metrics import ADMISSION_REJECTED, QUEUE_DEPTH
+from .ratelimit import TokenBucket
+from .utils import ADMIT_RATE, ADMIT_BURST, ADMIT_USER_RATE, \
+    ADMIT_USER_BURST, ADMIT_CONCURRENCY, ADMIT_MAX_USERS
+
+
+class Admission(object):
+    """ Admit the cluster operations of the users, or reject them at once
+
+    An operation must pass the token bucket of its user, then the global
+    one, then get one of the slots for operations in flight, so a bursty
+    user is rejected before taking the capacity of the others, and
+    overload is answered by fast rejections instead of piling up work on
+    mongo and the daemons.
+    """
+    def __init__(self, rate=ADMIT_RATE, burst=ADMIT_BURST,
+                 user_rate=ADMIT_USER_RATE, user_burst=ADMIT_USER_BURST,
+                 concurrency=ADMIT_CONCURRENCY, max_users=ADMIT_MAX_USERS,
+                 busy_retry=1):
+        """ Init
+
+        :param rate: operations per second in total, 0 for no limit
+        :param burst: operations at once in total
+        :param user_rate: operations per second of each user, 0 for no limit
+        :param user_burst: operations at once of each user
+        :param concurrency: max operations in flight, 0 for no limit
+        :param max_users: max users to keep the buckets of
+        :param busy_retry: seconds to retry after when no slot is free
+        """
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.user_rate, self.user_burst = user_rate, user_burst
+        self.users = OrderedDict()  # user -> TokenBucket, least recent first
+        self.max_users = max_users
+        self.lock = Lock()
+        self.slots = BoundedSemaphore(concurrency) if concurrency > 0 \
+            else None
+        self.busy_retry = busy_retry
+        self.in_flight = QUEUE_DEPTH.labels("admitted")
+
+    def _user_bucket(self, user):
+        """ Get the bucket of a user, a new one is full
+
+        :param user: user id
+        :return: TokenBucket
+        """
+        with self.lock:
+            bucket = self.users.pop(user, None)
+            if bucket is None:
+                bucket = TokenBucket(self.user_rate, self.user_burst)
+                if len(self.users) >= self.max_users:
+                    self.users.popitem(last=False)
+            self.users[user] = bucket
+        return bucket
+
+    def enter(self, user, n=1):
+        """ Try to admit n operations of a user in one slot, call leave()
+        after them if admitted
+
+        :param user: user id, or some other key of the client
+        :param n: number of operations
+        :return: 0 if admitted, otherwise seconds to retry after
+        :raise ValueError: if n is over the bursts
+        """
+        return self.enter_batch([user] * n)
+
+    def enter_batch(self, users):
+        """ Try to admit a batch of operations in one slot, each charged to
+        the bucket of its user and the global one, call leave() after them
+        if admitted
+
+        :param users: user of each operation
+        :return: 0 if admitted, otherwise seconds to retry after
+        :raise ValueError: if more operations than the bursts, which could
+        never be admitted
+
+        The tokens taken are given back if a later limit rejects the batch,
+        so rejections never drain the quotas of the users.
+        """
+        counts = OrderedDict()
+        for user in users:
+            counts[user] = counts.get(user, 0) + 1
+        if self.bucket and len(users) > self.bucket.burst:
+            ADMISSION_REJECTED.labels("batch_size").inc()
+            raise ValueError("{} operations over the burst of {}".format(
+                len(users), int(self.bucket.burst)))
+        if self.user_rate > 0:
+            for user, n in counts.items():
+                if n > max(self.user_burst, 1):
+                    ADMISSION_REJECTED.labels("batch_size").inc()
+                    raise ValueError(
+                        "{} operations of {} over the burst of {}".format(
+                            n, user, max(self.user_burst, 1)))
+        taken = []  # (bucket, tokens) to give back if rejected
+
+        def reject(reason, wait):
+            for bucket, n in taken:
+                bucket.refund(n)
+            ADMISSION_REJECTED.labels(reason).inc()
+            return wait
+
+        if self.user_rate > 0:
+            for user, n in counts.items():
+                bucket = self._user_bucket(user)
+                wait = bucket.try_acquire(n)
+                if wait:
+                    return reject("user_rate", wait)
+                taken.append((bucket, n))
+        if self.bucket:
+            wait = self.bucket.try_acquire(len(users))
+            if wait:
+                return reject("rate", wait)
+            taken.append((self.bucket, len(users)))
+        if self.slots and not self.slots.acquire(False):
+            return reject("concurrency", self.busy_retry)
+        self.in_flight.inc()
+        return 0
+
+    def leave(self):
+        """ Free the slot of an admitted operation
+
+        :return: None
+        """
+        self.in_flight.dec()
+        if self.slots:
+            self.slots.release()
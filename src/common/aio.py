@@ -0,0 +1,31 @@
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from .db import MONGO_URL, MONGO_DB
+from .metrics import MongoListener
+from .utils import AIO_AGENT_WORKERS, AIO_DB_WORKERS
+
+aio_client = AsyncIOMotorClient(MONGO_URL, event_listeners=[MongoListener()])
+aio_db = aio_client[MONGO_DB]
+
+# blocking calls are split by their length, so slow agent operations never
+# hold up the short db bookkeeping
+_executors = {
+    'agent': ThreadPoolExecutor(max_workers=AIO_AGENT_WORKERS),
+    'db': ThreadPoolExecutor(max_workers=AIO_DB_WORKERS),
+}
+
+
+def run_blocking(pool, func, *args, **kwargs):
+    """ Run a blocking call in a bounded thread pool, off the event loop
+
+    :param pool: 'agent' for operations on the daemons, 'db' for short
+    mongo writes
+    :param func: the blocking function
+    :return: awaitable of the result
+    """
+    return asyncio.get_event_loop().run_in_executor(
+        _executors[pool], functools.partial(func, *args, **kwargs))
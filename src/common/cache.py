@@ -0,0 +1,83 @@
+import copy
+import time
+
+from collections import OrderedDict
+from threading import Lock
+
+from .utils import CACHE_SIZE, CACHE_TTL
+
+
+class DocCache(object):
+    """ Read-through cache for serialized docs
+
+    Entries expire after `ttl` seconds, the least recently used ones are
+    evicted beyond `max_size`. Callers get copies, so they can modify the
+    results freely.
+    """
+    def __init__(self, name, ttl=CACHE_TTL, max_size=CACHE_SIZE):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.data = OrderedDict()  # key -> (expire_ts, value)
+        self.generation = 0  # changed by each invalidation
+        self.lock = Lock()
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def get(self, key, loader):
+        """ Get the value of the key, load it if not cached
+
+        Empty values are not cached.
+
+        :param key: key of the value
+        :param loader: func(key) to load the value on miss
+        :return: copy of the value
+        """
+        now = time.time()
+        with self.lock:
+            item = self.data.get(key)
+            if item and item[0] > now:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(item[1])
+            self.misses += 1
+            generation = self.generation
+        value = loader(key)
+        if value and self.ttl > 0:
+            with self.lock:
+                # skip if invalidated during loading, may be stale already
+                if generation == self.generation:
+                    self.data[key] = (now + self.ttl, copy.deepcopy(value))
+                    self.data.move_to_end(key)
+                    while len(self.data) > self.max_size:
+                        self.data.popitem(last=False)
+                        self.evictions += 1
+        return value
+
+    def invalidate(self, key=None):
+        """ Drop a cached key, or all keys if not given
+
+        :param key: key to drop
+        :return: None
+        """
+        with self.lock:
+            self.generation += 1
+            if key is None:
+                self.data.clear()
+            else:
+                self.data.pop(key, None)
+
+    def stats(self):
+        """ Get the counters of the cache
+
+        :return: dict of the counters
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'name': self.name,
+                'size': len(self.data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0,
+            }
@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+from .log import log_handler, LOG_LEVEL
+from .response import json_dumps
+from .utils import CAPTURE_FILE
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+# bodies up to this size are parsed for the outcome, larger ones are lists
+OUTCOME_MAX_SIZE = 4096
+
+
+def outcome_of(data):
+    """ Get the code and cluster id from a small json response body
+
+    :param data: body bytes or str
+    :return: tuple of (code in the body, id of the data), None if unknown
+    """
+    if not data or len(data) > OUTCOME_MAX_SIZE:
+        return None, None
+    try:
+        body = json.loads(data if isinstance(data, str) else
+                          data.decode("utf-8"))
+    except ValueError:
+        return None, None
+    if not isinstance(body, dict):
+        return None, None
+    d = body.get("data")
+    return body.get("code"), d.get("id") if isinstance(d, dict) else None
+
+
+class TrafficCapture(object):
+    """ Append the api requests with their outcomes to a file, one compact
+    json line each, to be replayed by test/replay_traffic.py
+
+    Each line is written by one append, so the workers of a server can
+    share the file.
+    """
+    def __init__(self, path=CAPTURE_FILE):
+        self.path = path
+        self.lock = Lock()
+        self.fd, self.pid = None, None
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _open(self):
+        if self.fd is None or self.pid != os.getpid():  # forked
+            self.fd = os.open(self.path,
+                              os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self.pid = os.getpid()
+        return self.fd
+
+    def record(self, start, method, route, path, params, body, key, status,
+               data):
+        """ Append a request
+
+        :param start: timestamp the request came
+        :param method: http method
+        :param route: rule of the matched route, e.g., /v2/cluster/<id>
+        :param path: path of the request
+        :param params: dict of the query and form parameters
+        :param body: json body, or None
+        :param key: idempotency key, or None
+        :param status: http status of the response
+        :param data: response body to get the outcome from
+        :return: None
+        """
+        code, cluster_id = outcome_of(data)
+        record = {"t": round(start, 3), "m": method, "r": route, "p": path,
+                  "s": status, "l": round((time.time() - start) * 1000, 1)}
+        for k, v in (("q", params), ("b", body), ("k", key), ("c", code),
+                     ("i", cluster_id)):
+            if v:
+                record[k] = v
+        line = (json_dumps(record) + "\n").encode("utf-8")
+        try:
+            with self.lock:
+                os.write(self._open(), line)
+        except OSError as e:
+            logger.warning("Error to capture request %s: %s", path, e)
+
+
+traffic_capture = TrafficCapture()
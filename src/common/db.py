@@ -2,10 +2,12 @@ import os
 
 from pymongo import MongoClient
 
+from .metrics import MongoListener
+
 MONGO_URL = os.environ.get('MONGO_URL', None) or 'mongodb://mongo:27017'
 MONGO_DB = os.environ.get('MONGO_DB', None) or 'dev'
 
-mongo_client = MongoClient(MONGO_URL)
+mongo_client = MongoClient(MONGO_URL, event_listeners=[MongoListener()])
 db = mongo_client[MONGO_DB]
 
 col_host = db["host"]
@@ -0,0 +1,224 @@
+import logging
+import time
+
+from threading import Lock, Thread
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, OperationFailure, PyMongoError
+
+from .db import db
+from .log import log_handler, LOG_LEVEL
+from .utils import CHANGELOG_SIZE, FEED_RETRY_INTERVAL
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+
+class ChangeFeed(object):
+    """ Propagate document changes among the dashboard, restserver and
+    watchdog processes
+
+    Handlers publish each change of a doc into the capped `changelog`
+    collection. Every process follows the changelog with a change stream
+    when mongo supports it (replica set), otherwise tails it with a
+    tailable cursor, and dispatches the changes to local subscribers.
+    """
+    def __init__(self, col_name="changelog"):
+        self.col = db[col_name]
+        self.subscribers = []
+        self.versions = {}  # col_name -> id of its latest change
+        self.mode = ""  # 'stream' or 'tail' once started
+        self.ready = False
+        self.lock = Lock()
+        self.thread = None
+
+    def publish(self, col_name, doc_id, op="update"):
+        """ Publish a change of a doc
+
+        Local subscribers are notified at once, others by the changelog.
+
+        :param col_name: collection name of the changed doc
+        :param doc_id: id of the changed doc
+        :param op: 'insert', 'update' or 'delete'
+        :return: None
+        """
+        self._dispatch(col_name, doc_id, op)
+        try:
+            self._ensure()
+            change_id = self.col.insert_one(
+                {"col": col_name, "id": doc_id, "op": op}).inserted_id
+            self.versions[col_name] = str(change_id)
+        except PyMongoError as e:
+            logger.warning("Error to publish change of %s/%s: %s",
+                           col_name, doc_id, e)
+
+    def publish_many(self, col_name, doc_ids, op="update"):
+        """ Publish the changes of many docs by one write
+
+        :param col_name: collection name of the changed docs
+        :param doc_ids: ids of the changed docs
+        :param op: 'insert', 'update' or 'delete'
+        :return: None
+        """
+        if not doc_ids:
+            return
+        for doc_id in doc_ids:
+            self._dispatch(col_name, doc_id, op)
+        try:
+            self._ensure()
+            change_ids = self.col.insert_many(
+                [{"col": col_name, "id": doc_id, "op": op}
+                 for doc_id in doc_ids]).inserted_ids
+            self.versions[col_name] = str(change_ids[-1])
+        except PyMongoError as e:
+            logger.warning("Error to publish changes of %s: %s", col_name, e)
+
+    def subscribe(self, callback):
+        """ Register a callback for every change, starts the feed
+
+        Callbacks get op 'reset' with empty col_name when changes may be
+        missed, e.g., after reconnecting, and should drop all local state.
+
+        :param callback: func(col_name, doc_id, op)
+        :return: None
+        """
+        self.subscribers.append(callback)
+        self.start()
+
+    def version(self, col_name):
+        """ Get the version of a collection
+
+        Identical among processes once they have caught up the feed.
+
+        :param col_name: collection name
+        :return: id of the latest change, or '' if unknown
+        """
+        return self.versions.get(col_name, '')
+
+    def start(self):
+        """ Start following the changelog in background, only once
+
+        :return: None
+        """
+        with self.lock:
+            if self.thread:
+                return
+            self.thread = Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _ensure(self):
+        """ Create the capped changelog collection if not existed
+
+        :return: None
+        """
+        if self.ready:
+            return
+        try:
+            db.create_collection(self.col.name, capped=True,
+                                 size=CHANGELOG_SIZE)
+            # tailable cursor dies on empty collection
+            self.col.insert_one({"col": "", "id": "", "op": "init"})
+        except CollectionInvalid:  # existed already
+            pass
+        self.ready = True
+
+    def _load_versions(self):
+        """ Load the latest change of each collection into versions
+
+        Called once following, so changes missed before are counted.
+
+        :return: None
+        """
+        for col_name in self.col.distinct("col"):
+            if col_name:
+                change = self.col.find_one({"col": col_name},
+                                           sort=[("$natural", -1)])
+                self.versions[col_name] = str(change["_id"])
+
+    def _dispatch(self, col_name, doc_id, op):
+        """ Notify local subscribers
+
+        :param col_name: collection name of the changed doc
+        :param doc_id: id of the changed doc
+        :param op: operation type
+        :return: None
+        """
+        for callback in self.subscribers:
+            try:
+                callback(col_name, doc_id, op)
+            except Exception as e:
+                logger.warning("Error to dispatch change of %s/%s: %s",
+                               col_name, doc_id, e)
+
+    def _on_change(self, change):
+        """ Handle one changelog entry
+
+        :param change: changelog doc
+        :return: None
+        """
+        if not change.get("col"):
+            return
+        # bump the version after the caches dropped the changed doc
+        self._dispatch(change["col"], change["id"], change["op"])
+        self.versions[change["col"]] = str(change["_id"])
+
+    def _follow_stream(self):
+        """ Follow the changelog by change stream
+
+        :return: None, raise OperationFailure if not supported
+        """
+        with self.col.watch([{"$match": {"operationType": "insert"}}]) as s:
+            self.mode = "stream"
+            logger.info("Follow changes by change stream")
+            # changes may be missed before (re)connecting
+            self._dispatch("", "", "reset")
+            self._load_versions()
+            for event in s:
+                self._on_change(event["fullDocument"])
+
+    def _follow_tail(self):
+        """ Follow the changelog by tailable cursor, start from the end
+
+        Capped collection keeps the insertion order, while ids from
+        different processes may not be ordered, so skip till the last one
+        instead of filtering by id.
+
+        :return: None
+        """
+        self.mode = "tail"
+        logger.info("Follow changes by tailing %s", self.col.name)
+        last_id = self.col.find_one(sort=[("$natural", -1)])["_id"]
+        self._dispatch("", "", "reset")
+        self._load_versions()
+        caught_up = False
+        cursor = self.col.find(cursor_type=CursorType.TAILABLE_AWAIT)
+        while cursor.alive:
+            for change in cursor:
+                if caught_up:
+                    self._on_change(change)
+                elif change["_id"] == last_id:
+                    caught_up = True
+            time.sleep(FEED_RETRY_INTERVAL / 10.0)
+
+    def _run(self):
+        """ Follow the changelog forever, retry on errors
+
+        :return: None
+        """
+        while True:
+            try:
+                self._ensure()
+                if self.mode != "tail":
+                    try:
+                        self._follow_stream()
+                    except (OperationFailure, AttributeError):
+                        self._follow_tail()
+                else:
+                    self._follow_tail()
+            except PyMongoError as e:
+                logger.warning("Error to follow changes: %s", e)
+            time.sleep(FEED_RETRY_INTERVAL)
+
+
+change_feed = ChangeFeed()
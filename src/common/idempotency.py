@@ -0,0 +1,191 @@
+import datetime
+import hashlib
+import logging
+import time
+
+from threading import Lock, Thread
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from .db import db
+from .log import log_handler, LOG_LEVEL
+from .utils import IDEMPOTENCY_TTL, IDEMPOTENCY_WAIT, IDEMPOTENCY_LEASE
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+
+class IdempotencyStore(object):
+    """ Keep the first outcome of the requests by their idempotency keys
+
+    A key is claimed as running by its first request, then the outcome is
+    saved to be replayed for the duplicates until it expires after `ttl`
+    seconds. Duplicates coming while the first one still runs wait for
+    its outcome. A running key is leased to the token of its request for
+    `lease` seconds, renewed in background while the request runs, then
+    taken over by the next request once expired, so a key whose request
+    died with its worker does not block the retries until it expires. The
+    outcome is only saved by the request still owning the key. Being in
+    mongo, the keys work across the workers.
+    """
+    def __init__(self, col_name="idempotency", ttl=IDEMPOTENCY_TTL,
+                 lease=IDEMPOTENCY_LEASE):
+        self.col = db[col_name]
+        self.ttl, self.lease = ttl, lease
+        self.indexed = False
+        self.held = {}  # owner -> id of the key held by this process
+        self.lock = Lock()
+        self.thread = None
+
+    def ensure_indexes(self):
+        """ Create the index expiring the keys
+
+        :return: None
+        """
+        if self.indexed:
+            return
+        self.col.create_index([("ts", ASCENDING)],
+                              expireAfterSeconds=self.ttl)
+        self.indexed = True
+
+    @staticmethod
+    def scoped(key, *scope):
+        """ Get the id of a key within its scope, e.g., user and path, so
+        the same key from different users or apis never collides
+
+        :param key: idempotency key from the client
+        :param scope: strs of the scope
+        :return: id of the key
+        """
+        return hashlib.sha1("|".join(
+            [str(s) for s in scope] + [key]).encode("utf-8")).hexdigest()
+
+    def begin(self, key_id, owner):
+        """ Claim a key for its first request, or take it over if its lease
+        expired, then keep renewing the lease until finished or abandoned
+
+        :param key_id: id of the key
+        :param owner: unique token of the request, e.g., a uuid
+        :return: None if claimed, otherwise the doc of the key
+        """
+        self.ensure_indexes()
+        now = datetime.datetime.now()
+        lease = now + datetime.timedelta(seconds=self.lease)
+        try:
+            self.col.insert_one({"_id": key_id, "status": "running",
+                                 "owner": owner, "ts": now, "lease": lease})
+            self._hold(key_id, owner)
+            return None
+        except DuplicateKeyError:
+            pass
+        if self.col.find_one_and_update(
+                {"_id": key_id, "status": "running",
+                 "lease": {"$lt": now}},
+                {"$set": {"owner": owner, "ts": now, "lease": lease}}):
+            logger.warning("Take over idempotency key %s of expired lease",
+                           key_id)
+            self._hold(key_id, owner)
+            return None
+        return self.col.find_one({"_id": key_id}) or \
+            self.begin(key_id, owner)
+
+    def _hold(self, key_id, owner):
+        """ Renew the lease of a key claimed by this process until dropped
+
+        :param key_id: id of the key
+        :param owner: token of the request
+        :return: None
+        """
+        with self.lock:
+            self.held[owner] = key_id
+            if not self.thread:
+                self.thread = Thread(target=self._renew, daemon=True)
+                self.thread.start()
+
+    def _drop(self, owner):
+        """ Stop renewing the lease of a key
+
+        :param owner: token of the request
+        :return: None
+        """
+        with self.lock:
+            self.held.pop(owner, None)
+
+    def _renew(self):
+        """ Extend the leases of the keys held, in period, forever
+
+        :return: None
+        """
+        while True:
+            time.sleep(self.lease / 3.0)
+            with self.lock:
+                owners, key_ids = list(self.held), list(self.held.values())
+            if not owners:
+                continue
+            try:
+                self.col.update_many(
+                    {"_id": {"$in": key_ids}, "owner": {"$in": owners},
+                     "status": "running"},
+                    {"$set": {"lease": datetime.datetime.now() +
+                              datetime.timedelta(seconds=self.lease)}})
+            except Exception as e:
+                logger.warning("Error to renew idempotency leases: %s", e)
+
+    @staticmethod
+    def expired(doc):
+        """ Check if the lease of a running key expired
+
+        :param doc: doc of the key
+        :return: True or False
+        """
+        return doc.get("status") == "running" and \
+            doc.get("lease", datetime.datetime.max) < datetime.datetime.now()
+
+    def finish(self, key_id, owner, code, body):
+        """ Save the outcome of a key to replay, unless taken over
+
+        :param key_id: id of the key
+        :param owner: token of the request claiming the key
+        :param code: http status code
+        :param body: response body
+        :return: None
+        """
+        self._drop(owner)
+        self.col.update_one({"_id": key_id, "owner": owner}, {"$set": {
+            "status": "done", "code": code, "body": body,
+            "ts": datetime.datetime.now()}})
+
+    def abandon(self, key_id, owner):
+        """ Drop a key without outcome, so a retry runs again, unless taken
+        over
+
+        :param key_id: id of the key
+        :param owner: token of the request claiming the key
+        :return: None
+        """
+        self._drop(owner)
+        self.col.delete_one({"_id": key_id, "owner": owner,
+                             "status": "running"})
+
+    def wait(self, key_id, timeout=IDEMPOTENCY_WAIT):
+        """ Wait for the outcome of a key being run by another request
+
+        :param key_id: id of the key
+        :param timeout: max seconds to wait
+        :return: the doc of the key, still running if timed out, or None
+        if abandoned or its lease expired, to begin again
+        """
+        deadline, delay = time.time() + timeout, 0.05
+        while True:
+            doc = self.col.find_one({"_id": key_id})
+            if doc and self.expired(doc):
+                return None
+            if not doc or doc.get("status") == "done" or \
+                    time.time() >= deadline:
+                return doc
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+
+idempotency_store = IdempotencyStore()
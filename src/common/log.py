@@ -1,11 +1,184 @@
+import atexit
+import copy
+import datetime
+import json
 import os
 import logging
+import threading
+
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue, Full
+
+LOG_LEVEL = eval("logging." + os.environ.get("LOG_LEVEL", "INFO"))
+# text or json, json gives one structured record per line
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+# max records waiting to be written, more are dropped
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+# sample rates of the debug records by logger, e.g.,
+# "modules.cluster=0.01,common.feed=0.1" keeps 1 of 100 and 1 of 10
+LOG_SAMPLE = os.environ.get("LOG_SAMPLE", "")
+
+_context = threading.local()
+
+
+def get_log_id():
+    """ Get the request or operation id of the current thread
+
+    :return: id, or "-" if none
+    """
+    return getattr(_context, "log_id", "-")
+
+
+def set_log_id(log_id):
+    """ Tag the following records of the current thread with an id
+
+    :param log_id: request or operation id, None to clear
+    :return: None
+    """
+    _context.log_id = log_id or "-"
+
+
+class ContextFilter(logging.Filter):
+    """ Add the id of the current request or operation as `log_id`,
+    must run in the logging thread, before the records are queued
+    """
+    def filter(self, record):
+        record.log_id = get_log_id()
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """ Keep 1 of every n debug records of some loggers
+
+    Records are counted by their logger and line, so each hot-path debug
+    call is sampled on its own, while rare ones still show up.
+    """
+    def __init__(self, rates):
+        """ Init
+
+        :param rates: dict of logger name -> rate in (0, 1]
+        """
+        super(SampleFilter, self).__init__()
+        self.every = dict((name, max(1, int(round(1 / rate))))
+                          for name, rate in rates.items() if rate > 0)
+        self.counts = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        every = self.every.get(record.name)
+        if not every:
+            return True
+        key = (record.name, record.lineno)
+        n = self.counts.get(key, 0)
+        self.counts[key] = n + 1  # racy, while only the sampling drifts
+        return n % every == 0
+
+
+def parse_sample(value):
+    """ Parse the sample rates of LOG_SAMPLE
+
+    :param value: str as "name=rate,name=rate"
+    :return: dict of logger name -> rate
+    """
+    rates = {}
+    for item in value.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """ Format a record as one json line
+    """
+    def format(self, record):
+        doc = {
+            "ts": datetime.datetime.utcfromtimestamp(
+                record.created).isoformat() + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "file": "{}:{}".format(record.filename, record.lineno),
+            "func": record.funcName,
+            "id": getattr(record, "log_id", "-"),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            doc["exc"] = record.exc_text
+        return json.dumps(doc, default=str)
+
+
+class AsyncHandler(QueueHandler):
+    """ Queue the records to a thread writing them to the real handler
+
+    The message and traceback of each record are rendered by the caller,
+    as its args may change once it goes on, while the rest of formatting
+    is left to the writing thread. A full queue drops the records
+    instead of blocking the caller, counting them in `dropped`. The thread
+    is started on the first record of each process, so it also works in
+    the workers forked by gunicorn.
+    """
+    def __init__(self, handler, queue_size=LOG_QUEUE_SIZE):
+        """ Init
+
+        :param handler: handler to write the records
+        :param queue_size: max records waiting to be written
+        """
+        super(AsyncHandler, self).__init__(None)
+        self.handler = handler
+        self.queue_size = queue_size
+        self.listener = None
+        self.pid = None
+        self.dropped = 0
+        self.start_lock = threading.Lock()
+
+    def _start(self):
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = Queue(self.queue_size)
+            self.listener = QueueListener(self.queue, self.handler)
+            self.listener.start()
+            self.pid = os.getpid()
+
+    def stop(self):
+        """ Write the queued records and stop the thread
+
+        :return: None
+        """
+        if self.listener and self.pid == os.getpid():
+            self.listener.stop()
+            self.pid = None
+
+    def prepare(self, record):
+        record = copy.copy(record)  # other handlers still see the original
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            formatter = self.handler.formatter or logging.Formatter()
+            record.exc_text = formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
 
-log_handler = logging.StreamHandler()
 
 formatter = logging.Formatter("[%(asctime)s] %(levelname)s [%(name)s]"
                               " [%(filename)s:%(lineno)s %(funcName)20s()]"
-                              " - %(message)s")
-log_handler.setFormatter(formatter)
+                              " [%(log_id)s] - %(message)s")
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json"
+                            else formatter)
 
-LOG_LEVEL = eval("logging." + os.environ.get("LOG_LEVEL", "INFO"))
+log_handler = AsyncHandler(stream_handler)
+log_handler.addFilter(SampleFilter(parse_sample(LOG_SAMPLE)))
+log_handler.addFilter(ContextFilter())
+atexit.register(log_handler.stop)
@@ -0,0 +1,127 @@
+import functools
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, \
+    REGISTRY, CONTENT_TYPE_LATEST, generate_latest, start_http_server
+from prometheus_client import multiprocess
+from pymongo import monitoring
+
+# with multiple worker processes, each one writes its metrics into files
+# under this dir, and /metrics aggregates all of them
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or \
+    os.getenv("prometheus_multiproc_dir")
+
+# port to expose the metrics of processes without web server, e.g., watchdog
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+REQUEST_LATENCY = Histogram(
+    "cello_request_seconds", "Latency of the API requests",
+    ["route", "method", "status"])
+AGENT_LATENCY = Histogram(
+    "cello_agent_seconds", "Latency of the operations on the daemons",
+    ["op", "result"],
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+MONGO_LATENCY = Histogram(
+    "cello_mongo_seconds", "Latency of the mongo commands", ["command"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1))
+MONGO_FAILURES = Counter(
+    "cello_mongo_failures_total", "Failed mongo commands", ["command"])
+WATCHDOG_CYCLE = Histogram(
+    "cello_watchdog_cycle_seconds", "Duration of each watchdog check cycle",
+    buckets=(1, 2.5, 5, 10, 15, 30, 60, 120, 300))
+ADMISSION_REJECTED = Counter(
+    "cello_rejected_total", "Requests rejected by the admission control",
+    ["reason"])
+QUEUE_DEPTH = Gauge(
+    "cello_queue_depth", "Number of items waiting or running in queues",
+    ["queue"], multiprocess_mode="livesum")
+
+
+def timed(op):
+    """ Decorator to observe the latency of an agent operation
+
+    Falsy results and exceptions are observed as failures.
+
+    :param op: name of the operation
+    :return: decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start, result = time.time(), None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                AGENT_LATENCY.labels(op, "ok" if result else "fail").observe(
+                    time.time() - start)
+        return wrapper
+    return decorator
+
+
+class MongoListener(monitoring.CommandListener):
+    """ Observe the latency of each mongo command
+    """
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_LATENCY.labels(event.command_name).observe(
+            event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_LATENCY.labels(event.command_name).observe(
+            event.duration_micros / 1e6)
+        MONGO_FAILURES.labels(event.command_name).inc()
+
+
+def metrics_data():
+    """ Get the metrics of this process, or of all workers if multiprocess
+
+    :return: tuple of (body, content type)
+    """
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def instrument_app(app):
+    """ Observe the latency of each request by route, and serve /metrics
+
+    :param app: the flask app
+    :return: None
+    """
+    def before():
+        g.request_start = time.time()
+
+    def after(response):
+        start = getattr(g, "request_start", None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else "unknown"
+            REQUEST_LATENCY.labels(route, request.method,
+                                   response.status_code).observe(
+                time.time() - start)
+        return response
+
+    def metrics():
+        body, content_type = metrics_data()
+        return Response(body, content_type=content_type)
+
+    app.before_request(before)
+    app.after_request(after)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+
+def serve_metrics(port=METRICS_PORT):
+    """ Serve /metrics in a background thread, if the port is given
+
+    :param port: port to listen
+    :return: None
+    """
+    if port:
+        start_http_server(port)
@@ -0,0 +1,193 @@
+import logging
+import time
+
+from collections import OrderedDict
+from queue import Queue, Empty, Full
+from threading import Lock, Thread
+
+from .feed import change_feed
+from .log import log_handler, LOG_LEVEL
+from .response import json_dumps
+from .utils import PUSH_INTERVAL, PUSH_KEEPALIVE, PUSH_QUEUE_SIZE, \
+    PUSH_MAX_LISTENERS
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+
+class Broadcaster(object):
+    """ Push the changes of docs to many viewers, as Server-Sent Events
+
+    Changes from the change feed are coalesced for `interval` seconds,
+    then each changed doc is loaded once and its event fanned out to all
+    viewers, so the cost on mongo does not grow with the viewers. Viewers
+    falling behind by `queue_size` events get a `reset` event instead,
+    asking them to reload. At most `max_listeners` viewers are served at
+    once, as each holds a connection and a thread.
+    """
+    def __init__(self, interval=PUSH_INTERVAL, queue_size=PUSH_QUEUE_SIZE,
+                 max_listeners=PUSH_MAX_LISTENERS):
+        self.interval = interval
+        self.queue_size = queue_size
+        self.max_listeners = max_listeners
+        self.loaders = {}  # col_name -> (event name, func(id) -> data)
+        self.summaries = []  # [(event name, func() -> data)]
+        self.pending = OrderedDict()  # (col_name, id) -> op
+        self.reset = False
+        self.viewers = set()
+        self.seq = 0
+        self.lock = Lock()
+        self.thread = None
+
+    def register(self, col_name, event, loader):
+        """ Push the changes of a collection as some event
+
+        :param col_name: collection name
+        :param event: event name
+        :param loader: func(doc_id) to get the pushed data, {} if gone
+        :return: None
+        """
+        self.loaders[col_name] = (event, loader)
+
+    def summary(self, event, loader):
+        """ Push some data after each round having changes, e.g., counts
+
+        :param event: event name
+        :param loader: func() to get the pushed data
+        :return: None
+        """
+        self.summaries.append((event, loader))
+
+    def listen(self):
+        """ Add a viewer, starts the broadcasting
+
+        :return: queue of the viewer's (seq, event, data), or None if
+        max_listeners viewers are already served
+        """
+        q = Queue(self.queue_size)
+        with self.lock:
+            if 0 < self.max_listeners <= len(self.viewers):
+                logger.warning("Reject push viewer over %s",
+                               self.max_listeners)
+                return None
+            self.viewers.add(q)
+            if not self.thread:
+                change_feed.subscribe(self._on_change)
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+        return q
+
+    def close(self, q):
+        """ Remove a viewer
+
+        :param q: queue of the viewer
+        :return: None
+        """
+        with self.lock:
+            self.viewers.discard(q)
+
+    def stream(self, q, keepalive=PUSH_KEEPALIVE):
+        """ Format the events of a viewer as an event stream
+
+        :param q: queue of the viewer
+        :param keepalive: seconds between comments on idle connections
+        :return: generator of text/event-stream chunks
+        """
+        try:
+            yield "retry: {}\n\n".format(int(self.interval * 1000))
+            while True:
+                try:
+                    seq, event, data = q.get(timeout=keepalive)
+                except Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield "id: {}\nevent: {}\ndata: {}\n\n".format(
+                    seq, event, json_dumps(data))
+        finally:
+            self.close(q)
+
+    def _on_change(self, col_name, doc_id, op):
+        """ Collect a change to push in the next round
+
+        :param col_name: collection of the changed doc
+        :param doc_id: id of the changed doc
+        :param op: operation type
+        :return: None
+        """
+        with self.lock:
+            if op == "reset":
+                self.reset = True
+            elif col_name in self.loaders:
+                key = (col_name, doc_id)
+                # insert then delete in one round is still a delete
+                if self.pending.get(key) != "insert" or op == "delete":
+                    self.pending[key] = op
+
+    def _events(self, changes, reset):
+        """ Load the events of a round of changes
+
+        :param changes: list of ((col_name, doc_id), op)
+        :param reset: whether changes may have been missed
+        :return: list of (event, data)
+        """
+        if reset:
+            return [("reset", {})]
+        events = []
+        for (col_name, doc_id), op in changes:
+            event, loader = self.loaders[col_name]
+            data = loader(doc_id) if op != "delete" else {}
+            if not data:
+                op = "delete"
+            events.append((event, {"id": doc_id, "op": op, "doc": data}))
+        if events:
+            events.extend((event, loader()) for event, loader in
+                          self.summaries)
+        return events
+
+    def flush(self):
+        """ Push the collected changes to all viewers
+
+        :return: number of events pushed
+        """
+        with self.lock:
+            changes, reset = list(self.pending.items()), self.reset
+            self.pending.clear()
+            self.reset = False
+            viewers = list(self.viewers)
+        if not viewers:
+            return 0
+        events = self._events(changes, reset)
+        for event, data in events:
+            self.seq += 1
+            for q in viewers:
+                try:
+                    q.put_nowait((self.seq, event, data))
+                except Full:  # drop the backlog of the slow viewer
+                    self._drain(q)
+                    q.put_nowait((self.seq, "reset", {}))
+        return len(events)
+
+    def _drain(self, q):
+        """ Drop all queued events of a viewer
+
+        :param q: queue of the viewer
+        :return: None
+        """
+        try:
+            while True:
+                q.get_nowait()
+        except Empty:
+            pass
+
+    def _run(self):
+        """ Push the changes in rounds forever
+
+        :return: None
+        """
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Error to push changes: %s", e)
@@ -0,0 +1,58 @@
+import time
+
+from threading import Lock
+
+
+class TokenBucket(object):
+    """ Token bucket rate limiter, thread-safe
+
+    Tokens are refilled at `rate` per second, up to `burst` tokens.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = self.burst
+        self.ts = time.time()
+        self.lock = Lock()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+
+    def try_acquire(self, tokens=1):
+        """ Take tokens if available, never wait
+
+        :param tokens: number of tokens to take
+        :return: 0 if taken, otherwise seconds to wait before available
+        """
+        with self.lock:
+            self._refill(time.time())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            if self.rate <= 0:
+                return float("inf")
+            return (tokens - self.tokens) / self.rate
+
+    def refund(self, tokens=1):
+        """ Give back tokens taken for an operation that did not run
+
+        :param tokens: number of tokens to give back
+        :return: None
+        """
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + tokens)
+
+    def acquire(self, tokens=1):
+        """ Take tokens, wait until available
+
+        :param tokens: number of tokens to take
+        :return: None
+        """
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            time.sleep(min(wait, 1.0))
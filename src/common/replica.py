@@ -0,0 +1,175 @@
+import copy
+import logging
+import re
+
+from threading import Lock
+
+from .feed import change_feed
+from .log import log_handler, LOG_LEVEL
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+
+def _match_value(value, cond):
+    """ Check a doc value against a filter condition
+
+    :param value: value in the doc
+    :param cond: value or {"$op": arg} dict in the filter
+    :return: True or False, None if the condition is not supported
+    """
+    if not isinstance(cond, dict) or not cond or \
+            not all(k.startswith("$") for k in cond):
+        if isinstance(value, list) and not isinstance(cond, list):
+            return cond in value
+        return value == cond
+    for op, arg in cond.items():
+        try:
+            if op == "$ne":
+                ok = value != arg
+            elif op == "$in":
+                ok = value in arg
+            elif op == "$nin":
+                ok = value not in arg
+            elif op == "$gt":
+                ok = value is not None and value > arg
+            elif op == "$gte":
+                ok = value is not None and value >= arg
+            elif op == "$lt":
+                ok = value is not None and value < arg
+            elif op == "$lte":
+                ok = value is not None and value <= arg
+            elif op == "$exists":
+                ok = (value is not None) == bool(arg)
+            elif op == "$regex":
+                ok = isinstance(value, str) and \
+                    re.search(arg, value) is not None
+            else:
+                return None
+        except TypeError:  # not comparable, mongo does not match either
+            ok = False
+        if not ok:
+            return False
+    return True
+
+
+class Replica(object):
+    """ In-process replica of a whole collection
+
+    Bootstrapped on first read, then kept current by the change feed.
+    Writes still go to mongo, then come back by the feed.
+    """
+    def __init__(self, col, key="id"):
+        self.col = col
+        self.key = key
+        self.docs = {}  # key -> doc without _id
+        self.ready = False
+        self.loading = False
+        self.pending = set()  # keys changed during bootstrapping
+        self.lock = Lock()
+        change_feed.subscribe(self._on_change)
+
+    def get(self, key):
+        """ Get a doc by key
+
+        :param key: value of the key field
+        :return: copy of the doc, None if not found
+        """
+        self._bootstrap()
+        doc = self.docs.get(key)
+        return copy.deepcopy(doc) if doc else None
+
+    def find(self, filter_data={}):
+        """ Find docs matching the filter
+
+        Only top-level fields and simple operators are supported. The docs
+        are shared with the replica, should be treated as read-only.
+
+        :param filter_data: mongo style filter
+        :return: list of docs, None if the filter is not supported
+        """
+        for k in filter_data:
+            if k.startswith("$") or "." in k:
+                return None
+        self._bootstrap()
+        result = []
+        for doc in list(self.docs.values()):
+            matched = True
+            for k, cond in filter_data.items():
+                ok = _match_value(doc.get(k), cond)
+                if ok is None:
+                    return None
+                if not ok:
+                    matched = False
+                    break
+            if matched:
+                result.append(doc)
+        return result
+
+    def count(self, filter_data={}):
+        """ Count docs matching the filter
+
+        :param filter_data: mongo style filter
+        :return: number of docs, None if the filter is not supported
+        """
+        docs = self.find(filter_data)
+        return None if docs is None else len(docs)
+
+    def _bootstrap(self, force=False):
+        """ Load the whole collection, only once unless forced
+
+        :param force: reload even if loaded already
+        :return: None
+        """
+        if self.ready and not force:
+            return
+        with self.lock:
+            if self.ready and not force:
+                return
+            self.loading, self.pending = True, set()
+            logger.info("Bootstrap replica of %s", self.col.name)
+            docs = {}
+            for doc in self.col.find({}, {"_id": 0}):
+                if doc.get(self.key):
+                    docs[doc[self.key]] = doc
+            self.docs = docs
+            while self.pending:
+                self._refresh(self.pending.pop())
+            self.loading, self.ready = False, True
+            while self.pending:  # arrived before loading is cleared
+                self._refresh(self.pending.pop())
+
+    def _refresh(self, key):
+        """ Reload one doc from db
+
+        :param key: value of the key field
+        :return: None
+        """
+        doc = self.col.find_one({self.key: key}, {"_id": 0})
+        if doc:
+            self.docs[key] = doc
+        else:
+            self.docs.pop(key, None)
+
+    def _on_change(self, col_name, key, op):
+        """ Apply a change from the feed
+
+        :param col_name: collection of the changed doc
+        :param key: key of the changed doc
+        :param op: operation type
+        :return: None
+        """
+        if op == "reset":
+            if self.ready:
+                self._bootstrap(force=True)
+            return
+        if col_name != self.col.name:
+            return
+        if self.loading:
+            self.pending.add(key)
+        elif self.ready:
+            if op == "delete":
+                self.docs.pop(key, None)
+            else:
+                self._refresh(key)
@@ -1,4 +1,11 @@
-from flask import jsonify
+import datetime
+import json
+import math
+
+from bson import ObjectId
+from flask import Response
+
+from .utils import STREAM_MIN_ITEMS, STREAM_CHUNK_ITEMS
 
 CODE_OK = 200
 CODE_CREATED = 201
@@ -9,32 +16,98 @@ CODE_NOT_FOUND = 404
 CODE_METHOD_NOT_ALLOWED = 405
 CODE_NOT_ACCEPTABLE = 406
 CODE_CONFLICT = 409
+CODE_TOO_MANY_REQUESTS = 429
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
+           'Oct', 'Nov', 'Dec')
+
+
+def http_date(d):
+    """ Format a datetime as flask jsonify does, e.g.,
+    'Sun, 18 Oct 2026 22:07:28 GMT', naive ones taken as UTC
+
+    :param d: datetime or date
+    :return: str
+    """
+    if isinstance(d, datetime.datetime):
+        if d.tzinfo:
+            d = d.astimezone(datetime.timezone.utc)
+        hms = (d.hour, d.minute, d.second)
+    else:
+        hms = (0, 0, 0)
+    return '{}, {:02d} {} {:04d} {:02d}:{:02d}:{:02d} GMT'.format(
+        _DAYS[d.weekday()], d.day, _MONTHS[d.month - 1], d.year, *hms)
+
+
+def _default(o):
+    if isinstance(o, datetime.date):
+        return http_date(o)
+    if isinstance(o, ObjectId):
+        return str(o)
+    raise TypeError("{} is not JSON serializable".format(repr(o)))
+
+
+# compact, so the C encoder is used instead of the pure python one
+_encoder = json.JSONEncoder(default=_default, separators=(',', ':'))
+json_dumps = _encoder.encode
+
 
-response_ok = {
-    "status": "OK",
-    "code": CODE_OK,
-    "error": "",
-    "data": {}
-}
+def _stream(body):
+    """ Encode a body with a big data list in chunks
 
-response_fail = {
-    "status": "FAIL",
-    "code": CODE_BAD_REQUEST,
-    "error": "",
-    "data": {}
-}
+    :param body: dict with the list as data
+    :return: generator of str
+    """
+    head, items = dict(body), body["data"]
+    del head["data"]
+    yield json_dumps(head)[:-1] + ',"data":[' if head else '{"data":['
+    for i in range(0, len(items), STREAM_CHUNK_ITEMS):
+        chunk = ','.join(map(json_dumps, items[i:i + STREAM_CHUNK_ITEMS]))
+        yield chunk if i == 0 else ',' + chunk
+    yield ']}'
+
+
+def json_response(body, status=CODE_OK):
+    """ Make a json response, streamed if the data is a big list
+
+    :param body: dict to encode
+    :param status: http status code
+    :return: flask Response
+    """
+    data = body.get("data")
+    if isinstance(data, list) and len(data) >= STREAM_MIN_ITEMS:
+        return Response(_stream(body), status=status,
+                        mimetype='application/json')
+    return Response(json_dumps(body), status=status,
+                    mimetype='application/json')
+
+
+def ok_body(error="", data={}, code=CODE_OK):
+    return {"status": "OK", "code": code, "error": error, "data": data}
+
+
+def fail_body(error="Invalid request", data={}, code=CODE_BAD_REQUEST):
+    return {"status": "FAIL", "code": code, "error": error, "data": data}
 
 
 def make_ok_response(error="", data={}, code=CODE_OK):
-    response_ok['code'] = code
-    response_ok["error"] = error
-    response_ok["data"] = data
-    return jsonify(response_ok), CODE_OK
+    return json_response(ok_body(error, data, code)), CODE_OK
 
 
 def make_fail_response(error="Invalid request", data={},
                        code=CODE_BAD_REQUEST):
-    response_fail['code'] = code
-    response_fail["error"] = error
-    response_fail["data"] = data
-    return jsonify(response_fail), CODE_BAD_REQUEST
+    return json_response(fail_body(error, data, code)), CODE_BAD_REQUEST
+
+
+def make_retry_response(retry_after, error="Too many requests"):
+    """ Reject a request not admitted, asking to retry later
+
+    :param retry_after: seconds to wait before retrying
+    :param error: error message
+    :return: tuple of (response, status code)
+    """
+    response = json_response(fail_body(error, code=CODE_TOO_MANY_REQUESTS),
+                             CODE_TOO_MANY_REQUESTS)
+    response.headers["Retry-After"] = str(int(math.ceil(retry_after)))
+    return response, CODE_TOO_MANY_REQUESTS
@@ -0,0 +1,58 @@
+import datetime
+import time
+
+
+class Span(object):
+    """ Time the phases of an operation one after another
+
+    Each `mark` closes the running phase, so the phases add up to the
+    total time of the operation.
+    """
+    def __init__(self, op):
+        self.op = op
+        self.start_ts = datetime.datetime.now()
+        self.start = self.last = time.time()
+        self.phases = {}  # phase -> seconds
+
+    def mark(self, phase):
+        """ Close the running phase with the given name
+
+        A phase marked several times adds up.
+
+        :param phase: name of the phase
+        :return: seconds of this phase
+        """
+        now = time.time()
+        seconds = now - self.last
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+        self.last = now
+        return seconds
+
+    def to_dict(self):
+        """ Get the span to store with the cluster
+
+        :return: dict of start_ts, end_ts, total seconds and phases
+        """
+        total = self.last - self.start
+        return {
+            'start_ts': self.start_ts,
+            'end_ts': self.start_ts + datetime.timedelta(seconds=total),
+            'total': total,
+            'phases': dict(self.phases),
+        }
+
+
+def percentiles(values, ps=(50, 95, 99)):
+    """ Get the percentiles of some values, by the nearest rank
+
+    :param values: list of numbers
+    :param ps: percentiles to get
+    :return: dict of 'p<percentile>' -> value, empty if no value
+    """
+    values = sorted(values)
+    if not values:
+        return {}
+    # the nearest rank is ceil(p * n / 100)
+    return dict(('p{}'.format(p),
+                 values[max(-(-p * len(values) // 100), 1) - 1])
+                for p in ps)
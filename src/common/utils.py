@@ -1,4 +1,5 @@
 import json
+import logging
 import os
 
 
@@ -57,6 +58,131 @@ SYS_CREATOR = SYS_USER + "CREATING"
 SYS_DELETER = SYS_USER + "DELETING"
 SYS_RESETTING = SYS_USER + "RESETTING"
 
+# raw released records older than this are rolled up into daily summaries
+RELEASED_TTL_DAYS = int(os.getenv("RELEASED_TTL_DAYS", 30))
+# seconds between two released records roll-up runs
+RETENTION_CHECK_INTERVAL = int(os.getenv("RETENTION_CHECK_INTERVAL", 3600))
+
+# seconds to keep a cached host/cluster doc, 0 to disable the cache
+CACHE_TTL = float(os.getenv("CACHE_TTL", 5))
+# max number of docs in each cache
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", 10000))
+
+# seconds to keep the host/cluster stats, also dropped on changes
+STAT_CACHE_TTL = float(os.getenv("STAT_CACHE_TTL", 10))
+
+# seconds between two recounts of the pool counters
+COUNTER_SYNC_INTERVAL = int(os.getenv("COUNTER_SYNC_INTERVAL", 300))
+
+# seconds between two samples of the pool metrics
+SERIES_INTERVAL = int(os.getenv("SERIES_INTERVAL", 5))
+# seconds to keep the raw, per minute and per hour pool metrics
+SERIES_RAW_TTL = int(os.getenv("SERIES_RAW_TTL", 2 * 3600))
+SERIES_MINUTE_TTL = int(os.getenv("SERIES_MINUTE_TTL", 7 * 86400))
+SERIES_HOUR_TTL = int(os.getenv("SERIES_HOUR_TTL", 365 * 86400))
+
+# hours of cluster operations to count into the phase latency percentiles
+SPAN_WINDOW = int(os.getenv("SPAN_WINDOW", 24))
+
+# share of the host memory to fill with clusters
+CAPACITY_MEM_RATIO = float(os.getenv("CAPACITY_MEM_RATIO", 0.8))
+# cpu overcommit ratio, chains are mostly idle
+CAPACITY_CPU_RATIO = float(os.getenv("CAPACITY_CPU_RATIO", 4.0))
+# default footprint of each peer node until learned, bytes and cores
+CAPACITY_NODE_MEM = int(os.getenv("CAPACITY_NODE_MEM", 256 * 1024 * 1024))
+CAPACITY_NODE_CPU = float(os.getenv("CAPACITY_NODE_CPU", 0.1))
+# number of clusters of each host to sample stats of, picked at random on
+# each capacity check
+CAPACITY_SAMPLES = int(os.getenv("CAPACITY_SAMPLES", 1))
+# seconds between two capacity checks of the hosts
+CAPACITY_CHECK_INTERVAL = int(os.getenv("CAPACITY_CHECK_INTERVAL", 300))
+# no more clusters than the port range can hold
+CAPACITY_MAX = int((65535 - CLUSTER_PORT_START) / CLUSTER_PORT_STEP)
+
+# placement strategy for new clusters, first one is the default one
+SCHEDULER_STRATEGIES = ['least_loaded', 'bin_packing', 'spread']
+SCHEDULER_STRATEGY = os.getenv("SCHEDULER_STRATEGY", SCHEDULER_STRATEGIES[0])
+# score bonus for hosts having the images of the cluster profile
+SCHEDULER_WARM_BONUS = float(os.getenv("SCHEDULER_WARM_BONUS", 0.1))
+# score penalty for each recent creation failure on the host
+SCHEDULER_FAIL_PENALTY = float(os.getenv("SCHEDULER_FAIL_PENALTY", 0.2))
+# seconds for a creation failure to count half
+SCHEDULER_FAIL_HALF_LIFE = float(os.getenv("SCHEDULER_FAIL_HALF_LIFE", 600))
+
+# default max cluster operations running together on one daemon
+FILLUP_CONCURRENCY = int(os.getenv("FILLUP_CONCURRENCY", 4))
+# default max cluster operations started on one daemon per second
+FILLUP_RATE = float(os.getenv("FILLUP_RATE", 1))
+# seconds without progress for a running job to be taken as lost
+JOB_STALE_TIMEOUT = int(os.getenv("JOB_STALE_TIMEOUT", 600))
+
+# minutes of apply history to forecast the demand of each cluster profile
+DEMAND_WINDOW = int(os.getenv("DEMAND_WINDOW", 60))
+# minutes for an apply to count half in the forecast
+DEMAND_HALF_LIFE = float(os.getenv("DEMAND_HALF_LIFE", 15))
+# applies assumed for every profile, keeps some of each in the pool
+DEMAND_PRIOR = float(os.getenv("DEMAND_PRIOR", 1))
+
+# keep an in-process replica of hosts and active clusters for reading
+POOL_REPLICA = os.getenv("POOL_REPLICA", "false") == "true"
+
+# bytes of the capped changelog collection to propagate changes
+CHANGELOG_SIZE = int(os.getenv("CHANGELOG_SIZE", 16 * 1024 * 1024))
+# seconds to wait before re-following the changelog after errors
+FEED_RETRY_INTERVAL = float(os.getenv("FEED_RETRY_INTERVAL", 1))
+
+# seconds to coalesce the changes before pushing them to the dashboards
+PUSH_INTERVAL = float(os.getenv("PUSH_INTERVAL", 1))
+# seconds between two keepalives on idle push connections
+PUSH_KEEPALIVE = float(os.getenv("PUSH_KEEPALIVE", 15))
+# max events queued for a slow viewer before asking it to reload
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", 1000))
+# max push connections open in each process, each holding a thread, keep it
+# below the threads of the worker, 0 for no limit
+PUSH_MAX_LISTENERS = int(os.getenv("PUSH_MAX_LISTENERS", 100))
+
+# bytes of the smallest response body to compress
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+# gzip/deflate level, 1 (fastest) to 9 (smallest)
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", 6))
+
+# threads of the async restserver for operations on the daemons
+AIO_AGENT_WORKERS = int(os.getenv("AIO_AGENT_WORKERS", 32))
+# threads of the async restserver for the blocking db bookkeeping
+AIO_DB_WORKERS = int(os.getenv("AIO_DB_WORKERS", 8))
+
+# lists in responses with this many items are encoded in streaming chunks
+STREAM_MIN_ITEMS = int(os.getenv("STREAM_MIN_ITEMS", 1000))
+# items encoded in each chunk
+STREAM_CHUNK_ITEMS = int(os.getenv("STREAM_CHUNK_ITEMS", 500))
+
+# cluster operations admitted per second in each process, 0 for no limit
+ADMIT_RATE = float(os.getenv("ADMIT_RATE", 200))
+# cluster operations admitted at once in each process
+ADMIT_BURST = int(os.getenv("ADMIT_BURST", 400))
+# cluster operations admitted per second for each user, 0 for no limit
+ADMIT_USER_RATE = float(os.getenv("ADMIT_USER_RATE", 5))
+# cluster operations admitted at once for each user
+ADMIT_USER_BURST = int(os.getenv("ADMIT_USER_BURST", 10))
+# max cluster operations in flight in each process, 0 for no limit
+ADMIT_CONCURRENCY = int(os.getenv("ADMIT_CONCURRENCY", 64))
+# max users to keep the buckets of, the least recent ones are dropped
+ADMIT_MAX_USERS = int(os.getenv("ADMIT_MAX_USERS", 10000))
+
+# max entries of a batch apply
+APPLY_BATCH_MAX = int(os.getenv("APPLY_BATCH_MAX", 1000))
+
+# seconds to keep the outcome of a request to replay for its idempotency key
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 24 * 3600))
+# max seconds for a duplicate request to wait for the running original
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", 30))
+# seconds a running key is held by its request, renewed while it runs, then
+# taken over by a retry, e.g., when the worker running it was killed
+IDEMPOTENCY_LEASE = float(os.getenv("IDEMPOTENCY_LEASE", 120))
+
+# file to append the v2 requests to, to replay them, empty to not capture
+CAPTURE_FILE = os.getenv("CAPTURE_FILE", "")
+
 
 def json_decode(jsonstr):
     try:
@@ -68,16 +194,18 @@ def json_decode(jsonstr):
 
 
 def request_debug(request, logger):
-    logger.debug("path={}, method={}".format(request.path, request.method))
-    logger.debug("request args:")
-    for k in request.args:
-        logger.debug("Arg: {0}:{1}".format(k, request.args[k]))
-    logger.debug("request form:")
-    for k in request.form:
-        logger.debug("Form: {0}:{1}".format(k, request.form[k]))
-    logger.debug("request raw body data:")
-    logger.debug(request.data)
-    logger.debug(request.get_json(force=True, silent=True))
+    """ Log the request in one debug record, nothing is read or formatted
+    unless the logger is at debug
+
+    :param request: the flask request
+    :param logger: logger of the caller
+    :return: None
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug("path=%s, method=%s, args=%s, form=%s, body=%r",
+                 request.path, request.method, request.args.to_dict(),
+                 request.form.to_dict(), request.get_data())
 
 
 def request_get(request, key, default_value=None):
@@ -0,0 +1,268 @@
+import calendar
+import functools
+import gzip
+import hashlib
+import time
+import uuid
+import zlib
+
+from bson import ObjectId
+from flask import Response, g, make_response, request
+from werkzeug.http import http_date
+
+from .capture import OUTCOME_MAX_SIZE
+from .feed import change_feed
+from .log import set_log_id, get_log_id
+from .response import make_retry_response, make_fail_response, \
+    CODE_CONFLICT, CODE_TOO_MANY_REQUESTS
+from .utils import COMPRESS_MIN_SIZE, COMPRESS_LEVEL, request_get
+
+
+def cache_validators(col_names, full_path):
+    """ Get the ETag and Last-Modified of a request from the versions of
+    the collections it reads
+
+    :param col_names: collection names
+    :param full_path: path and query string of the request
+    :return: tuple of (etag, last modified timestamp), or None if some
+    version is unknown
+    """
+    versions = [change_feed.version(name) for name in col_names]
+    if not all(versions):
+        return None
+    key = "|".join(versions + [full_path])
+    etag = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    last_modified = max(calendar.timegm(
+        ObjectId(v).generation_time.utctimetuple()) for v in versions)
+    return etag, last_modified
+
+
+def _not_modified(etag, last_modified):
+    """ Check the conditional headers of the request
+
+    If-Modified-Since only counts once the last change is a second old,
+    as later changes within the same second share the same time.
+
+    :param etag: current etag
+    :param last_modified: current last modified timestamp
+    :return: True if the client has the current version
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    return bool(since) and last_modified < int(time.time()) and \
+        last_modified <= calendar.timegm(since.utctimetuple())
+
+
+def conditional(col_names):
+    """ Decorator to answer conditional GETs with 304 Not Modified while
+    the collections read by the view are unchanged
+
+    The view is not run for the 304, so idle polling costs little.
+
+    :param col_names: collection names, or func(request) to get them, empty
+    to skip
+    :return: decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            names = col_names(request) if callable(col_names) else col_names
+            validators = None
+            if names and request.method in ("GET", "HEAD"):
+                validators = cache_validators(names, request.full_path)
+            if not validators:
+                return func(*args, **kwargs)
+            etag, last_modified = validators
+            if _not_modified(etag, last_modified):
+                response = Response(status=304)
+            else:
+                response = make_response(func(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.headers["Last-Modified"] = http_date(last_modified)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        return wrapper
+    return decorator
+
+
+def admitted(admission, user_of):
+    """ Decorator to reject the requests not admitted, by 429 with a
+    Retry-After header
+
+    :param admission: Admission of the requests
+    :param user_of: func(request) to get the user of the request
+    :return: decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            retry_after = admission.enter(user_of(request))
+            if retry_after:
+                return make_retry_response(retry_after)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                admission.leave()
+        return wrapper
+    return decorator
+
+
+def request_key(r):
+    """ Get the idempotency key of a request, from the Idempotency-Key
+    header or the idempotency_key parameter
+
+    :param r: the request
+    :return: key, or None
+    """
+    return r.headers.get("Idempotency-Key") or \
+        request_get(r, "idempotency_key")
+
+
+def _replay(doc):
+    response = Response(doc.get("body"), status=doc.get("code"),
+                        mimetype="application/json")
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(store, scope_of):
+    """ Decorator to run a request once for its idempotency key, and
+    replay the first outcome for the duplicates
+
+    Requests without key always run. Rejected or failed runs (429, 5xx or
+    exceptions) are not kept, so their retries run again.
+
+    :param store: IdempotencyStore
+    :param scope_of: func(request) to get the scope of the key, e.g., the
+    user and action, as a tuple
+    :return: decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = request_key(request)
+            if not key:
+                return func(*args, **kwargs)
+            key_id = store.scoped(key, request.path, *scope_of(request))
+            owner = uuid.uuid4().hex
+            doc = store.begin(key_id, owner)
+            if doc and doc.get("status") == "running":
+                doc = store.wait(key_id) or store.begin(key_id, owner)
+            if doc:
+                if doc.get("status") == "done":
+                    return _replay(doc)
+                return make_fail_response(
+                    "Request with the same key is still running",
+                    code=CODE_CONFLICT)
+            try:
+                response = make_response(func(*args, **kwargs))
+            except Exception:
+                store.abandon(key_id, owner)
+                raise
+            code = response.status_code
+            if code == CODE_TOO_MANY_REQUESTS or code >= 500:
+                store.abandon(key_id, owner)
+            else:
+                store.finish(key_id, owner, code,
+                             response.get_data(as_text=True))
+            return response
+        return wrapper
+    return decorator
+
+
+def _compress(response):
+    """ Compress large response bodies by gzip or deflate, as accepted
+
+    :param response: the response
+    :return: the response
+    """
+    if response.status_code != 200 or response.direct_passthrough or \
+            response.is_streamed or "Content-Encoding" in response.headers:
+        return response
+    accepted = request.accept_encodings
+    encoding = next((e for e in ("gzip", "deflate") if accepted[e]), None)
+    response.vary.add("Accept-Encoding")
+    if not encoding or response.content_length is None or \
+            response.content_length < COMPRESS_MIN_SIZE:
+        return response
+    data = response.get_data()
+    if encoding == "gzip":
+        data = gzip.compress(data, COMPRESS_LEVEL)
+    else:
+        data = zlib.compress(data, COMPRESS_LEVEL)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def compress_app(app):
+    """ Compress the large responses of the app
+
+    :param app: the flask app
+    :return: None
+    """
+    app.after_request(_compress)
+
+
+def _begin_trace():
+    set_log_id(request.headers.get("X-Request-Id") or uuid.uuid4().hex[:16])
+
+
+def _end_trace(response):
+    response.headers["X-Request-Id"] = get_log_id()
+    return response
+
+
+def trace_app(app):
+    """ Tag the log records of each request with its id, from the
+    X-Request-Id header or a new one, and return it in the same header
+
+    :param app: the flask app
+    :return: None
+    """
+    app.before_request(_begin_trace)
+    app.after_request(_end_trace)
+    app.teardown_request(lambda e: set_log_id(None))
+
+
+def capture_app(app, capture, prefix="/v2/"):
+    """ Capture the requests of the app under a path prefix with their
+    outcomes, if the capture is enabled
+
+    Call it after the other hooks changing the responses, e.g.,
+    compress_app, so the outcomes are read before them.
+
+    :param app: the flask app
+    :param capture: TrafficCapture
+    :param prefix: path prefix of the requests to capture
+    :return: None
+    """
+    if not capture.enabled:
+        return
+
+    def before():
+        if request.path.startswith(prefix):
+            g.capture_start = time.time()
+
+    def after(response):
+        start = getattr(g, "capture_start", None)
+        if start is None:
+            return response
+        params = dict(request.args.items())
+        params.update(request.form.items())
+        data = None
+        if not response.is_streamed and \
+                (response.content_length or 0) <= OUTCOME_MAX_SIZE:
+            data = response.get_data()
+        capture.record(
+            start, request.method,
+            request.url_rule.rule if request.url_rule else "", request.path,
+            params, request.get_json(silent=True) if request.is_json
+            else None, request_key(request), response.status_code, data)
+        return response
+
+    app.before_request(before)
+    app.after_request(after)
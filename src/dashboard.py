@@ -1,10 +1,11 @@
 import os
-from common import log_handler, LOG_LEVEL
+from common import log_handler, LOG_LEVEL, instrument_app, compress_app, \
+    trace_app
 from flask import Flask, render_template
 from resources import bp_index, \
     bp_stat_view, bp_stat_api, \
     bp_cluster_view, bp_cluster_api, \
-    bp_host_view, bp_host_api
+    bp_host_view, bp_host_api, bp_push_api
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
@@ -21,6 +22,10 @@ app.register_blueprint(bp_cluster_view)
 app.register_blueprint(bp_cluster_api)
 app.register_blueprint(bp_stat_view)
 app.register_blueprint(bp_stat_api)
+app.register_blueprint(bp_push_api)
+instrument_app(app)
+compress_app(app)
+trace_app(app)
 
 
 @app.errorhandler(404)
@@ -0,0 +1,14 @@
+# Gunicorn settings for the product deployment, e.g.,
+# gunicorn -c gunicorn_config.py -w 128 -b 0.0.0.0:80 restserver:app
+# Set `prometheus_multiproc_dir` to an empty dir to aggregate the metrics of
+# all workers at /metrics.
+# The dashboard keeps a connection open for each page following the pushed
+# changes at /api/events, holding a thread, so run it with threads, e.g.,
+# --threads 32 with PUSH_MAX_LISTENERS below that, or gevent workers, e.g.,
+# -k gevent; the sync workers would be all taken by a few open pages.
+
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,3 +1,10 @@
 from .cluster import cluster_handler
 from .host import host_handler
 from .stat import stat_handler
+from .scheduler import host_scheduler
+from .capacity import capacity_handler
+from .retention import retention_handler
+from .job import job_handler
+from .demand import demand_handler
+from .counter import counter_handler
+from .series import series_handler
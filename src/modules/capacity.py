@@ -0,0 +1,151 @@
+import datetime
+import logging
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from common import db, log_handler, LOG_LEVEL, \
+    CAPACITY_MEM_RATIO, CAPACITY_CPU_RATIO, CAPACITY_NODE_MEM, \
+    CAPACITY_NODE_CPU, CAPACITY_SAMPLES, CAPACITY_MAX
+
+from agent import get_daemon_resources, get_project_usage
+
+from modules import cluster, host
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+# weight of the newest sample in the learned footprint
+FOOTPRINT_ALPHA = 0.2
+
+
+def profile_key(consensus_plugin, consensus_mode, size):
+    """ Get the key of a cluster profile
+
+    :return: e.g., 'pbft/batch/4'
+    """
+    return "{}/{}/{}".format(consensus_plugin, consensus_mode, size)
+
+
+class CapacityHandler(object):
+    """ Compute the effective capacity of the hosts by their resources
+
+    The daemon resources are collected by the watchdog, the footprint of
+    each cluster profile is learned from the container stats, then the
+    effective capacity is how many average clusters fit in the budget.
+    """
+    def __init__(self):
+        self.col = db["profile_footprint"]
+
+    def observe(self, host_id):
+        """ Collect the resources of a host, learn the footprints from
+        CAPACITY_SAMPLES of its clusters picked at random, and update its
+        effective capacity.
+
+        :param host_id: id of the host
+        :return: the effective capacity, or 0 if unknown
+        """
+        h = host.host_handler.get_by_id(host_id)
+        if not h:
+            return 0
+        resources = get_daemon_resources(h.get("daemon_url"))
+        if not resources:
+            logger.warning("Cannot get resources of host %s", host_id)
+            return 0
+        resources["ts"] = datetime.datetime.now()
+
+        clusters = cluster.cluster_handler.list(
+            filter_data={"host_id": host_id, "status": "running"})
+        samples = random.sample(clusters, min(CAPACITY_SAMPLES,
+                                              len(clusters)))
+        for c in samples:
+            usage = get_project_usage(h.get("daemon_url"), c.get("id"))
+            if usage:
+                self.learn(c, usage)
+
+        capacity = self.compute(resources, clusters)
+        host.host_handler.db_set_by_id(host_id, resources=resources,
+                                       effective_capacity=capacity)
+        logger.debug("Host %s resources=%s, effective capacity=%s",
+                     host_id, resources, capacity)
+        return capacity
+
+    def learn(self, c, usage):
+        """ Blend a usage sample into the footprint of the cluster profile
+
+        :param c: serialized cluster
+        :param usage: dict of mem and cpu used by the cluster
+        :return: None
+        """
+        key = profile_key(c.get("consensus_plugin"),
+                          c.get("consensus_mode"), c.get("size"))
+        fp = self.col.find_one({"_id": key})
+        if fp:
+            mem = (1 - FOOTPRINT_ALPHA) * fp["mem"] + \
+                FOOTPRINT_ALPHA * usage["mem"]
+            cpu = (1 - FOOTPRINT_ALPHA) * fp["cpu"] + \
+                FOOTPRINT_ALPHA * usage["cpu"]
+        else:
+            mem, cpu = usage["mem"], usage["cpu"]
+        self.col.update_one({"_id": key},
+                            {"$set": {"mem": mem, "cpu": cpu},
+                             "$inc": {"samples": 1}}, upsert=True)
+
+    def footprint(self, consensus_plugin, consensus_mode, size,
+                  footprints=None):
+        """ Get the footprint of a cluster profile
+
+        Use the default per node values until learned.
+
+        :param footprints: dict of loaded footprints, loaded if not given
+        :return: tuple of (mem, cpu)
+        """
+        if footprints is None:
+            footprints = self.footprints()
+        fp = footprints.get(profile_key(consensus_plugin, consensus_mode,
+                                        size))
+        if fp:
+            return fp["mem"], fp["cpu"]
+        size = size or 1
+        return CAPACITY_NODE_MEM * size, CAPACITY_NODE_CPU * size
+
+    def footprints(self):
+        """ Load all learned footprints
+
+        :return: dict of profile key -> footprint doc
+        """
+        return dict((fp["_id"], fp) for fp in self.col.find())
+
+    def compute(self, resources, clusters):
+        """ Compute how many clusters fit in the resource budget
+
+        The average footprint of the clusters on the host is used, or of
+        all learned profiles for an empty host.
+
+        :param resources: dict of cpus and mem_total
+        :param clusters: serialized clusters on the host
+        :return: effective capacity
+        """
+        footprints = self.footprints()
+        if clusters:
+            fps = [self.footprint(c.get("consensus_plugin"),
+                                  c.get("consensus_mode"), c.get("size"),
+                                  footprints) for c in clusters]
+        else:
+            fps = [(fp["mem"], fp["cpu"]) for fp in footprints.values()] or \
+                [self.footprint("", "", 4, footprints)]
+        mem = sum(fp[0] for fp in fps) / len(fps)
+        cpu = sum(fp[1] for fp in fps) / len(fps)
+        mem_budget = resources.get("mem_total", 0) * CAPACITY_MEM_RATIO
+        cpu_budget = resources.get("cpus", 0) * CAPACITY_CPU_RATIO
+        limits = [CAPACITY_MAX]
+        if mem > 0:
+            limits.append(mem_budget / mem)
+        if cpu > 0:
+            limits.append(cpu_budget / cpu)
+        return int(min(limits))
+
+
+capacity_handler = CapacityHandler()
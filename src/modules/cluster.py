@@ -6,10 +6,12 @@ import sys
 import time
 
 from threading import Thread
+from pymongo import UpdateOne
 from pymongo.collection import ReturnDocument
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
-from common import db, log_handler, LOG_LEVEL
+from common import db, log_handler, LOG_LEVEL, DocCache, Replica, \
+    change_feed, POOL_REPLICA, Span
 
 from agent import get_swarm_node_ip, \
     compose_up, compose_clean, compose_start, compose_stop, compose_restart
@@ -18,7 +20,7 @@ from common import CLUSTER_PORT_START, CLUSTER_PORT_STEP, CONSENSUS_PLUGINS, \
     CONSENSUS_MODES, HOST_TYPES, SYS_CREATOR, SYS_DELETER, SYS_USER, \
     SYS_RESETTING, CLUSTER_SIZES, PEER_SERVICE_PORTS, CA_SERVICE_PORTS
 
-from modules import host
+from modules import counter, demand, host, scheduler
 
 logger = logging.getLogger(__name__)
 logger.setLevel(LOG_LEVEL)
@@ -33,6 +35,9 @@ class ClusterHandler(object):
         self.col_active = db["cluster_active"]
         self.col_released = db["cluster_released"]
         self.host_handler = host.host_handler
+        self.cache = DocCache(self.col_active.name)
+        self.replica = Replica(self.col_active) if POOL_REPLICA else None
+        change_feed.subscribe(self._on_change)
 
     def list(self, filter_data={}, col_name="active"):
         """ List clusters with given criteria
@@ -44,8 +49,8 @@ class ClusterHandler(object):
         result = []
         if col_name == "active":
             logger.debug("List all active clusters")
-            result = list(map(self._serialize, self.col_active.find(
-                filter_data)))
+            result = list(map(self._serialize,
+                              self._find_active(filter_data)))
         elif col_name == "released":
             logger.debug("List all released clusters")
             result = list(map(self._serialize, self.col_released.find(
@@ -54,6 +59,23 @@ class ClusterHandler(object):
             logger.warning("Unknown cluster col_name=" + col_name)
         return result
 
+    def count(self, filter_data={}, col_name="active"):
+        """ Count clusters with given criteria, without loading them
+
+        :param filter_data: Image with the filter properties
+        :param col_name: Use data in which col_name
+        :return: number of matched docs
+        """
+        if col_name == "active":
+            n = self.replica.count(filter_data) if self.replica else None
+            if n is None:
+                n = self.col_active.count_documents(filter_data)
+            return n
+        elif col_name == "released":
+            return self.col_released.count_documents(filter_data)
+        logger.warning("Unknown cluster col_name=" + col_name)
+        return 0
+
     def get_by_id(self, id, col_name="active"):
         """ Get a cluster for the external request
 
@@ -63,18 +85,40 @@ class ClusterHandler(object):
         """
         if col_name != "released":
             # logger.debug("Get a cluster with id=" + id)
-            cluster = self.col_active.find_one({"id": id})
+            if self.replica:
+                cluster = self._serialize(self.replica.get(id))
+            else:
+                cluster = self.cache.get(id, self._load_by_id)
         else:
             # logger.debug("Get a released cluster with id=" + id)
-            cluster = self.col_released.find_one({"id": id})
+            cluster = self._serialize(self.col_released.find_one({"id": id}))
         if not cluster:
             logger.warning("No cluster found with id=" + id)
-            return {}
-        return self._serialize(cluster)
+        return cluster
+
+    def _load_by_id(self, id):
+        """ Load an active cluster from db
+
+        :param id: id of the doc
+        :return: serialized result or {}
+        """
+        return self._serialize(self.col_active.find_one({"id": id}))
+
+    def _find_active(self, filter_data):
+        """ Find active cluster docs from the replica or the db
+
+        :param filter_data: filter of the docs
+        :return: iteration of raw docs
+        """
+        docs = self.replica.find(filter_data) if self.replica else None
+        if docs is None:
+            docs = self.col_active.find(filter_data)
+        return docs
 
     def create(self, name, host_id, start_port=0, user_id="",
                consensus_plugin=CONSENSUS_PLUGINS[0],
-               consensus_mode=CONSENSUS_MODES[0], size=CLUSTER_SIZES[0]):
+               consensus_mode=CONSENSUS_MODES[0], size=CLUSTER_SIZES[0],
+               span=None):
         """ Create a cluster based on given data
 
         TODO: maybe need other id generation mechanism
@@ -86,22 +130,25 @@ class ClusterHandler(object):
         :param user_id: user_id of the cluster if start to be applied
         :param consensus_plugin: type of the consensus type
         :param size: size of the cluster, int type
+        :param span: Span to time the phases into, saved with the cluster
         :return: Id of the created cluster or None
         """
-        logger.info("Create cluster {}, host_id={}, consensus={}/{}, "
-                    "size={}".format(name, host_id, consensus_plugin,
-                                     consensus_mode, size))
+        logger.info("Create cluster %s, host_id=%s, consensus=%s/%s, "
+                    "size=%s", name, host_id, consensus_plugin,
+                    consensus_mode, size)
+        span = span or Span("create")
 
         h = self.host_handler.get_active_host_by_id(host_id)
         if not h:
             return None
 
-        if len(h.get("clusters")) >= h.get("capacity"):
-            logger.warning("host {} is full already".format(host_id))
+        if len(h.get("clusters")) >= self.host_handler.capacity_of(h):
+            logger.warning("host %s is full already", host_id)
             return None
+        span.mark("host_check")
 
         daemon_url = h.get("daemon_url")
-        logger.debug("daemon_url={}".format(daemon_url))
+        logger.debug("daemon_url=%s", daemon_url)
 
         if start_port <= 0:
             ports = self.find_free_start_ports(host_id, 1)
@@ -109,6 +156,7 @@ class ClusterHandler(object):
                 logger.warning("No free port is found")
                 return None
             start_port = ports[0]
+        span.mark("port_search")
 
         peer_mapped_ports, ca_mapped_ports, mapped_ports = {}, {}, {}
         for k, v in PEER_SERVICE_PORTS.items():
@@ -136,31 +184,40 @@ class ClusterHandler(object):
             'size': size,
             'containers': [],
             'status': 'running',
-            'health': ''
+            'health': '',
+            'spans': {}
         }
         uuid = self.col_active.insert_one(c).inserted_id  # object type
         cid = str(uuid)
         self.col_active.update_one({"_id": uuid}, {"$set": {"id": cid}})
+        change_feed.publish(self.col_active.name, cid, "insert")
+        counter.counter_handler.add(c)
         # try to add one cluster to host
         h = self.host_handler.db_update_one(
             {"id": host_id}, {"$addToSet": {"clusters": cid}})
-        if not h or len(h.get("clusters")) > h.get("capacity"):
+        if not h or \
+                len(h.get("clusters")) > self.host_handler.capacity_of(h):
             self.col_active.delete_one({"id": cid})
+            change_feed.publish(self.col_active.name, cid, "delete")
+            counter.counter_handler.add(c, -1)
             self.host_handler.db_update_one({"id": host_id},
                                             {"$pull": {"clusters": cid}})
             return None
+        span.mark("db_insert")
 
         # from now on, we should be safe
 
         # start compose project, failed then clean and return
-        logger.debug("Start compose project with name={}".format(cid))
+        logger.debug("Start compose project with name=%s", cid)
         containers = compose_up(
             name=cid, mapped_ports=mapped_ports, host=h,
             consensus_plugin=consensus_plugin, consensus_mode=consensus_mode,
-            cluster_size=size)
+            cluster_size=size, span=span)
+        profile = (consensus_plugin, consensus_mode, size)
         if not containers or len(containers) != size:
-            logger.warning("failed containers={}, then delete cluster".format(
-                containers))
+            logger.warning("failed containers=%s, then delete cluster",
+                           containers)
+            scheduler.host_scheduler.record_result(host_id, profile, False)
             self.delete(id=cid, record=False, forced=True)
             return None
 
@@ -169,8 +226,11 @@ class ClusterHandler(object):
         # no api_url, then clean and return
         if not peer_host_ip:  # not valid api_url
             logger.error("Error to find peer host url, cleanup")
+            scheduler.host_scheduler.record_result(host_id, profile, False)
             self.delete(id=cid, record=False, forced=True)
             return None
+        span.mark("service_ip")
+        scheduler.host_scheduler.record_result(host_id, profile, True)
 
         service_urls = {}
         for k, v in peer_mapped_ports.items():
@@ -179,12 +239,14 @@ class ClusterHandler(object):
         for k, v in ca_mapped_ports.items():
             service_urls[k] = "{}:{}".format(ca_host_ip, v)
 
-        # update api_url, container, and user_id field
+        # update api_url, container, and user_id field, the health phase
+        # is added once the chain turns healthy
         self.db_update_one(
             {"id": cid},
             {"$set": {"containers": containers, "user_id": user_id,
                       'api_url': service_urls['rest'],
-                      'service_url': service_urls}})
+                      'service_url': service_urls,
+                      'spans.' + span.op: span.to_dict()}})
 
         def check_health_work(cid):
             time.sleep(5)
@@ -192,10 +254,10 @@ class ClusterHandler(object):
         t = Thread(target=check_health_work, args=(cid,))
         t.start()
 
-        logger.info("Create cluster OK, id={}".format(cid))
+        logger.info("Create cluster OK, id=%s", cid)
         return cid
 
-    def delete(self, id, record=False, forced=False):
+    def delete(self, id, record=False, forced=False, span=None):
         """ Delete a cluster instance
 
         Clean containers, remove db entry. Only operate on active host.
@@ -203,60 +265,69 @@ class ClusterHandler(object):
         :param id: id of the cluster to delete
         :param record: Whether to record into the released collections
         :param forced: Whether to removing user-using cluster, for release
+        :param span: Span to time the phases into, saved with the record
         :return:
         """
-        logger.debug("Delete cluster: id={}, forced={}".format(id, forced))
+        logger.debug("Delete cluster: id=%s, forced=%s", id, forced)
+        span = span or Span("delete")
 
         c = self.db_update_one({"id": id}, {"$set": {"user_id": SYS_DELETER}},
                                after=False)
         if not c:
-            logger.warning("Cannot find cluster {}".format(id))
+            logger.warning("Cannot find cluster %s", id)
             return False
         # we are safe from occasional applying now
         user_id = c.get("user_id")  # original user_id
         if not forced and user_id != "" and not user_id.startswith(SYS_USER):
             # not forced, and chain is used by normal user, then no process
-            logger.warning("Cannot delete cluster {} by "
-                           "user {}".format(id, user_id))
-            self.col_active.update_one({"id": id},
-                                       {"$set": {"user_id": user_id}})
+            logger.warning("Cannot delete cluster %s by user %s", id,
+                           user_id)
+            self.db_update_one({"id": id}, {"$set": {"user_id": user_id}})
             return False
 
         #  0. forced
         #  1. user_id == SYS_DELETER or ""
         #  Then, add deleting flag to the db, and start deleting
         if not user_id.startswith(SYS_DELETER):
-            self.col_active.update_one(
+            self.db_update_one(
                 {"id": id},
                 {"$set": {"user_id": SYS_DELETER + user_id}})
+        span.mark("db_claim")
         host_id, daemon_url, consensus_plugin = \
             c.get("host_id"), c.get("daemon_url"), \
             c.get("consensus_plugin", CONSENSUS_PLUGINS[0])
         # port = api_url.split(":")[-1] or CLUSTER_PORT_START
 
         if not self.host_handler.get_active_host_by_id(host_id):
-            logger.warning("Host {} inactive".format(host_id))
-            self.col_active.update_one({"id": id},
-                                       {"$set": {"user_id": user_id}})
+            logger.warning("Host %s inactive", host_id)
+            self.db_update_one({"id": id}, {"$set": {"user_id": user_id}})
             return False
+        span.mark("host_check")
 
         if not compose_clean(id, daemon_url, consensus_plugin):
             logger.warning("Error to run compose clean work")
-            self.col_active.update_one({"id": id},
-                                       {"$set": {"user_id": user_id}})
+            self.db_update_one({"id": id}, {"$set": {"user_id": user_id}})
             return False
+        span.mark("compose_clean")
 
         self.host_handler.db_update_one({"id": c.get("host_id")},
                                         {"$pull": {"clusters": id}})
-        self.col_active.delete_one({"id": id})
+        doc = self.col_active.find_one_and_delete({"id": id})
+        change_feed.publish(self.col_active.name, id, "delete")
+        if doc:
+            counter.counter_handler.add(doc, -1)
+        span.mark("db_remove")
         if record:  # record original c into release collection
             logger.debug("Record the cluster info into released collection")
+            c["spans"] = dict(c.get("spans") or {}, delete=span.to_dict())
             c["release_ts"] = datetime.datetime.now()
             c["duration"] = str(c["release_ts"] - c["apply_ts"])
             # seems mongo reject timedelta type
             if user_id.startswith(SYS_DELETER):
                 c["user_id"] = user_id[len(SYS_DELETER):]
             self.col_released.insert_one(c)
+            change_feed.publish(self.col_released.name, id, "insert")
+            counter.counter_handler.add_released()
         return True
 
     def delete_released(self, id):
@@ -265,8 +336,10 @@ class ClusterHandler(object):
         :param id: id of the cluster to delete
         :return: True or False
         """
-        logger.debug("Delete cluster: id={} from release records.".format(id))
-        self.col_released.find_one_and_delete({"id": id})
+        logger.debug("Delete cluster: id=%s from release records.", id)
+        if self.col_released.find_one_and_delete({"id": id}):
+            counter.counter_handler.add_released(-1)
+        change_feed.publish(self.col_released.name, id, "delete")
         return True
 
     def apply_cluster(self, user_id, condition={}, allow_multiple=False):
@@ -277,9 +350,11 @@ class ClusterHandler(object):
         :param allow_multiple: Allow multiple chain for each tenant
         :return: serialized cluster or None
         """
+        span = Span("apply")
         if not allow_multiple:  # check if already having one
             filt = {"user_id": user_id, "release_ts": "", "health": "OK"}
             filt.update(condition)
+            # from the db, the replica may not have the last apply yet
             c = self.col_active.find_one(filt)
             if c:
                 logger.debug("Already assigned cluster for " + user_id)
@@ -288,7 +363,23 @@ class ClusterHandler(object):
         hosts = self.host_handler.list({"status": "active",
                                         "schedulable": "true"})
         host_ids = [h.get("id") for h in hosts]
-        logger.debug("Find active and schedulable hosts={}".format(host_ids))
+        logger.debug("Find active and schedulable hosts=%s", host_ids)
+        span.mark("lookup")
+        if self.replica:  # only try the candidates known as free
+            filt = {"user_id": "", "host_id": {"$in": host_ids},
+                    "health": "OK"}
+            filt.update(condition)
+            candidates = self.replica.find(filt) or []
+            for cand in candidates:
+                filt.update({"id": cand.get("id"),
+                             "host_id": cand.get("host_id")})
+                c = self.db_update_one(
+                    filt,
+                    {"$set": {"user_id": user_id,
+                              "apply_ts": datetime.datetime.now()}})
+                if c and c.get("user_id") == user_id:
+                    return self._applied(c, user_id, condition, span)
+            # replica may lag behind, then walk the hosts in db
         for h_id in host_ids:  # check each active and schedulable host
             filt = {"user_id": "", "host_id": h_id, "health": "OK"}
             filt.update(condition)
@@ -297,22 +388,175 @@ class ClusterHandler(object):
                 {"$set": {"user_id": user_id,
                           "apply_ts": datetime.datetime.now()}})
             if c and c.get("user_id") == user_id:
-                logger.info("Now have cluster {} at {} for user {}".format(
-                    c.get("id"), h_id, user_id))
-                return self._serialize(c)
+                return self._applied(c, user_id, condition, span)
         logger.warning("Not find matched available cluster for " + user_id)
+        demand.demand_handler.record(condition, hit=False)
         return {}
 
+    def apply_clusters(self, entries, allow_multiple=False, rounds=3):
+        """ Apply clusters for many users in one pass
+
+        The free clusters for the entries of each condition are found by one
+        query, spread over the hosts, then all are claimed by one bulk
+        write. Entries losing races to other applies retry in the next
+        round with other clusters.
+
+        :param entries: list of (user_id, condition)
+        :param allow_multiple: Allow multiple chain for each tenant
+        :param rounds: max rounds to claim clusters
+        :return: list of serialized cluster or {} for each entry
+        """
+        results = [{} for _ in entries]
+        keys = [(user_id, tuple(sorted(condition.items())))
+                for user_id, condition in entries]
+        first = {}  # key -> index of its first entry
+        if allow_multiple:
+            pending = list(range(len(entries)))
+        else:  # same user and condition gets the same cluster
+            for i, key in enumerate(keys):
+                first.setdefault(key, i)
+            pending = self._assigned(entries, sorted(first.values()),
+                                     results)
+        host_ids = [h.get("id") for h in self.host_handler.list(
+            {"status": "active", "schedulable": "true"})]
+        asked = pending  # entries to claim for, counted into the demand
+        for _ in range(rounds):
+            claims = self._pick(entries, pending, host_ids)
+            if not claims:
+                break
+            pending = self._claim(entries, claims, results, pending)
+        for i, key in enumerate(keys):
+            if not allow_multiple and first[key] != i:
+                results[i] = results[first[key]]
+        hits = {}  # condition -> (hits, misses)
+        for i in asked:
+            hit, miss = hits.get(keys[i][1], (0, 0))
+            hits[keys[i][1]] = (hit + 1, miss) if results[i] else \
+                (hit, miss + 1)
+        for condition, (hit, miss) in hits.items():
+            for ok, n in ((True, hit), (False, miss)):
+                if n:
+                    demand.demand_handler.record(dict(condition), ok, n)
+        logger.info("Batch apply %s clusters, %s got", len(entries),
+                    sum(1 for r in results if r))
+        return results
+
+    def _assigned(self, entries, pending, results):
+        """ Fill the entries whose users already have a matched cluster
+
+        :param entries: list of (user_id, condition)
+        :param pending: indexes of the entries to check
+        :param results: results to fill
+        :return: indexes of the entries still pending
+        """
+        users = list(set(entries[i][0] for i in pending))
+        owned = {}  # from the db, the replica may lag behind the applies
+        for c in self.col_active.find({"user_id": {"$in": users},
+                                       "release_ts": "", "health": "OK"}):
+            owned.setdefault(c.get("user_id"), []).append(c)
+        left = []
+        for i in pending:
+            user_id, condition = entries[i]
+            c = next((c for c in owned.get(user_id, []) if all(
+                c.get(k) == v for k, v in condition.items())), None)
+            if c:
+                results[i] = self._serialize(c)
+            else:
+                left.append(i)
+        return left
+
+    def _pick(self, entries, pending, host_ids):
+        """ Pick free clusters for the pending entries, spread over hosts
+
+        :param entries: list of (user_id, condition)
+        :param pending: indexes of the pending entries
+        :param host_ids: ids of the hosts to pick from
+        :return: list of (index, cluster doc)
+        """
+        groups = {}  # condition -> indexes
+        for i in pending:
+            groups.setdefault(tuple(sorted(entries[i][1].items())),
+                              []).append(i)
+        claims, taken = [], set()
+        for condition, indexes in groups.items():
+            filt = {"user_id": "", "host_id": {"$in": host_ids},
+                    "health": "OK"}
+            filt.update(condition)
+            docs = self.replica.find(filt) if self.replica else None
+            if docs is None:
+                docs = self.col_active.find(filt, {"_id": 0}).limit(
+                    len(indexes) * 2 + len(taken))
+            by_host = {}
+            for c in docs:
+                if c.get("id") not in taken:
+                    by_host.setdefault(c.get("host_id"), []).append(c)
+            # take from the hosts in turn, most free ones first
+            queues = sorted(by_host.values(), key=len, reverse=True)
+            spread = [q[n] for n in range(max(map(len, queues or [[]])))
+                      for q in queues if n < len(q)]
+            for i, c in zip(indexes, spread):
+                claims.append((i, c))
+                taken.add(c.get("id"))
+        return claims
+
+    def _claim(self, entries, claims, results, pending):
+        """ Claim the picked clusters by one bulk write
+
+        :param entries: list of (user_id, condition)
+        :param claims: list of (index, cluster doc)
+        :param results: results to fill
+        :param pending: indexes of the pending entries
+        :return: indexes of the entries still pending
+        """
+        now = datetime.datetime.now()
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        self.col_active.bulk_write([UpdateOne(
+            {"id": c.get("id"), "user_id": "", "health": "OK"},
+            {"$set": {"user_id": entries[i][0], "apply_ts": now}})
+            for i, c in claims], ordered=False)
+        docs = dict((c.get("id"), c) for c in self.col_active.find(
+            {"id": {"$in": [c.get("id") for i, c in claims]}}))
+        won = {}  # state of the users -> docs
+        for i, c in claims:
+            doc = docs.get(c.get("id"), {})
+            if doc.get("user_id") == entries[i][0] and \
+                    doc.get("apply_ts") == now:
+                results[i] = self._serialize(doc)
+                won.setdefault(counter.state_of(entries[i][0]),
+                               []).append(doc)
+        for cs in won.values():
+            counter.counter_handler.transit_many(cs, "", cs[0]["user_id"])
+        change_feed.publish_many(self.col_active.name, [
+            c.get("id") for cs in won.values() for c in cs])
+        return [i for i in pending if not results[i]]
+
+    def _applied(self, c, user_id, condition, span):
+        """ Finish a successful apply, saving its span with the cluster
+
+        :param c: the applied cluster
+        :param user_id: which user applied the cluster
+        :param condition: the apply condition
+        :param span: Span of the apply
+        :return: serialized cluster
+        """
+        span.mark("claim")
+        logger.info("Now have cluster %s at %s for user %s",
+                    c.get("id"), c.get("host_id"), user_id)
+        demand.demand_handler.record(condition, hit=True)
+        span.mark("demand")
+        return self.db_update_one({"id": c.get("id")},
+                                  {"$set": {"spans.apply": span.to_dict()}})
+
     def release_cluster_for_user(self, user_id):
         """ Release all cluster for a user_id.
 
         :param user_id: which user
         :return: True or False
         """
-        logger.debug("release clusters for user_id={}".format(user_id))
+        logger.debug("release clusters for user_id=%s", user_id)
         c = self.col_active.find({"user_id": user_id, "release_ts": ""})
         cluster_ids = list(map(lambda x: x.get("id"), c))
-        logger.debug("clusters for user {}={}".format(user_id, cluster_ids))
+        logger.debug("clusters for user %s=%s", user_id, cluster_ids)
         result = True
         for cid in cluster_ids:
             result = result and self.release_cluster(cid)
@@ -331,12 +575,12 @@ class ClusterHandler(object):
             {"id": cluster_id},
             {"$set": {"release_ts": datetime.datetime.now()}})
         if not c:
-            logger.warning("No cluster find for released with id {}".format(
-                cluster_id))
+            logger.warning("No cluster find for released with id %s",
+                           cluster_id)
             return True
         if not c.get("release_ts"):  # not have one
-            logger.warning("No cluster can be released for id {}".format(
-                cluster_id))
+            logger.warning("No cluster can be released for id %s",
+                           cluster_id)
             return False
 
         return self.reset(cluster_id, record)
@@ -349,12 +593,12 @@ class ClusterHandler(object):
         """
         c = self.get_by_id(cluster_id)
         if not c:
-            logger.warning('No cluster found with id={}'.format(cluster_id))
+            logger.warning('No cluster found with id=%s', cluster_id)
             return False
         h_id = c.get('host_id')
         h = self.host_handler.get_active_host_by_id(h_id)
         if not h:
-            logger.warning('No host found with id={}'.format(h_id))
+            logger.warning('No host found with id=%s', h_id)
             return False
         result = compose_start(
             name=cluster_id, daemon_url=h.get('daemon_url'),
@@ -381,12 +625,12 @@ class ClusterHandler(object):
         """
         c = self.get_by_id(cluster_id)
         if not c:
-            logger.warning('No cluster found with id={}'.format(cluster_id))
+            logger.warning('No cluster found with id=%s', cluster_id)
             return False
         h_id = c.get('host_id')
         h = self.host_handler.get_active_host_by_id(h_id)
         if not h:
-            logger.warning('No host found with id={}'.format(h_id))
+            logger.warning('No host found with id=%s', h_id)
             return False
         result = compose_restart(
             name=cluster_id, daemon_url=h.get('daemon_url'),
@@ -413,12 +657,12 @@ class ClusterHandler(object):
         """
         c = self.get_by_id(cluster_id)
         if not c:
-            logger.warning('No cluster found with id={}'.format(cluster_id))
+            logger.warning('No cluster found with id=%s', cluster_id)
             return False
         h_id = c.get('host_id')
         h = self.host_handler.get_active_host_by_id(h_id)
         if not h:
-            logger.warning('No host found with id={}'.format(h_id))
+            logger.warning('No host found with id=%s', h_id)
             return False
         result = compose_stop(
             name=cluster_id, daemon_url=h.get('daemon_url'),
@@ -446,7 +690,7 @@ class ClusterHandler(object):
         :param record: whether to record into released db
         :return:
         """
-
+        span = Span("reset")
         c = self.get_by_id(cluster_id)
         logger.debug("Run recreate_work in background thread")
         cluster_name, host_id, mapped_ports, consensus_plugin, \
@@ -454,14 +698,21 @@ class ClusterHandler(object):
             = c.get("name"), c.get("host_id"), \
             c.get("mapped_ports"), c.get("consensus_plugin"), \
             c.get("consensus_mode"), c.get("size")
-        if not self.delete(cluster_id, record=record, forced=True):
+        if not self.delete(cluster_id, record=record, forced=True,
+                           span=span):
             logger.warning("Delete cluster failed with id=" + cluster_id)
             return False
+        if self.host_handler.get_by_id(host_id).get("draining") == "true":
+            logger.info("Host %s draining, recreate cluster elsewhere",
+                        host_id)
+            return bool(self.host_handler.place_cluster(
+                (consensus_plugin, consensus_mode, size), exclude=(host_id,)))
         if not self.create(name=cluster_name, host_id=host_id,
                            start_port=mapped_ports['rest'],
                            consensus_plugin=consensus_plugin,
-                           consensus_mode=consensus_mode, size=size):
-            logger.warning("Fail to recreate cluster {}".format(cluster_name))
+                           consensus_mode=consensus_mode, size=size,
+                           span=span):
+            logger.warning("Fail to recreate cluster %s", cluster_name)
             return False
         return True
 
@@ -472,12 +723,12 @@ class ClusterHandler(object):
         :param cluster_id: id to reset
         :return: True or False
         """
-        logger.debug("Try reseting cluster {}".format(cluster_id))
+        logger.debug("Try reseting cluster %s", cluster_id)
         c = self.db_update_one({"id": cluster_id, "user_id": ""},
                                {"$set": {"user_id": SYS_RESETTING}})
         if c.get("user_id") != SYS_RESETTING:  # not have one
-            logger.warning("No free cluster can be reset for id {}".format(
-                cluster_id))
+            logger.warning("No free cluster can be reset for id %s",
+                           cluster_id)
             return False
         return self.reset(cluster_id)
 
@@ -486,7 +737,8 @@ class ClusterHandler(object):
                                     'consensus_mode', 'daemon_url',
                                     'create_ts', 'apply_ts', 'release_ts',
                                     'duration', 'containers', 'size', 'status',
-                                    'health', 'mapped_ports', 'service_url')):
+                                    'health', 'mapped_ports', 'service_url',
+                                    'spans')):
         """ Serialize an obj
 
         :param doc: doc to serialize
@@ -510,26 +762,26 @@ class ClusterHandler(object):
         host_id = self.get_by_id(cluster_id).get("host_id")
         host = self.host_handler.get_by_id(host_id)
         if not host:
-            logger.warning("No host found with cluster {}".format(cluster_id))
+            logger.warning("No host found with cluster %s", cluster_id)
             return ""
         daemon_url, host_type = host.get('daemon_url'), host.get('type')
         if host_type not in HOST_TYPES:
-            logger.warning("Found invalid host_type=%s".format(host_type))
+            logger.warning("Found invalid host_type=%s", host_type)
             return ""
         # we should diff with simple host and swarm host here
         if host_type == HOST_TYPES[0]:  # single
             segs = daemon_url.split(":")  # tcp://x.x.x.x:2375
             if len(segs) != 3:
-                logger.error("Invalid daemon url = ", daemon_url)
+                logger.error("Invalid daemon url = %s", daemon_url)
                 return ""
             host_ip = segs[1][2:]
-            logger.debug("single host, ip = {}".format(host_ip))
+            logger.debug("single host, ip = %s", host_ip)
         elif host_type == HOST_TYPES[1]:  # swarm
             host_ip = get_swarm_node_ip(daemon_url, "{}_{}".format(
                 cluster_id, node))
-            logger.debug("swarm host, ip = {}".format(host_ip))
+            logger.debug("swarm host, ip = %s", host_ip)
         else:
-            logger.error("Unknown host type = {}".format(host_type))
+            logger.error("Unknown host type = %s", host_type)
             host_ip = ""
         return host_ip
 
@@ -544,12 +796,12 @@ class ClusterHandler(object):
         :param number: Number of ports to get
         :return: The port list, e.g., [7050, 7150, ...]
         """
-        logger.debug("Find {} start ports for host {}".format(number, host_id))
+        logger.debug("Find %s start ports for host %s", number, host_id)
         if number <= 0:
-            logger.warning("number {} <= 0".format(number))
+            logger.warning("number %s <= 0", number)
             return []
         if not self.host_handler.get_by_id(host_id):
-            logger.warning("Cannot find host with id={}", host_id)
+            logger.warning("Cannot find host with id=%s", host_id)
             return ""
 
         clusters_exists = self.col_active.find({"host_id": host_id})
@@ -559,7 +811,7 @@ class ClusterHandler(object):
             lambda c: int(c["service_url"]["rest"].split(":")[-1]),
             clusters_valid))
 
-        logger.debug("The ports existed: {}".format(ports_existed))
+        logger.debug("The ports existed: %s", ports_existed)
         if len(ports_existed) + number >= 1000:
             logger.warning("Too much ports are already in used.")
             return []
@@ -568,7 +820,7 @@ class ClusterHandler(object):
 
         result = list(filter(lambda x: x not in ports_existed, candidates))
 
-        logger.debug("Free ports are {}".format(result[:number]))
+        logger.debug("Free ports are %s", result[:number])
         return result[:number]
 
     def refresh_health(self, cluster_id, timeout=5):
@@ -578,13 +830,13 @@ class ClusterHandler(object):
         :param timeout: how many seconds to wait for receiving response
         :return: True or False
         """
-        logger.debug("checking health of cluster id={}".format(cluster_id))
+        logger.debug("checking health of cluster id=%s", cluster_id)
         cluster = self.get_by_id(cluster_id)
         if not cluster:
-            logger.warning("Cannot found cluster id={}".format(cluster_id))
+            logger.warning("Cannot found cluster id=%s", cluster_id)
             return True
         if cluster.get('status') != 'running':
-            logger.warning("cluster is not running id={}".format(cluster_id))
+            logger.warning("cluster is not running id=%s", cluster_id)
             return True
         rest_api = cluster["service_url"]['rest'] + "/network/peers"
         if not rest_api.startswith('http'):
@@ -592,34 +844,64 @@ class ClusterHandler(object):
         try:
             r = requests.get(rest_api, timeout=timeout)
         except Exception as e:
-            logger.error("Error to refresh health of cluster {}: {}".format(
-                cluster_id, e))
+            logger.error("Error to refresh health of cluster %s: %s",
+                         cluster_id, e)
             return True
 
         peers = r.json().get("peers")
 
         if len(peers) == cluster["size"]:
             self.db_update_one({"id": cluster_id},
-                               {"$set": {"health": "OK"}})
+                               {"$set": self._health_spans(cluster,
+                                                           {"health": "OK"})})
+            if not cluster.get("health") and cluster.get("create_ts"):
+                ready = datetime.datetime.now() - cluster["create_ts"]
+                counter.counter_handler.incr_pool(
+                    {"ready": 1, "ready_seconds": ready.total_seconds()})
             return True
         else:
-            logger.debug("checking result of cluster id={}".format(
-                cluster_id, peers))
+            logger.debug("checking result of cluster id=%s, peers=%s",
+                         cluster_id, peers)
             self.db_update_one({"id": cluster_id},
                                {"$set": {"health": "FAIL"}})
             return False
 
+    def _health_spans(self, cluster, fields):
+        """ Add the health phase to the spans of a cluster turning healthy
+
+        It lasts from the end of the creation till the first OK check.
+
+        :param cluster: serialized cluster
+        :param fields: fields to set
+        :return: fields to set with the span ones
+        """
+        now = datetime.datetime.now()
+        for op, span in (cluster.get("spans") or {}).items():
+            if op in ("create", "reset") and \
+                    "health" not in span.get("phases", {}):
+                health = (now - span["end_ts"]).total_seconds()
+                key = "spans." + op
+                fields[key + ".phases.health"] = health
+                fields[key + ".total"] = span["total"] + health
+                fields[key + ".end_ts"] = now
+        return fields
+
     def db_update_one(self, filter, operations, after=True, col="active"):
         """
         Update the data into the active db
 
+        Changes of user_id in active clusters are counted into the pool
+        counters, using the doc before the update.
+
         :param filter: Which instance to update, e.g., {"id": "xxx"}
         :param operations: data to update to db, e.g., {"$set": {}}
         :param after: return AFTER or BEFORE
         :param col: collection to operate on
         :return: The updated host json dict
         """
-        if after:
+        transit = col == "active" and list(operations) == ["$set"] and \
+            "user_id" in operations["$set"]
+        if after and not transit:
             return_type = ReturnDocument.AFTER
         else:
             return_type = ReturnDocument.BEFORE
@@ -629,7 +911,29 @@ class ClusterHandler(object):
         else:
             doc = self.col_released.find_one_and_update(
                 filter, operations, return_document=return_type)
+        if transit and doc:
+            counter.counter_handler.transit(
+                doc, doc.get("user_id", ""), operations["$set"]["user_id"])
+            if after:
+                doc = dict(doc, **operations["$set"])
+        if doc and doc.get("id"):
+            change_feed.publish(
+                self.col_active.name if col == "active" else
+                self.col_released.name, doc["id"])
         return self._serialize(doc)
 
+    def _on_change(self, col_name, id, op):
+        """ Drop the cached cluster once changed
+
+        :param col_name: collection of the changed doc
+        :param id: id of the changed doc
+        :param op: operation type
+        :return: None
+        """
+        if op == "reset":
+            self.cache.invalidate()
+        elif col_name == self.col_active.name:
+            self.cache.invalidate(id)
+
 
 cluster_handler = ClusterHandler()
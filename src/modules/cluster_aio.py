@@ -0,0 +1,142 @@
+import datetime
+import logging
+import os
+import sys
+
+from pymongo.collection import ReturnDocument
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from common import log_handler, LOG_LEVEL, Span
+from common.aio import aio_db, run_blocking
+
+from modules import cluster, counter, demand
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+
+class AsyncClusterHandler(object):
+    """ Cluster operations for the asyncio restserver
+
+    Lists, queries and the claim of applying read and write mongo without
+    blocking the event loop. The bookkeeping after a claim and the
+    operations on the daemons reuse the cluster handler in thread pools,
+    so both restservers behave the same.
+    """
+    def __init__(self):
+        self.col_active = aio_db["cluster_active"]
+        self.col_host = aio_db["host"]
+        self.handler = cluster.cluster_handler
+
+    async def list(self, filter_data={}):
+        """ List active clusters with given criteria
+
+        :param filter_data: filter of the docs
+        :return: list of serialized doc
+        """
+        docs = await self.col_active.find(filter_data).to_list(None)
+        return list(map(self.handler._serialize, docs))
+
+    async def get_by_id(self, id):
+        """ Get an active cluster
+
+        :param id: id of the doc
+        :return: serialized result or {}
+        """
+        c = self.handler._serialize(await self.col_active.find_one({"id": id}))
+        if not c:
+            logger.warning("No cluster found with id=" + id)
+        return c
+
+    async def apply_cluster(self, user_id, condition={},
+                            allow_multiple=False):
+        """ Apply a cluster for a user, same as the cluster handler
+
+        :param user_id: which user will apply the cluster
+        :param condition: the filter to select
+        :param allow_multiple: Allow multiple chain for each tenant
+        :return: serialized cluster or {}
+        """
+        span = Span("apply")
+        if not allow_multiple:  # check if already having one
+            filt = {"user_id": user_id, "release_ts": "", "health": "OK"}
+            filt.update(condition)
+            c = await self.col_active.find_one(filt)
+            if c:
+                logger.debug("Already assigned cluster for " + user_id)
+                return self.handler._serialize(c)
+        hosts = await self.col_host.find(
+            {"status": "active", "schedulable": "true"},
+            {"id": 1}).to_list(None)
+        host_ids = [h.get("id") for h in hosts]
+        span.mark("lookup")
+        candidates = []
+        if self.handler.replica:  # only try the candidates known as free
+            filt = {"user_id": "", "host_id": {"$in": host_ids},
+                    "health": "OK"}
+            filt.update(condition)
+            candidates = [{"id": c.get("id"), "host_id": c.get("host_id")}
+                          for c in self.handler.replica.find(filt) or []]
+        # replica may lag behind, then walk the hosts in db
+        candidates.extend({"host_id": h_id} for h_id in host_ids)
+        for cand in candidates:
+            filt = {"user_id": "", "health": "OK"}
+            filt.update(condition)
+            filt.update(cand)
+            c = await self.col_active.find_one_and_update(
+                filt,
+                {"$set": {"user_id": user_id,
+                          "apply_ts": datetime.datetime.now()}},
+                return_document=ReturnDocument.BEFORE)
+            if c:
+                return await run_blocking('db', self._claimed, c, user_id,
+                                          condition, span)
+        logger.warning("Not find matched available cluster for " + user_id)
+        await run_blocking('db', demand.demand_handler.record, condition,
+                           hit=False)
+        return {}
+
+    def _claimed(self, c, user_id, condition, span):
+        """ Count and publish a claimed cluster, blocking
+
+        :param c: the cluster doc before the claim
+        :param user_id: which user applied the cluster
+        :param condition: the apply condition
+        :param span: Span of the apply
+        :return: serialized cluster
+        """
+        counter.counter_handler.transit(c, c.get("user_id", ""), user_id)
+        return self.handler._applied(c, user_id, condition, span)
+
+    async def release_cluster(self, cluster_id):
+        """ Release a cluster, which recreates it on the daemon
+
+        :param cluster_id: specific cluster to release
+        :return: True or False
+        """
+        return await run_blocking('agent', self.handler.release_cluster,
+                                  cluster_id)
+
+    async def release_cluster_for_user(self, user_id):
+        """ Release all clusters of a user
+
+        :param user_id: which user
+        :return: True or False
+        """
+        return await run_blocking('agent',
+                                  self.handler.release_cluster_for_user,
+                                  user_id)
+
+    async def operate(self, action, cluster_id):
+        """ Start, stop or restart a cluster
+
+        :param action: 'start', 'stop' or 'restart'
+        :param cluster_id: id of the cluster
+        :return: True or False
+        """
+        return await run_blocking('agent', getattr(self.handler, action),
+                                  cluster_id)
+
+
+cluster_aio_handler = AsyncClusterHandler()
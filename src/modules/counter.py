@@ -0,0 +1,199 @@
+import logging
+import os
+import sys
+
+from pymongo import UpdateOne
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from common import db, log_handler, LOG_LEVEL, SYS_USER
+
+from modules import capacity
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+POOL_KEY = "pool"
+STATES = ("free", "inuse", "process")
+# cumulative pool counters, kept by sync
+POOL_TOTALS = ("released", "applies", "misses", "ready", "ready_seconds")
+
+
+def state_of(user_id):
+    """ Get the lifecycle state of a cluster by its user_id
+
+    :param user_id: user_id of the cluster
+    :return: 'free', 'inuse' or 'process' (creating, deleting, resetting)
+    """
+    if user_id == "":
+        return "free"
+    if user_id.startswith(SYS_USER):
+        return "process"
+    return "inuse"
+
+
+def counter_keys(c):
+    """ Get the keys of the counters a cluster counts into
+
+    :param c: cluster doc
+    :return: list of counter keys
+    """
+    return [POOL_KEY, "host:" + c.get("host_id", ""),
+            "profile:" + capacity.profile_key(c.get("consensus_plugin"),
+                                              c.get("consensus_mode"),
+                                              c.get("size"))]
+
+
+class CounterHandler(object):
+    """ Keep the pool counts incrementally
+
+    Counters of the whole pool, each host and each profile are changed by
+    the cluster handler along with each lifecycle transition, so reading
+    the counts costs a single lookup. `sync` recounts them from the
+    collections periodically in case some change was missed.
+    """
+    def __init__(self):
+        self.col = db["counter"]
+
+    def incr(self, c, deltas):
+        """ Change the counters of a cluster
+
+        :param c: cluster doc
+        :param deltas: dict of counter field -> delta
+        :return: None
+        """
+        deltas = dict((k, v) for k, v in deltas.items() if v)
+        if not deltas:
+            return
+        self.col.bulk_write([UpdateOne({"_id": key}, {"$inc": deltas},
+                                       upsert=True)
+                             for key in counter_keys(c)], ordered=False)
+
+    def add(self, c, n=1):
+        """ Count a cluster added into (or removed from) the active pool
+
+        :param c: cluster doc
+        :param n: 1 to add, -1 to remove
+        :return: None
+        """
+        self.incr(c, {"active": n, state_of(c.get("user_id", "")): n})
+
+    def transit(self, c, old_user_id, new_user_id):
+        """ Count a cluster changing its user_id
+
+        :param c: cluster doc
+        :param old_user_id: user_id before the change
+        :param new_user_id: user_id after the change
+        :return: None
+        """
+        old, new = state_of(old_user_id), state_of(new_user_id)
+        if old != new:
+            self.incr(c, {old: -1, new: 1})
+
+    def transit_many(self, cs, old_user_id, new_user_id):
+        """ Count many clusters changing their user_id, by one write
+
+        :param cs: cluster docs
+        :param old_user_id: user_id before the change
+        :param new_user_id: user_id after the change
+        :return: None
+        """
+        old, new = state_of(old_user_id), state_of(new_user_id)
+        if old == new or not cs:
+            return
+        counts = {}
+        for c in cs:
+            for key in counter_keys(c):
+                counts[key] = counts.get(key, 0) + 1
+        self.col.bulk_write([UpdateOne({"_id": key},
+                                       {"$inc": {old: -n, new: n}},
+                                       upsert=True)
+                             for key, n in counts.items()], ordered=False)
+
+    def add_released(self, n=1):
+        """ Count released records added or removed
+
+        :param n: number of records, negative to remove
+        :return: None
+        """
+        self.incr_pool({"released": n})
+
+    def incr_pool(self, deltas):
+        """ Change the cumulative counters of the pool
+
+        :param deltas: dict of counter field -> delta, e.g., applies,
+        misses, ready (chains turned healthy) and ready_seconds
+        :return: None
+        """
+        deltas = dict((k, v) for k, v in deltas.items() if v)
+        if deltas:
+            self.col.update_one({"_id": POOL_KEY}, {"$inc": deltas},
+                                upsert=True)
+
+    def get(self, key=POOL_KEY):
+        """ Get the counts of a counter
+
+        :param key: 'pool', 'host:<host_id>' or 'profile:<profile>'
+        :return: dict of active, free, inuse, process (and the cumulative
+        ones for the pool)
+        """
+        return self._counts(self.col.find_one({"_id": key}) or {"_id": key})
+
+    def list(self, prefix):
+        """ Get the counts of all counters of a kind
+
+        :param prefix: 'host' or 'profile'
+        :return: dict of host_id or profile -> counts
+        """
+        docs = self.col.find({"_id": {"$regex": "^{}:".format(prefix)}})
+        return dict((d["_id"][len(prefix) + 1:], self._counts(d))
+                    for d in docs)
+
+    def _counts(self, doc):
+        """ Get the counts from a counter doc, negative ones are clipped
+
+        Counters may drift below zero until the next sync.
+
+        :param doc: counter doc
+        :return: dict of counts
+        """
+        fields = ("active",) + STATES
+        if doc.get("_id") == POOL_KEY:
+            fields += POOL_TOTALS
+        return dict((k, max(doc.get(k, 0), 0)) for k in fields)
+
+    def sync(self):
+        """ Recount all counters from the cluster collections
+
+        :return: the pool counts
+        """
+        counts = {}
+        pipeline = [{"$group": {
+            "_id": {"host_id": "$host_id",
+                    "consensus_plugin": "$consensus_plugin",
+                    "consensus_mode": "$consensus_mode",
+                    "size": "$size",
+                    "state": {"$cond": [
+                        {"$eq": ["$user_id", ""]}, "free",
+                        {"$cond": [{"$eq": [{"$substrBytes": [
+                            "$user_id", 0, len(SYS_USER)]}, SYS_USER]},
+                            "process", "inuse"]}]}},
+            "n": {"$sum": 1}}}]
+        for d in db["cluster_active"].aggregate(pipeline):
+            for key in counter_keys(d["_id"]):
+                item = counts.setdefault(key, dict(
+                    (k, 0) for k in ("active",) + STATES))
+                item["active"] += d["n"]
+                item[d["_id"]["state"]] += d["n"]
+        pool = counts.setdefault(POOL_KEY, dict(
+            (k, 0) for k in ("active",) + STATES))
+        pool["released"] = db["cluster_released"].count_documents({})
+        requests = [UpdateOne({"_id": key}, {"$set": item}, upsert=True)
+                    for key, item in counts.items()]
+        self.col.bulk_write(requests, ordered=False)
+        self.col.delete_many({"_id": {"$nin": list(counts)}})
+        logger.debug("Counters synced, pool=%s", pool)
+        return pool
+
+
+counter_handler = CounterHandler()
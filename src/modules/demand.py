@@ -0,0 +1,208 @@
+import datetime
+import logging
+import os
+import sys
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from common import db, log_handler, LOG_LEVEL, CONSENSUS_TYPES, \
+    CLUSTER_SIZES, DEMAND_WINDOW, DEMAND_HALF_LIFE, DEMAND_PRIOR
+
+from modules import capacity, cluster, counter, scheduler
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+CONDITION_KEYS = ("consensus_plugin", "consensus_mode", "size")
+
+
+def all_profiles():
+    """ Get all profiles the pool can create
+
+    :return: list of (consensus_plugin, consensus_mode, size)
+    """
+    return [(plugin, mode, size) for plugin, mode in CONSENSUS_TYPES
+            for size in CLUSTER_SIZES]
+
+
+def matches(condition, profile):
+    """ Check whether a cluster of the profile meets the apply condition
+
+    :param condition: tuple of (consensus_plugin, consensus_mode, size),
+    None as any
+    :param profile: tuple of (consensus_plugin, consensus_mode, size)
+    :return: True or False
+    """
+    return all(c is None or c == p for c, p in zip(condition, profile))
+
+
+class ProfileMix(object):
+    """ Pick profiles of new clusters one by one to follow the forecast
+
+    Each pick is the profile whose free clusters fall the most behind
+    its share of the forecast demand.
+    """
+    def __init__(self, shares, free):
+        self.shares = shares  # profile -> share of demand
+        self.have = dict(free)  # profile -> number of free clusters
+        self.total = sum(self.have.values())
+
+    def pick(self):
+        """ Pick the profile of the next new cluster
+
+        :return: tuple of (consensus_plugin, consensus_mode, size)
+        """
+        self.total += 1
+        profile = max(sorted(self.shares), key=lambda p: (
+            self.shares[p] * self.total - self.have.get(p, 0)))
+        self.have[profile] = self.have.get(profile, 0) + 1
+        return profile
+
+
+class DemandHandler(object):
+    """ Model the demand of clusters from the apply history
+
+    Each apply is counted per minute and condition, as hit or miss. The
+    forecast decays the counts within `DEMAND_WINDOW` minutes by
+    `DEMAND_HALF_LIFE`, and spreads each condition over the profiles
+    meeting it.
+    """
+    def __init__(self):
+        self.col = db["apply_demand"]
+        self.indexed = False
+
+    def ensure_indexes(self):
+        """ Create the indexes of the demand counters, expiring old ones
+
+        :return: None
+        """
+        if self.indexed:
+            return
+        self.col.create_index([("ts", ASCENDING)],
+                              expireAfterSeconds=DEMAND_WINDOW * 60)
+        self.col.create_index(
+            [("ts", ASCENDING), ("consensus_plugin", ASCENDING),
+             ("consensus_mode", ASCENDING), ("size", ASCENDING)],
+            unique=True)
+        self.indexed = True
+
+    def record(self, condition, hit, n=1):
+        """ Count an apply into the history, and the pool totals
+
+        :param condition: the apply condition
+        :param hit: whether a matched free cluster was found
+        :param n: number of such applies
+        :return: None
+        """
+        # only bookkeeping, so errors are logged, never failing the apply
+        now = datetime.datetime.now()
+        key = dict((k, condition.get(k)) for k in CONDITION_KEYS)
+        key["ts"] = now.replace(second=0, microsecond=0)
+        inc = {"$inc": {"hits" if hit else "misses": n}}
+        try:
+            self.ensure_indexes()
+            try:
+                self.col.update_one(key, inc, upsert=True)
+            except DuplicateKeyError:  # upserted by another apply meanwhile
+                self.col.update_one(key, inc)
+            counter.counter_handler.incr_pool({"applies": n,
+                                               "misses": 0 if hit else n})
+        except PyMongoError as e:
+            logger.warning("Error to record the demand of %s: %s", key, e)
+
+    def history(self, window=DEMAND_WINDOW):
+        """ Load the demand counters within the window
+
+        :param window: minutes to look back
+        :return: list of counter docs
+        """
+        since = datetime.datetime.now() - datetime.timedelta(minutes=window)
+        return list(self.col.find({"ts": {"$gte": since}}))
+
+    def forecast(self, history=None):
+        """ Forecast the share of each profile in the coming demand
+
+        Every profile gets `DEMAND_PRIOR` applies in addition, so the
+        forecast is even without history.
+
+        :param history: counter docs, loaded if not given
+        :return: dict of profile -> share
+        """
+        if history is None:
+            history = self.history()
+        profiles = all_profiles()
+        demand = dict((p, float(DEMAND_PRIOR)) for p in profiles)
+        now = datetime.datetime.now()
+        for d in history:
+            age = (now - d["ts"]).total_seconds() / 60.0
+            weight = 0.5 ** (age / DEMAND_HALF_LIFE)
+            count = d.get("hits", 0) + d.get("misses", 0)
+            condition = tuple(d.get(k) for k in CONDITION_KEYS)
+            matched = [p for p in profiles if matches(condition, p)]
+            for p in matched:
+                demand[p] += weight * count / len(matched)
+        total = sum(demand.values())
+        if not total:
+            return dict((p, 1.0 / len(profiles)) for p in profiles)
+        return dict((p, v / total) for p, v in demand.items())
+
+    def free_profiles(self):
+        """ Count the free clusters of each profile
+
+        :return: dict of profile -> number of free clusters
+        """
+        free = {}
+        for c in cluster.cluster_handler.list({"user_id": ""}):
+            p = scheduler.cluster_profile(c)
+            free[p] = free.get(p, 0) + 1
+        return free
+
+    def mix(self):
+        """ Start picking the profiles of new clusters for the pool
+
+        :return: ProfileMix
+        """
+        return ProfileMix(self.forecast(), self.free_profiles())
+
+    def stats(self):
+        """ Get the applies within the window against the forecast
+
+        :return: dict of the hit rate and each profile's forecast share,
+        demand and free clusters
+        """
+        history = self.history()
+        shares, free = self.forecast(history), self.free_profiles()
+        hits = sum(d.get("hits", 0) for d in history)
+        misses = sum(d.get("misses", 0) for d in history)
+        demand = {}
+        for d in history:
+            condition = tuple(d.get(k) for k in CONDITION_KEYS)
+            item = demand.setdefault(condition, {"hits": 0, "misses": 0})
+            item["hits"] += d.get("hits", 0)
+            item["misses"] += d.get("misses", 0)
+        result = {
+            'window': DEMAND_WINDOW,
+            'applies': hits + misses,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': float(hits) / (hits + misses) if hits + misses else 0,
+            'profiles': [],
+            'conditions': [],
+        }
+        for p in sorted(shares):
+            result['profiles'].append({
+                'name': capacity.profile_key(*p),
+                'forecast': shares[p],
+                'free': free.get(p, 0),
+            })
+        for condition, item in demand.items():
+            item['name'] = capacity.profile_key(
+                *["*" if c is None else c for c in condition])
+            result['conditions'].append(item)
+        return result
+
+
+demand_handler = DemandHandler()
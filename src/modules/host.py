@@ -1,16 +1,13 @@
 import datetime
 import logging
 import os
-import random
 import sys
-import time
 
-from threading import Thread
 from pymongo.collection import ReturnDocument
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from common import \
-    db, log_handler, \
+    db, log_handler, DocCache, Replica, change_feed, POOL_REPLICA, \
     LOG_LEVEL, CLUSTER_LOG_TYPES, CLUSTER_LOG_LEVEL, \
     CLUSTER_SIZES, CLUSTER_PORT_START, CLUSTER_PORT_STEP, \
     CONSENSUS_TYPES
@@ -18,7 +15,7 @@ from common import \
 from agent import cleanup_host, check_daemon, detect_daemon_type, \
     reset_container_host, setup_container_host
 
-from modules import cluster
+from modules import cluster, demand, job, scheduler
 
 logger = logging.getLogger(__name__)
 logger.setLevel(LOG_LEVEL)
@@ -40,11 +37,14 @@ class HostHandler(object):
     """
     def __init__(self):
         self.col = db["host"]
+        self.cache = DocCache(self.col.name)
+        self.replica = Replica(self.col) if POOL_REPLICA else None
+        change_feed.subscribe(self._on_change)
 
     def create(self, name, daemon_url, capacity=1,
                log_level=CLUSTER_LOG_LEVEL[0],
                log_type=CLUSTER_LOG_TYPES[0], log_server="", autofill="false",
-               schedulable="false", serialization=True):
+               schedulable="false", autocapacity="false", serialization=True):
         """ Create a new docker host node
 
         A docker host is potentially a single node or a swarm.
@@ -58,18 +58,20 @@ class HostHandler(object):
         :param log_server: server addr of the syslog
         :param autofill: Whether automatically fillup with chains
         :param schedulable: Whether can schedule cluster request to it
+        :param autocapacity: Whether to use the capacity computed from the
+         host resources instead of the given one
         :param serialization: whether to get serialized result or object
         :return: True or False
         """
-        logger.debug("Create host: name={}, daemon_url={}, capacity={}, "
-                     "log={}/{}, autofill={}, schedulable={}"
-                     .format(name, daemon_url, capacity, log_type,
-                             log_server, autofill, schedulable))
+        logger.debug("Create host: name=%s, daemon_url=%s, capacity=%s, "
+                     "log=%s/%s, autofill=%s, schedulable=%s", name,
+                     daemon_url, capacity, log_type, log_server, autofill,
+                     schedulable)
         if not daemon_url.startswith("tcp://"):
             daemon_url = "tcp://" + daemon_url
 
         if self.col.find_one({"daemon_url": daemon_url}):
-            logger.warning("{} already existed in db".format(daemon_url))
+            logger.warning("%s already existed in db", daemon_url)
             return {}
 
         if "://" not in log_server:
@@ -86,7 +88,7 @@ class HostHandler(object):
         detected_type = detect_daemon_type(daemon_url)
 
         if not setup_container_host(detected_type, daemon_url):
-            logger.warning("{} cannot be setup".format(name))
+            logger.warning("%s cannot be setup", name)
             return {}
 
         h = {
@@ -102,9 +104,14 @@ class HostHandler(object):
             'log_type': log_type,
             'log_server': log_server,
             'autofill': autofill,
-            'schedulable': schedulable
+            'schedulable': schedulable,
+            'autocapacity': autocapacity,
+            'effective_capacity': 0,
+            'resources': {},
+            'draining': 'false'
         }
         hid = self.col.insert_one(h).inserted_id  # object type
+        change_feed.publish(self.col.name, str(hid), "insert")
         host = self.db_update_one(
             {"_id": hid},
             {"$set": {"id": str(hid)}})
@@ -124,11 +131,28 @@ class HostHandler(object):
         :return: serialized result or obj
         """
         # logger.debug("Get a host with id=" + id)
-        ins = self.col.find_one({"id": id})
-        if not ins:
+        host = self._get(id)
+        if not host:
             logger.warning("No host found with id=" + id)
-            return {}
-        return self._serialize(ins)
+        return host
+
+    def _get(self, id):
+        """ Get a host from the replica or the cache
+
+        :param id: id of the doc
+        :return: serialized result or {}
+        """
+        if self.replica:
+            return self._serialize(self.replica.get(id))
+        return self.cache.get(id, self._load_by_id)
+
+    def _load_by_id(self, id):
+        """ Load a host from db
+
+        :param id: id of the doc
+        :return: serialized result or {}
+        """
+        return self._serialize(self.col.find_one({"id": id}))
 
     def update(self, id, d):
         """ Update a host
@@ -153,6 +177,13 @@ class HostHandler(object):
         if d["capacity"] < len(h_old.get("clusters")):
             logger.warning("Cannot set cap smaller than running clusters")
             return {}
+        for k, convert in (("fillup_concurrency", int),
+                           ("fillup_rate", float)):
+            if d.get(k):  # empty to use the default
+                d[k] = convert(d[k])
+                if d[k] <= 0:
+                    logger.warning("Invalid %s=%s", k, d[k])
+                    return {}
         if "log_server" in d and "://" not in d["log_server"]:
             d["log_server"] = "udp://" + d["log_server"]
         if "log_type" in d and d["log_type"] == CLUSTER_LOG_TYPES[0]:
@@ -166,7 +197,9 @@ class HostHandler(object):
         :param filter_data: Image with the filter properties
         :return: iteration of serialized doc
         """
-        hosts = self.col.find(filter_data)
+        hosts = self.replica.find(filter_data) if self.replica else None
+        if hosts is None:
+            hosts = self.col.find(filter_data)
         return list(map(self._serialize, hosts))
 
     def delete(self, id):
@@ -175,7 +208,7 @@ class HostHandler(object):
         :param id: id of the host to delete
         :return:
         """
-        logger.debug("Delete a host with id={0}".format(id))
+        logger.debug("Delete a host with id=%s", id)
 
         h = self.get_by_id(id)
         if not h:
@@ -186,6 +219,7 @@ class HostHandler(object):
             return False
         cleanup_host(h.get("daemon_url"))
         self.col.delete_one({"id": id})
+        change_feed.publish(self.col.name, id, "delete")
         return True
 
     @check_status
@@ -193,72 +227,270 @@ class HostHandler(object):
         """
         Fullfil a host with clusters to its capacity limit
 
+        The clusters are created in a background job, limited by the host
+        fillup concurrency and rate.
+
         :param id: host id
-        :return: True or False
+        :return: id of the job or False
         """
-        logger.debug("Try fillup host {}".format(id))
+        logger.debug("Try fillup host %s", id)
         host = self.get_by_id(id)
         if not host:
             return False
-        num_new = host.get("capacity") - len(host.get("clusters"))
+        if id in job.job_handler.busy_hosts("fillup"):
+            logger.warning("host %s is being filled up already", id)
+            return False
+        num_new = self.capacity_of(host) - len(host.get("clusters"))
         if num_new <= 0:
-            logger.warning("host {} already full".format(id))
-            return True
+            logger.warning("host %s already full", id)
+            num_new = 0
 
         free_ports = cluster.cluster_handler.find_free_start_ports(id, num_new)
-        logger.debug("Free_ports = {}".format(free_ports))
-
-        def create_cluster_work(start_port):
-            cluster_name = "{}_{}".format(
-                host.get("name"),
-                int((start_port - CLUSTER_PORT_START) / CLUSTER_PORT_STEP))
-            consensus_plugin, consensus_mode = random.choice(CONSENSUS_TYPES)
-            cluster_size = random.choice(CLUSTER_SIZES)
-            cid = cluster.cluster_handler.create(
-                name=cluster_name, host_id=id, start_port=start_port,
-                consensus_plugin=consensus_plugin,
-                consensus_mode=consensus_mode, size=cluster_size)
-            if cid:
-                logger.debug("Create cluster {} with id={}".format(
-                    cluster_name, cid))
-            else:
-                logger.warning("Create cluster failed")
-        for p in free_ports:
-            t = Thread(target=create_cluster_work, args=(p,))
-            t.start()
-            time.sleep(0.2)
+        logger.debug("Free_ports = %s", free_ports)
 
-        return True
+        mix = demand.demand_handler.mix()
+        tasks = [self._create_task(host, p, mix.pick()) for p in free_ports]
+        return job.job_handler.run("fillup", host, tasks)
+
+    def fillup_pool(self):
+        """
+        Fill up all autofill hosts to their capacity limit.
+
+        Each new cluster is placed by the scheduler, so the pool grows on
+        the least loaded and healthy hosts first, with the profiles mixed
+        to match the forecast demand.
+
+        :return: number of clusters to create
+        """
+        placements = {}  # host_id -> profiles of new clusters
+        mix = demand.demand_handler.mix()
+        # clusters queued by running jobs have no doc yet to be counted,
+        # nor their ports, so leave the hosts alone until the jobs finish
+        busy = job.job_handler.busy_hosts("fillup")
+        while True:
+            profile = mix.pick()
+            host_id = scheduler.host_scheduler.select(profile,
+                                                      autofill_only=True,
+                                                      exclude=busy)
+            if not host_id:
+                break
+            scheduler.host_scheduler.reserve(host_id, profile)
+            placements.setdefault(host_id, []).append(profile)
+
+        num_new = 0
+        for host_id, profiles in placements.items():
+            host = self.get_by_id(host_id)
+            free_ports = cluster.cluster_handler.find_free_start_ports(
+                host_id, len(profiles))
+            logger.debug("Fillup host %s on ports %s",
+                         host_id, free_ports)
+            tasks = [self._create_task(host, p, profile)
+                     for p, profile in zip(free_ports, profiles)]
+            job.job_handler.run("fillup", host, tasks)
+            num_new += len(tasks)
+        return num_new
+
+    def _create_task(self, host, start_port, profile):
+        """
+        Wrap a cluster creation as a job task.
+
+        :return: function to create the cluster
+        """
+        return lambda: self._create_cluster(host, start_port, profile)
+
+    def _create_cluster(self, host, start_port, profile):
+        """
+        Create a free cluster on the host.
+
+        :param host: serialized host
+        :param start_port: first service port of the cluster
+        :param profile: tuple of (consensus_plugin, consensus_mode, size)
+        :return: id of the cluster or None
+        """
+        cluster_name = "{}_{}".format(
+            host.get("name"),
+            int((start_port - CLUSTER_PORT_START) / CLUSTER_PORT_STEP))
+        consensus_plugin, consensus_mode, cluster_size = profile
+        cid = cluster.cluster_handler.create(
+            name=cluster_name, host_id=host.get("id"), start_port=start_port,
+            consensus_plugin=consensus_plugin,
+            consensus_mode=consensus_mode, size=cluster_size)
+        if cid:
+            logger.debug("Create cluster %s with id=%s",
+                         cluster_name, cid)
+        else:
+            logger.warning("Create cluster failed")
+        return cid
 
     @check_status
     def clean(self, id):
         """
         Clean a host's free clusters.
 
+        The clusters are deleted in a background job, limited by the host
+        fillup concurrency and rate, the host is kept unschedulable until
+        the job finishes.
+
         :param id: host id
-        :return: True or False
+        :return: id of the job or False
         """
-        logger.debug("clean host with id = {}".format(id))
+        logger.debug("clean host with id = %s", id)
         host = self.get_by_id(id)
         if not host:
             return False
         if len(host.get("clusters")) <= 0:
-            return True
+            return job.job_handler.run("clean", host, [])
 
         host = self.db_set_by_id(id, autofill="false")
         schedulable_status = host.get("schedulable")
         if schedulable_status == "true":
             host = self.db_set_by_id(id, schedulable="false")
 
-        for cid in host.get("clusters"):
-            t = Thread(target=cluster.cluster_handler.delete, args=(cid,))
-            t.start()
-            time.sleep(0.2)
+        def on_done():
+            if schedulable_status == "true":
+                self.db_set_by_id(id, schedulable=schedulable_status)
 
-        if schedulable_status == "true":
-            self.db_set_by_id(id, schedulable=schedulable_status)
+        tasks = [self._delete_task(cid) for cid in host.get("clusters")]
+        return job.job_handler.run("clean", host, tasks, on_done)
 
-        return True
+    def _delete_task(self, cluster_id):
+        """
+        Wrap a cluster deletion as a job task.
+
+        :return: function to delete the cluster
+        """
+        return lambda: cluster.cluster_handler.delete(cluster_id)
+
+    @check_status
+    def drain(self, id):
+        """
+        Drain a host for maintenance.
+
+        The host stops taking applies and autofill, its free clusters are
+        recreated on other hosts by placement before removed in a
+        background job. Clusters in use are moved when released.
+
+        :param id: host id
+        :return: id of the job or False
+        """
+        logger.debug("drain host with id = %s", id)
+        before = self.db_update_one(
+            {"id": id}, {"$set": {"draining": "true", "schedulable": "false",
+                                  "autofill": "false"}}, after=False)
+        if not before:
+            return False
+        if before.get("draining") != "true":  # restored by undrain
+            host = self.db_set_by_id(
+                id, drain_schedulable=before.get("schedulable") or "true")
+        else:  # draining again
+            host = self.get_by_id(id)
+        free = cluster.cluster_handler.list({"host_id": id, "user_id": ""})
+        tasks = [self._move_task(c.get("id"), exclude=(id,)) for c in free]
+        return job.job_handler.run("drain", host, tasks)
+
+    def undrain(self, id):
+        """
+        Bring a drained host back to service, as schedulable as it was
+        before the drain, autofill is left disabled.
+
+        :param id: host id
+        :return: True or False
+        """
+        logger.debug("undrain host with id = %s", id)
+        doc = self.col.find_one({"id": id}, {"drain_schedulable": 1})
+        if not doc:
+            return False
+        return bool(self.db_update_one(
+            {"id": id},
+            {"$set": {"draining": "false",
+                      "schedulable": doc.get("drain_schedulable") or "true"},
+             "$unset": {"drain_schedulable": ""}}))
+
+    def rebalance(self):
+        """
+        Even out the free clusters across the schedulable hosts.
+
+        Surplus free clusters over the average are recreated on the hosts
+        below the average with room, then removed from the origin host.
+
+        :return: number of clusters to move
+        """
+        hosts = [h for h in self.list({"status": "active",
+                                       "schedulable": "true"})
+                 if h.get("draining") != "true"]
+        if not hosts:
+            return 0
+        free = dict((h.get("id"), cluster.cluster_handler.list(
+            {"host_id": h.get("id"), "user_id": ""})) for h in hosts)
+        total = sum(len(v) for v in free.values())
+        high = -(-total // len(hosts))  # ceil of the average
+        low = total // len(hosts)
+        room = {}  # host_id -> number of free clusters to receive
+        for h in hosts:
+            space = self.capacity_of(h) - len(h.get("clusters"))
+            room[h.get("id")] = min(low - len(free[h.get("id")]), space)
+        targets = [hid for hid in room for _ in range(max(room[hid], 0))]
+
+        num_moved = 0
+        for h in hosts:
+            surplus = free[h.get("id")][high:]
+            tasks = []
+            while surplus and targets:
+                tasks.append(self._move_task(surplus.pop().get("id"),
+                                             target_id=targets.pop()))
+            if tasks:
+                job.job_handler.run("rebalance", h, tasks)
+                num_moved += len(tasks)
+        logger.info("Rebalance %s free clusters", num_moved)
+        return num_moved
+
+    def place_cluster(self, profile, exclude=(), target_id=None):
+        """
+        Create a free cluster on the host selected by placement.
+
+        :param profile: tuple of (consensus_plugin, consensus_mode, size)
+        :param exclude: host ids not to select
+        :param target_id: host id to use instead of placement
+        :return: id of the cluster or None
+        """
+        host_id = target_id or scheduler.host_scheduler.select(
+            profile, exclude=exclude)
+        if not host_id:
+            logger.warning("No host to place cluster %s", profile)
+            return None
+        scheduler.host_scheduler.reserve(host_id, profile)
+        free_ports = cluster.cluster_handler.find_free_start_ports(host_id, 1)
+        if not free_ports:
+            logger.warning("No free port on host %s", host_id)
+            return None
+        return self._create_cluster(self.get_by_id(host_id), free_ports[0],
+                                    profile)
+
+    def _move_task(self, cluster_id, exclude=(), target_id=None):
+        """
+        Wrap a free cluster move as a job task.
+
+        :return: function to move the cluster
+        """
+        return lambda: self._move_cluster(cluster_id, exclude, target_id)
+
+    def _move_cluster(self, cluster_id, exclude=(), target_id=None):
+        """
+        Recreate a free cluster on another host, then remove it.
+
+        :param cluster_id: id of the free cluster
+        :param exclude: host ids not to select
+        :param target_id: host id to use instead of placement
+        :return: True or False
+        """
+        c = cluster.cluster_handler.get_by_id(cluster_id)
+        if not c or c.get("user_id") != "":
+            logger.warning("Cluster %s not free to move", cluster_id)
+            return False
+        if not self.place_cluster(scheduler.cluster_profile(c), exclude,
+                                  target_id):
+            return False
+        return cluster.cluster_handler.delete(cluster_id)
 
     @check_status
     def reset(self, id):
@@ -268,10 +500,10 @@ class HostHandler(object):
         :param id: host id
         :return: True or False
         """
-        logger.debug("clean host with id = {}".format(id))
+        logger.debug("clean host with id = %s", id)
         host = self.get_by_id(id)
         if not host or len(host.get("clusters")) > 0:
-            logger.warning("No find resettable host with id ={}".format(id))
+            logger.warning("No find resettable host with id =%s", id)
             return False
         return reset_container_host(host_type=host.get("type"),
                                     daemon_url=host.get("daemon_url"))
@@ -288,7 +520,7 @@ class HostHandler(object):
             logger.warning("No host found with id=" + id)
             return False
         if not check_daemon(host.get("daemon_url")):
-            logger.warning("Host {} is inactive".format(id))
+            logger.warning("Host %s is inactive", id)
             self.db_set_by_id(id, status="inactive")
             return False
         else:
@@ -315,17 +547,35 @@ class HostHandler(object):
         :param id: host id
         :return: host or None
         """
-        logger.debug("check host with id = {}".format(id))
-        host = self.col.find_one({"id": id, "status": "active"})
-        if not host:
+        logger.debug("check host with id = %s", id)
+        host = self._get(id)
+        if not host or host.get("status") != "active":
             logger.warning("No active host found with id=" + id)
             return {}
-        return self._serialize(host)
+        return host
+
+    def capacity_of(self, host):
+        """
+        Get the number of clusters the host can hold.
+
+        The effective capacity from resources is used when autocapacity is
+        enabled and already computed, otherwise the configured capacity.
+
+        :param host: serialized host
+        :return: capacity
+        """
+        if host.get("autocapacity") == "true" and \
+                host.get("effective_capacity"):
+            return host.get("effective_capacity")
+        return host.get("capacity") or 0
 
     def _serialize(self, doc, keys=['id', 'name', 'daemon_url', 'capacity',
                                     'type', 'create_ts', 'status', 'autofill',
                                     'schedulable', 'clusters', 'log_level',
-                                    'log_type', 'log_server']):
+                                    'log_type', 'log_server', 'autocapacity',
+                                    'effective_capacity', 'resources',
+                                    'fillup_concurrency', 'fillup_rate',
+                                    'draining']):
         """ Serialize an obj
 
         :param doc: doc to serialize
@@ -362,7 +612,22 @@ class HostHandler(object):
             return_type = ReturnDocument.BEFORE
         doc = self.col.find_one_and_update(
             filter, operations, return_document=return_type)
+        if doc and doc.get("id"):
+            change_feed.publish(self.col.name, doc["id"])
         return self._serialize(doc)
 
+    def _on_change(self, col_name, id, op):
+        """ Drop the cached host once changed
+
+        :param col_name: collection of the changed doc
+        :param id: id of the changed doc
+        :param op: operation type
+        :return: None
+        """
+        if op == "reset":
+            self.cache.invalidate()
+        elif col_name == self.col.name:
+            self.cache.invalidate(id)
+
 
 host_handler = HostHandler()
@@ -0,0 +1,259 @@
+import datetime
+import logging
+import os
+import sys
+import time
+import uuid
+
+from threading import Lock, Thread
+from pymongo import DESCENDING
+from pymongo.collection import ReturnDocument
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from common import db, log_handler, LOG_LEVEL, \
+    FILLUP_CONCURRENCY, FILLUP_RATE, JOB_STALE_TIMEOUT, QUEUE_DEPTH, \
+    set_log_id
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+
+class DaemonLimiter(object):
+    """ Limit the cluster operations hitting one daemon
+
+    At most `concurrency` operations run together, started no faster
+    than `rate` per second. The limits hold across all the processes,
+    coordinated in the `daemon_slot` collection: each running operation
+    leases one of the `concurrency` slot docs of the daemon, and a
+    schedule doc hands out the start times.
+    """
+    poll = 0.5  # seconds between tries to lease a slot
+
+    def __init__(self, col, daemon_url, concurrency, rate):
+        self.col, self.daemon_url = col, daemon_url
+        self.concurrency, self.rate = concurrency, rate
+        for i in range(concurrency):
+            self.col.update_one(
+                {"_id": "{}|{}".format(daemon_url, i)},
+                {"$setOnInsert": {"daemon_url": daemon_url, "slot": i,
+                                  "owner": "",
+                                  "expire": datetime.datetime.now()}},
+                upsert=True)
+
+    def acquire(self):
+        """ Wait for the turn to start an operation on the daemon
+
+        :return: token to release the slot with
+        """
+        self._wait_start()
+        owner = uuid.uuid4().hex
+        while True:
+            now = datetime.datetime.now()
+            # slots of lost processes are taken over after their lease
+            doc = self.col.find_one_and_update(
+                {"daemon_url": self.daemon_url,
+                 "slot": {"$lt": self.concurrency},
+                 "$or": [{"owner": ""}, {"expire": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expire": now + datetime.timedelta(
+                    seconds=JOB_STALE_TIMEOUT)}})
+            if doc:
+                return owner
+            time.sleep(self.poll)
+
+    def release(self, owner):
+        """ Give back the slot of a finished operation
+
+        :param owner: token returned by acquire
+        """
+        self.col.update_one({"daemon_url": self.daemon_url, "owner": owner},
+                            {"$set": {"owner": ""}})
+
+    def _wait_start(self):
+        """ Take the next start time of the daemon and sleep until it
+
+        Up to `concurrency` operations start at once after an idle time,
+        the same burst as a token bucket.
+        """
+        key = "{}|schedule".format(self.daemon_url)
+        self.col.update_one(
+            {"_id": key},
+            {"$max": {"next": time.time() -
+                      (self.concurrency - 1) / self.rate}},
+            upsert=True)
+        doc = self.col.find_one_and_update(
+            {"_id": key}, {"$inc": {"next": 1.0 / self.rate}})
+        delay = doc["next"] - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class JobHandler(object):
+    """ Run batches of cluster operations on hosts as trackable jobs
+
+    Each job is recorded in db with the total, succeeded, failed and
+    pending counts, so its progress can be checked from any service.
+    """
+    def __init__(self):
+        self.col = db["job"]
+        self.slots = db["daemon_slot"]
+        self.limiters = {}  # daemon_url -> DaemonLimiter
+        self.lock = Lock()
+
+    def limiter(self, host):
+        """ Get the limiter of the host daemon, tuned by the host settings
+
+        :param host: serialized host
+        :return: DaemonLimiter
+        """
+        concurrency = host.get("fillup_concurrency") or FILLUP_CONCURRENCY
+        concurrency = int(concurrency)
+        rate = float(host.get("fillup_rate") or FILLUP_RATE)
+        if concurrency <= 0 or rate <= 0:  # would never start a task
+            logger.warning("Invalid fillup limits of host %s, use defaults",
+                           host.get("id"))
+            concurrency, rate = max(FILLUP_CONCURRENCY, 1), \
+                FILLUP_RATE if FILLUP_RATE > 0 else 1.0
+        with self.lock:
+            lim = self.limiters.get(host.get("daemon_url"))
+            if not lim or lim.concurrency != concurrency or lim.rate != rate:
+                lim = DaemonLimiter(self.slots, host.get("daemon_url"),
+                                    concurrency, rate)
+                self.limiters[host.get("daemon_url")] = lim
+            return lim
+
+    def run(self, job_type, host, tasks, on_done=None):
+        """ Start a job running the tasks on the host in background
+
+        :param job_type: e.g., 'fillup' or 'clean'
+        :param host: serialized host
+        :param tasks: list of functions, each returns True on success
+        :param on_done: function to call after all tasks finished
+        :return: id of the job
+        """
+        job = {
+            'id': '',
+            'type': job_type,
+            'host_id': host.get("id"),
+            'status': 'running' if tasks else 'done',
+            'total': len(tasks),
+            'succeeded': 0,
+            'failed': 0,
+            'pending': len(tasks),
+            'create_ts': datetime.datetime.now(),
+            'update_ts': datetime.datetime.now(),
+            'finish_ts': '' if tasks else datetime.datetime.now(),
+        }
+        jid = self.col.insert_one(job).inserted_id
+        job_id = str(jid)
+        self.col.update_one({"_id": jid}, {"$set": {"id": job_id}})
+        logger.info("Job %s %s on host %s with %s tasks",
+                    job_id, job_type, host.get("id"), len(tasks))
+        if not tasks:
+            if on_done:
+                on_done()
+            return job_id
+
+        lim = self.limiter(host)
+        pending, running = QUEUE_DEPTH.labels("job_pending"), \
+            QUEUE_DEPTH.labels("job_running")
+        pending.inc(len(tasks))
+
+        def task_work(task, owner):
+            set_log_id(job_id)
+            try:
+                ok = bool(task())
+            except Exception as e:
+                logger.error("Job %s task error: %s", job_id, e)
+                ok = False
+            finally:
+                lim.release(owner)
+                running.dec()
+            if self._progress(job_id, ok) and on_done:
+                on_done()
+
+        def dispatch_work():
+            set_log_id(job_id)
+            for task in tasks:
+                owner = lim.acquire()
+                pending.dec()
+                running.inc()
+                Thread(target=task_work, args=(task, owner)).start()
+
+        Thread(target=dispatch_work).start()
+        return job_id
+
+    def _progress(self, job_id, ok):
+        """ Count one finished task of the job
+
+        :param job_id: id of the job
+        :param ok: whether the task succeeded
+        :return: True if it is the last task
+        """
+        key = "succeeded" if ok else "failed"
+        job = self.col.find_one_and_update(
+            {"id": job_id}, {"$inc": {key: 1, "pending": -1},
+                             "$set": {"update_ts": datetime.datetime.now()}},
+            return_document=ReturnDocument.AFTER)
+        if job and job.get("pending") <= 0:
+            self.col.update_one(
+                {"id": job_id},
+                {"$set": {"status": "done",
+                          "finish_ts": datetime.datetime.now()}})
+            logger.info("Job %s done, succeeded=%s, failed=%s",
+                        job_id, job.get("succeeded"), job.get("failed"))
+            return True
+        return False
+
+    def busy_hosts(self, job_type):
+        """ Get the hosts with a job of the type still running
+
+        Jobs without progress for JOB_STALE_TIMEOUT seconds are taken as
+        lost, e.g., with their process killed, so they do not block the
+        hosts forever.
+
+        :param job_type: e.g., 'fillup'
+        :return: set of host ids
+        """
+        since = datetime.datetime.now() - datetime.timedelta(
+            seconds=JOB_STALE_TIMEOUT)
+        return set(self.col.distinct("host_id", {
+            "type": job_type, "status": "running",
+            "update_ts": {"$gte": since}}))
+
+    def get_by_id(self, id):
+        """ Get a job
+
+        :param id: id of the job
+        :return: serialized result or {}
+        """
+        return self._serialize(self.col.find_one({"id": id}))
+
+    def list(self, filter_data={}, limit=100):
+        """ List the latest jobs with given criteria
+
+        :param filter_data: filter of the jobs
+        :param limit: max number of jobs
+        :return: list of serialized jobs
+        """
+        jobs = self.col.find(filter_data).sort(
+            "create_ts", DESCENDING).limit(limit)
+        return list(map(self._serialize, jobs))
+
+    def _serialize(self, doc, keys=('id', 'type', 'host_id', 'status',
+                                    'total', 'succeeded', 'failed',
+                                    'pending', 'create_ts', 'finish_ts')):
+        """ Serialize an obj
+
+        :param doc: doc to serialize
+        :param keys: filter which key in the results
+        :return: serialized obj
+        """
+        result = {}
+        if doc:
+            for k in keys:
+                result[k] = doc.get(k, '')
+        return result
+
+
+job_handler = JobHandler()
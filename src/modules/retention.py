@@ -0,0 +1,142 @@
+import datetime
+import logging
+import os
+import sys
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from common import db, log_handler, LOG_LEVEL, RELEASED_TTL_DAYS
+
+from modules import counter
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+
+class RetentionHandler(object):
+    """ Keep the released records bounded
+
+    Raw records in `cluster_released` only live for `RELEASED_TTL_DAYS`,
+    older ones are rolled up into per-day usage summaries.
+    """
+    def __init__(self):
+        self.col_released = db["cluster_released"]
+        self.col_summary = db["cluster_usage_daily"]
+        self.indexed = False
+
+    def ensure_indexes(self):
+        """ Create the indexes the retention queries rely on
+
+        :return: None
+        """
+        if self.indexed:
+            return
+        self.col_released.create_index([("release_ts", DESCENDING)])
+        self.col_summary.create_index(
+            [("day", ASCENDING), ("user_id", ASCENDING),
+             ("consensus_plugin", ASCENDING), ("consensus_mode", ASCENDING),
+             ("size", ASCENDING)], unique=True)
+        self.indexed = True
+
+    def cutoff(self, ttl_days=RELEASED_TTL_DAYS):
+        """ Get the oldest release_ts still kept as raw record
+
+        :param ttl_days: how many days to keep the raw records
+        :return: datetime
+        """
+        return datetime.datetime.now() - datetime.timedelta(days=ttl_days)
+
+    def rollup(self, ttl_days=RELEASED_TTL_DAYS, batch_size=1000):
+        """ Roll up expired released records into the daily summaries
+
+        Each batch is summarized first and then removed, so an interrupted
+        run only re-counts at most one batch.
+
+        :param ttl_days: how many days to keep the raw records
+        :param batch_size: how many records to process in one round
+        :return: number of raw records rolled up
+        """
+        self.ensure_indexes()
+        cutoff = self.cutoff(ttl_days)
+        logger.info("Roll up released records before %s", cutoff)
+        total = 0
+        while True:
+            docs = list(self.col_released.find(
+                {"release_ts": {"$lt": cutoff}}).limit(batch_size))
+            if not docs:
+                break
+            summaries = {}
+            for c in docs:
+                key = self._summary_key(c)
+                s = summaries.setdefault(key, {"count": 0, "duration": 0})
+                s["count"] += 1
+                s["duration"] += self._duration_seconds(c)
+            ops = [UpdateOne(dict(zip(("day", "user_id", "consensus_plugin",
+                                       "consensus_mode", "size"), k)),
+                             {"$inc": v}, upsert=True)
+                   for k, v in summaries.items()]
+            self.col_summary.bulk_write(ops, ordered=False)
+            deleted = self.col_released.delete_many(
+                {"_id": {"$in": [c["_id"] for c in docs]}}).deleted_count
+            counter.counter_handler.add_released(-deleted)
+            total += len(docs)
+        logger.info("Rolled up %s released records", total)
+        return total
+
+    def summary(self, days=RELEASED_TTL_DAYS, filter_data={}):
+        """ List the daily usage summaries in recent days
+
+        :param days: how many days back to check
+        :param filter_data: extra filter, e.g., {"user_id": "xxx"}
+        :return: list of serialized summaries, newest first
+        """
+        start = datetime.datetime.combine(
+            datetime.date.today() - datetime.timedelta(days=days),
+            datetime.time())
+        filt = {"day": {"$gte": start}}
+        filt.update(filter_data)
+        docs = self.col_summary.find(filt).sort("day", DESCENDING)
+        return list(map(self._serialize, docs))
+
+    def _summary_key(self, doc):
+        """ Get the summary key of a released record
+
+        :param doc: released cluster doc
+        :return: tuple of (day, user_id, plugin, mode, size)
+        """
+        day = datetime.datetime.combine(doc["release_ts"].date(),
+                                        datetime.time())
+        return (day, doc.get("user_id", ""), doc.get("consensus_plugin", ""),
+                doc.get("consensus_mode", ""), doc.get("size", 0))
+
+    def _duration_seconds(self, doc):
+        """ Get how long a released chain was used
+
+        :param doc: released cluster doc
+        :return: seconds, 0 if never applied
+        """
+        apply_ts, release_ts = doc.get("apply_ts"), doc.get("release_ts")
+        if not isinstance(apply_ts, datetime.datetime) or \
+                not isinstance(release_ts, datetime.datetime):
+            return 0
+        return int((release_ts - apply_ts).total_seconds())
+
+    def _serialize(self, doc, keys=('day', 'user_id', 'consensus_plugin',
+                                    'consensus_mode', 'size', 'count',
+                                    'duration')):
+        """ Serialize an obj
+
+        :param doc: doc to serialize
+        :param keys: filter which key in the results
+        :return: serialized obj
+        """
+        result = {}
+        if doc:
+            for k in keys:
+                result[k] = doc.get(k, '')
+        return result
+
+
+retention_handler = RetentionHandler()
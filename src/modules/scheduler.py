@@ -1,3 +1,62 @@
+import heapq
+import logging
+import os
+import sys
+import time
+
+from threading import Lock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from common import log_handler, LOG_LEVEL, change_feed, \
+    SCHEDULER_STRATEGY, SCHEDULER_STRATEGIES, SCHEDULER_WARM_BONUS, \
+    SCHEDULER_FAIL_PENALTY, SCHEDULER_FAIL_HALF_LIFE, JOB_STALE_TIMEOUT
+
+from modules import cluster, host
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+
+def cluster_profile(c):
+    """ Get the profile of a cluster
+
+    :param c: cluster doc
+    :return: tuple of (consensus_plugin, consensus_mode, size)
+    """
+    return c.get("consensus_plugin", ""), c.get("consensus_mode", ""), \
+        c.get("size", 0)
+
+
+class HostState(object):
+    """ Placement related state of one host
+    """
+    def __init__(self, id):
+        self.id = id
+        self.version = 0  # bumped on each change, older heap entries die
+        self.capacity = 0
+        self.used = 0
+        self.doc_used = 0  # clusters in the host doc
+        self.reserved = []  # times of the placements not in the doc yet
+        self.active = False
+        self.autofill = False
+        self.profiles = {}  # profile -> number of clusters
+        self.warm = set()  # profiles with images pulled already
+        self.failures = 0.0  # decayed number of failed creations
+        self.failure_ts = 0.0
+
+    def eligible(self):
+        return self.active and self.used < self.capacity
+
+    def failure_score(self, now):
+        """ Decay the failures with the configured half life
+
+        :param now: current timestamp
+        :return: decayed failures
+        """
+        half_lives = (now - self.failure_ts) / SCHEDULER_FAIL_HALF_LIFE
+        return self.failures * 0.5 ** half_lives
+
 
 class Scheduler(object):
     def __init__(self):
@@ -8,9 +67,285 @@ class Scheduler(object):
 
 
 class HostScheduler(Scheduler):
+    """ Placement engine to decide which host gets a new cluster
 
-    def __init__(self):
-        pass
+    Hosts are kept in one heap per strategy, profile and host group,
+    entries are invalidated lazily by the host version, so each selection
+    costs O(log n).
 
-    def get_host(self):
-        return {}
+    Strategies:
+    * least_loaded: lowest used/capacity ratio first
+    * bin_packing: highest used/capacity ratio with free room first
+    * spread: fewest clusters of the same profile first
+
+    Hosts with the profile images already (warm) are preferred, those
+    failing to create clusters recently are penalized.
+    """
+
+    def __init__(self, strategy=SCHEDULER_STRATEGY):
+        self.strategy = strategy
+        self.hosts = {}  # host_id -> HostState
+        self.clusters = {}  # cluster_id -> (host_id, profile)
+        self.heaps = {}  # (strategy, profile, autofill_only) -> heap
+        self.dirty_hosts, self.dirty_clusters = set(), set()
+        self.dirty_lock = Lock()  # not held on db calls, as self.lock is
+        self.loaded = False
+        self.lock = Lock()
+        change_feed.subscribe(self._on_change)
+
+    def get_host(self, profile=None, strategy=None, autofill_only=False,
+                 exclude=()):
+        """ Select the best host for a new cluster
+
+        :param profile: tuple of (consensus_plugin, consensus_mode, size)
+        :param strategy: one of SCHEDULER_STRATEGIES, default as configured
+        :param autofill_only: only select hosts with autofill enabled
+        :param exclude: host ids not to select
+        :return: serialized host or {}
+        """
+        host_id = self.select(profile, strategy, autofill_only, exclude)
+        if not host_id:
+            return {}
+        return host.host_handler.get_by_id(host_id)
+
+    def select(self, profile=None, strategy=None, autofill_only=False,
+               exclude=()):
+        """ Select the id of the best host for a new cluster
+
+        :param profile: tuple of (consensus_plugin, consensus_mode, size)
+        :param strategy: one of SCHEDULER_STRATEGIES, default as configured
+        :param autofill_only: only select hosts with autofill enabled
+        :param exclude: host ids not to select
+        :return: host id or ""
+        """
+        strategy = strategy or self.strategy
+        if strategy not in SCHEDULER_STRATEGIES:
+            logger.warning("Unknown scheduler strategy=%s", strategy)
+            strategy = SCHEDULER_STRATEGIES[0]
+        if not self.loaded:
+            self.refresh()
+        with self.lock:
+            self._sync()
+            key = (strategy, profile, autofill_only)
+            heap = self.heaps.get(key)
+            if heap is None:
+                heap = self._build_heap(key)
+            skipped, result = [], ""
+            while heap:
+                entry = heapq.heappop(heap)
+                h = self.hosts.get(entry[2])
+                if not h or h.version != entry[1] or not h.eligible():
+                    continue  # stale entry
+                skipped.append(entry)
+                if h.id not in exclude:
+                    result = h.id
+                    break
+            for entry in skipped:
+                heapq.heappush(heap, entry)
+            return result
+
+    def reserve(self, host_id, profile=None):
+        """ Count a placement before the host doc reflects it
+
+        So following selections see the host filled up already.
+
+        :param host_id: id of the selected host
+        :param profile: profile of the new cluster
+        :return: None
+        """
+        with self.lock:
+            h = self.hosts.get(host_id)
+            if not h:
+                return
+            h.reserved.append(time.time())
+            h.used += 1
+            if profile:
+                h.profiles[profile] = h.profiles.get(profile, 0) + 1
+            self._update(h)
+
+    def record_result(self, host_id, profile, ok):
+        """ Record a cluster creation result into the health history
+
+        :param host_id: id of the host
+        :param profile: profile of the cluster
+        :param ok: whether the cluster was created successfully
+        :return: None
+        """
+        with self.lock:
+            h = self.hosts.get(host_id)
+            if not h:
+                return
+            if ok:
+                h.warm.add(profile)
+            else:
+                now = time.time()
+                h.failures, h.failure_ts = h.failure_score(now) + 1, now
+            self._update(h)
+
+    def load(self, hosts, clusters):
+        """ Rebuild the whole state from the given docs
+
+        :param hosts: list of serialized hosts
+        :param clusters: list of serialized active clusters
+        :return: None
+        """
+        with self.lock:
+            old = self.hosts
+            self.hosts, self.clusters, self.heaps = {}, {}, {}
+            for d in hosts:
+                h = HostState(d.get("id"))
+                if d.get("id") in old:  # keep the history
+                    h.warm = old[h.id].warm
+                    h.failures = old[h.id].failures
+                    h.failure_ts = old[h.id].failure_ts
+                    h.doc_used = old[h.id].doc_used
+                    h.reserved = old[h.id].reserved
+                self._fill(h, d)
+                self.hosts[h.id] = h
+            for c in clusters:
+                h = self.hosts.get(c.get("host_id"))
+                if not h:
+                    continue
+                p = cluster_profile(c)
+                self.clusters[c.get("id")] = (h.id, p)
+                h.profiles[p] = h.profiles.get(p, 0) + 1
+                h.warm.add(p)
+            with self.dirty_lock:
+                self.dirty_hosts, self.dirty_clusters = set(), set()
+            self.loaded = True
+
+    def refresh(self):
+        """ Rebuild the whole state from db
+
+        :return: None
+        """
+        self.load(host.host_handler.list(),
+                  cluster.cluster_handler.list())
+
+    def _fill(self, h, d):
+        """ Update a host state from its doc
+
+        The reservations are kept counted until the doc has as many more
+        clusters, or taken as failed after JOB_STALE_TIMEOUT seconds.
+
+        :param h: HostState
+        :param d: serialized host
+        :return: None
+        """
+        h.capacity = host.host_handler.capacity_of(d)
+        doc_used = len(d.get("clusters") or [])
+        added, h.doc_used = doc_used - h.doc_used, doc_used
+        since = time.time() - JOB_STALE_TIMEOUT
+        h.reserved = [t for t in h.reserved[max(added, 0):] if t >= since]
+        h.used = doc_used + len(h.reserved)
+        h.active = d.get("status") == "active" and \
+            d.get("draining") != "true"
+        h.autofill = d.get("autofill") == "true"
+
+    def _score(self, h, strategy, profile, now):
+        """ Get the score of a host, lower is better
+
+        :param h: HostState
+        :param strategy: placement strategy
+        :param profile: profile of the new cluster
+        :param now: current timestamp
+        :return: score
+        """
+        load = float(h.used) / h.capacity if h.capacity else 1.0
+        if strategy == "bin_packing":
+            score = -load
+        elif strategy == "spread":
+            same = h.profiles.get(profile, 0) if profile else h.used
+            score = float(same) / h.capacity if h.capacity else 1.0
+            score += load / 1000.0  # tie breaker
+        else:  # least_loaded
+            score = load
+        if profile and profile in h.warm:
+            score -= SCHEDULER_WARM_BONUS
+        score += SCHEDULER_FAIL_PENALTY * h.failure_score(now)
+        return score
+
+    def _build_heap(self, key):
+        """ Build a new heap for the key
+
+        :param key: tuple of (strategy, profile, autofill_only)
+        :return: the heap
+        """
+        now = time.time()
+        strategy, profile, autofill_only = key
+        heap = [(self._score(h, strategy, profile, now), h.version, h.id)
+                for h in self.hosts.values()
+                if h.eligible() and (h.autofill or not autofill_only)]
+        heapq.heapify(heap)
+        self.heaps[key] = heap
+        return heap
+
+    def _update(self, h):
+        """ Push the new state of a host into the heaps
+
+        :param h: HostState
+        :return: None
+        """
+        h.version += 1
+        if not h.eligible():
+            return
+        now = time.time()
+        for key, heap in self.heaps.items():
+            strategy, profile, autofill_only = key
+            if autofill_only and not h.autofill:
+                continue
+            if len(heap) > 2 * len(self.hosts) + 64:  # too many stale ones
+                heap = self._build_heap(key)
+            else:
+                heapq.heappush(heap, (self._score(h, strategy, profile, now),
+                                      h.version, h.id))
+
+    def _sync(self):
+        """ Apply the changes from the feed, called with the lock held
+
+        :return: None
+        """
+        with self.dirty_lock:
+            dirty_clusters, self.dirty_clusters = self.dirty_clusters, set()
+            dirty_hosts, self.dirty_hosts = self.dirty_hosts, set()
+        for cid in dirty_clusters:
+            old = self.clusters.pop(cid, None)
+            if old and old[0] in self.hosts:
+                profiles = self.hosts[old[0]].profiles
+                profiles[old[1]] = max(profiles.get(old[1], 0) - 1, 0)
+                dirty_hosts.add(old[0])
+            c = cluster.cluster_handler.get_by_id(cid)
+            if c and c.get("host_id") in self.hosts:
+                p = cluster_profile(c)
+                self.clusters[cid] = (c["host_id"], p)
+                h = self.hosts[c["host_id"]]
+                h.profiles[p] = h.profiles.get(p, 0) + 1
+                dirty_hosts.add(h.id)
+        for host_id in dirty_hosts:
+            d = host.host_handler.get_by_id(host_id)
+            if not d:
+                self.hosts.pop(host_id, None)
+                continue
+            h = self.hosts.setdefault(host_id, HostState(host_id))
+            self._fill(h, d)
+            self._update(h)
+
+    def _on_change(self, col_name, id, op):
+        """ Mark the changed hosts and clusters, apply them lazily
+
+        :param col_name: collection of the changed doc
+        :param id: id of the changed doc
+        :param op: operation type
+        :return: None
+        """
+        if op == "reset":
+            self.loaded = False
+            return
+        with self.dirty_lock:
+            if col_name == "host":
+                self.dirty_hosts.add(id)
+            elif col_name == "cluster_active":
+                self.dirty_clusters.add(id)
+
+
+host_scheduler = HostScheduler()
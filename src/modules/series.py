@@ -0,0 +1,185 @@
+import datetime
+import logging
+import os
+import sys
+import time
+
+from pymongo import ASCENDING
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from common import db, log_handler, LOG_LEVEL, SERIES_INTERVAL, \
+    SERIES_RAW_TTL, SERIES_MINUTE_TTL, SERIES_HOUR_TTL
+
+from modules import counter, stat
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+# resolution -> (seconds of each point, seconds to keep)
+RESOLUTIONS = {
+    'raw': (SERIES_INTERVAL, SERIES_RAW_TTL),
+    '1m': (60, SERIES_MINUTE_TTL),
+    '1h': (3600, SERIES_HOUR_TTL),
+}
+# each resolution is downsampled from the previous one
+ROLLUPS = (('raw', '1m'), ('1m', '1h'))
+
+
+def bucket_start(ts, step):
+    """ Get the start of the time bucket a timestamp falls in
+
+    :param ts: datetime
+    :param step: seconds of the bucket
+    :return: datetime
+    """
+    epoch = int(time.mktime(ts.timetuple()))
+    return datetime.datetime.fromtimestamp(epoch - epoch % step)
+
+
+class SeriesHandler(object):
+    """ Record the pool metrics as time series
+
+    A raw point is sampled every `SERIES_INTERVAL` seconds, then averaged
+    into per minute and per hour points. Each point expires with its
+    resolution, so the storage stays bounded.
+    """
+    def __init__(self):
+        self.col = db["pool_series"]
+        self.last = None  # (ts, pool counts) of the last sample
+        self.rolled = {}  # resolution -> start of the last rolled bucket
+        self.indexed = False
+
+    def ensure_indexes(self):
+        """ Create the indexes of the points, expiring old ones
+
+        :return: None
+        """
+        if self.indexed:
+            return
+        self.col.create_index([("expire_at", ASCENDING)],
+                              expireAfterSeconds=0)
+        self.col.create_index([("res", ASCENDING), ("ts", ASCENDING)],
+                              unique=True)
+        self.indexed = True
+
+    def snapshot(self, now):
+        """ Collect the current pool metrics
+
+        Rates are per minute since the last sample, time to ready is the
+        average seconds for new chains to turn healthy.
+
+        :param now: datetime of the sample
+        :return: dict of metric name -> value
+        """
+        pool = counter.counter_handler.get()
+        metrics = dict((k, pool[k]) for k in ("active",) + counter.STATES)
+        for profile, counts in counter.counter_handler.list(
+                "profile").items():
+            metrics["free:" + profile] = counts["free"]
+            metrics["inuse:" + profile] = counts["inuse"]
+        for item in stat.stat_handler.hosts()["status"]:
+            metrics["hosts_" + item["name"]] = item["y"]
+        if self.last:
+            last_ts, last = self.last
+            minutes = (now - last_ts).total_seconds() / 60.0
+            if minutes > 0:
+                for k, name in (("applies", "apply_rate"),
+                                ("misses", "miss_rate")):
+                    metrics[name] = max(pool[k] - last[k], 0) / minutes
+            ready = pool["ready"] - last["ready"]
+            if ready > 0:
+                metrics["ready_time"] = \
+                    (pool["ready_seconds"] - last["ready_seconds"]) / ready
+        self.last = (now, pool)
+        return metrics
+
+    def sample(self, now=None):
+        """ Record a raw point, and downsample the finished buckets
+
+        :param now: datetime of the sample, default as now
+        :return: the recorded metrics
+        """
+        self.ensure_indexes()
+        now = now or datetime.datetime.now()
+        metrics = self.snapshot(now)
+        self._save('raw', now, metrics)
+        for src, dst in ROLLUPS:
+            step = RESOLUTIONS[dst][0]
+            start = bucket_start(now, step) - \
+                datetime.timedelta(seconds=step)
+            if self.rolled.get(dst) != start:
+                self.downsample(src, dst, start)
+                self.rolled[dst] = start
+        return metrics
+
+    def downsample(self, src, dst, start):
+        """ Average the points of a bucket into one coarser point
+
+        :param src: resolution to read
+        :param dst: resolution to write
+        :param start: start of the bucket
+        :return: the averaged metrics, or {} if no point
+        """
+        end = start + datetime.timedelta(seconds=RESOLUTIONS[dst][0])
+        sums, nums = {}, {}
+        for d in self.col.find({"res": src, "ts": {"$gte": start,
+                                                   "$lt": end}}):
+            for k, v in d["metrics"].items():
+                sums[k] = sums.get(k, 0) + v
+                nums[k] = nums.get(k, 0) + 1
+        metrics = dict((k, float(sums[k]) / nums[k]) for k in sums)
+        if metrics:
+            self._save(dst, start, metrics)
+        return metrics
+
+    def _save(self, res, ts, metrics):
+        """ Save a point
+
+        :param res: resolution of the point
+        :param ts: datetime of the point
+        :param metrics: dict of metric name -> value
+        :return: None
+        """
+        expire_at = ts + datetime.timedelta(seconds=RESOLUTIONS[res][1])
+        self.col.update_one({"res": res, "ts": ts},
+                            {"$set": {"metrics": metrics,
+                                      "expire_at": expire_at}},
+                            upsert=True)
+
+    def query(self, names, seconds=3600, res=None):
+        """ Get the series of some metrics
+
+        :param names: list of metric names
+        :param seconds: how long to look back
+        :param res: resolution, default as the finest one kept that long
+        :return: dict of metric name -> [[timestamp in ms, value], ...]
+        """
+        if res not in RESOLUTIONS:
+            res = next((r for r in ('raw', '1m', '1h')
+                        if RESOLUTIONS[r][1] >= seconds), '1h')
+        since = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+        result = dict((name, []) for name in names)
+        for d in self.col.find({"res": res, "ts": {"$gte": since}}).sort(
+                "ts", ASCENDING):
+            ms = int(time.mktime(d["ts"].timetuple())) * 1000
+            for name in names:
+                if name in d["metrics"]:
+                    result[name].append([ms, d["metrics"][name]])
+        return result
+
+    def run(self, interval=SERIES_INTERVAL):
+        """ Keep sampling in period, run in a background thread
+
+        :param interval: seconds between two samples
+        :return: None
+        """
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error("Error to sample pool metrics: %s", e)
+            time.sleep(interval)
+
+
+series_handler = SeriesHandler()
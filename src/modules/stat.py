@@ -1,8 +1,10 @@
+import datetime
 import logging
 import time
 from threading import Thread
 from common import LOG_LEVEL, HOST_TYPES, CONSENSUS_PLUGINS, log_handler, \
-    CONSENSUS_MODES
+    CONSENSUS_MODES, DocCache, change_feed, STAT_CACHE_TTL, SPAN_WINDOW, \
+    percentiles
 
 from modules import host_handler, cluster_handler
 
@@ -13,10 +15,14 @@ logger.addHandler(log_handler)
 
 class StatHandler(object):
     """ Main handler to get the Statistics data
+
+    Each resource is counted by one aggregation in db, the results are
+    cached shortly and dropped once the counted collection changes.
     """
 
     def __init__(self):
-        pass
+        self.cache = DocCache("stat", ttl=STAT_CACHE_TTL, max_size=16)
+        change_feed.subscribe(self._on_change)
 
     def hosts(self):
         """
@@ -24,59 +30,152 @@ class StatHandler(object):
 
         :return: The stat result
         """
+        return self.cache.get(host_handler.col.name, lambda _: self._hosts())
+
+    def clusters(self):
+        """
+        Get clusters related statistic result
+
+        :return: The stat result
+        """
+        return self.cache.get(cluster_handler.col_active.name,
+                              lambda _: self._clusters())
+
+    def spans(self):
+        """
+        Get the latency percentiles of each cluster operation phase
+
+        Only expire by the cache ttl, as every operation changes them.
+
+        :return: The stat result
+        """
+        return self.cache.get("span", lambda _: self._spans())
+
+    def _spans(self, window=SPAN_WINDOW):
+        """
+        Get the p50/p95/p99 of each phase of the cluster operations within
+        the window, saved with the active clusters and released records
+
+        :param window: hours to look back
+        :return: dict of the percentiles in total and of each host
+        """
+        since = datetime.datetime.now() - datetime.timedelta(hours=window)
+        fields = {"_id": 0, "host_id": 1, "spans": 1}
+        docs = list(cluster_handler.col_active.find(
+            {"spans": {"$exists": True}}, fields))
+        docs.extend(cluster_handler.col_released.find(
+            {"release_ts": {"$gte": since}, "spans": {"$exists": True}},
+            fields))
+        values = {}  # (host_id, op, phase) -> seconds, phase None as total
+        for d in docs:
+            for op, span in (d.get("spans") or {}).items():
+                if span.get("start_ts", since) < since:
+                    continue
+                items = list(span.get("phases", {}).items())
+                items.append((None, span.get("total", 0)))
+                for phase, seconds in items:
+                    for host_id in (None, d.get("host_id")):
+                        values.setdefault((host_id, op, phase), []).append(
+                            seconds)
+        result = {'window': window, 'ops': {}, 'hosts': {}}
+        for (host_id, op, phase), seconds in values.items():
+            ops = result['ops'] if host_id is None else \
+                result['hosts'].setdefault(host_id, {})
+            item = ops.setdefault(op, {'phases': {}})
+            if phase is None:
+                item.update(percentiles(seconds), count=len(seconds))
+            else:
+                item['phases'][phase] = percentiles(seconds)
+        return result
+
+    def _hosts(self):
+        """
+        Count the hosts by status and type in one aggregation
+
+        :return: The stat result
+        """
+        counts = self._facet(host_handler.col, {
+            'status': '$status',
+            'type': '$type',
+        })
+        status = dict((d['_id'], d['y']) for d in counts['status'])
+        types = dict((d['_id'], d['y']) for d in counts['type'])
         result = {'status': [], 'type': []}
-        actives = list(host_handler.list(filter_data={'status': 'active'}))
-        inactive = list(host_handler.list(filter_data={'status': 'inactive'}))
         result['status'] = [
-            {'name': 'active', 'y': len(actives)},
-            {'name': 'inactive', 'y': len(inactive)}
+            {'name': 'active', 'y': status.get('active', 0)},
+            {'name': 'inactive', 'y': status.get('inactive', 0)}
         ]
         for host_type in HOST_TYPES:
-            hosts = list(host_handler.list(filter_data={'type': host_type}))
             result['type'].append({
                 'name': host_type,
-                'y': len(hosts)
+                'y': types.get(host_type, 0)
             })
 
         return result
 
-    def clusters(self):
+    def _clusters(self):
         """
-        Get clusters related statistic result
+        Count the clusters by usage and consensus type in one aggregation
 
         :return: The stat result
         """
+        counts = self._facet(cluster_handler.col_active, {
+            'free': {'$eq': ['$user_id', '']},
+            'type': {'plugin': '$consensus_plugin',
+                     'mode': '$consensus_mode'},
+        })
+        free = dict((d['_id'], d['y']) for d in counts['free'])
+        types = {}
+        for d in counts['type']:
+            plugin, mode = d['_id'].get('plugin'), d['_id'].get('mode')
+            types[(plugin, mode)] = d['y']
+            types[plugin] = types.get(plugin, 0) + d['y']
         result = {'status': [], 'type': []}
-        total_clusters = list(cluster_handler.list())
-        free_clusters = list(cluster_handler.list(filter_data={
-            'user_id': ''}))
-        total_number = len(total_clusters)
-        free_clusters_number = len(free_clusters)
         result['status'] = [
-            {'name': 'free', 'y': free_clusters_number},
-            {'name': 'used', 'y': total_number - free_clusters_number}
+            {'name': 'free', 'y': free.get(True, 0)},
+            {'name': 'used', 'y': free.get(False, 0)}
         ]
         for consensus_plugin in CONSENSUS_PLUGINS:
             if consensus_plugin == CONSENSUS_PLUGINS[0]:
-                consensus_type = consensus_plugin
-                clusters = list(cluster_handler.list(filter_data={
-                    'consensus_plugin': consensus_plugin}))
                 result['type'].append({
-                    'name': consensus_type,
-                    'y': len(clusters)
+                    'name': consensus_plugin,
+                    'y': types.get(consensus_plugin, 0)
                 })
             else:
                 for consensus_mode in CONSENSUS_MODES:
                     consensus_type = consensus_plugin + "/" + consensus_mode
-                    clusters = list(cluster_handler.list(filter_data={
-                        'consensus_plugin': consensus_plugin,
-                        'consensus_mode': consensus_mode
-                    }))
                     result['type'].append({
                         'name': consensus_type,
-                        'y': len(clusters)
+                        'y': types.get((consensus_plugin, consensus_mode), 0)
                     })
         return result
 
+    def _facet(self, col, groups):
+        """
+        Count the docs of a collection grouped by several keys at once
+
+        :param col: collection to count
+        :param groups: dict of facet name -> group key expression
+        :return: dict of facet name -> list of {'_id': key, 'y': count}
+        """
+        pipeline = [{'$facet': dict(
+            (name, [{'$group': {'_id': key, 'y': {'$sum': 1}}}])
+            for name, key in groups.items())}]
+        return next(col.aggregate(pipeline))
+
+    def _on_change(self, col_name, id, op):
+        """ Drop the stat of the changed collection
+
+        :param col_name: collection of the changed doc
+        :param id: id of the changed doc
+        :param op: operation type
+        :return: None
+        """
+        if op == "reset":
+            self.cache.invalidate()
+        elif col_name in (host_handler.col.name,
+                          cluster_handler.col_active.name):
+            self.cache.invalidate(col_name)
+
 
 stat_handler = StatHandler()
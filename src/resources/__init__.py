@@ -7,3 +7,4 @@ from .cluster_view import bp_cluster_view
 from .host_view import bp_host_view
 
 from .stat import bp_stat_api, bp_stat_view
+from .push import bp_push_api
@@ -7,11 +7,12 @@ from flask import request as r
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from common import log_handler, LOG_LEVEL, \
-    request_get, make_ok_response, make_fail_response, \
-    request_debug, request_json_body, \
-    CODE_CREATED, CODE_NOT_FOUND, \
+    request_get, make_ok_response, make_fail_response, make_retry_response, \
+    request_debug, request_json_body, conditional, admitted, Admission, \
+    idempotent, idempotency_store, \
+    CODE_CREATED, CODE_NOT_FOUND, APPLY_BATCH_MAX, \
     CONSENSUS_PLUGINS, CONSENSUS_MODES, CLUSTER_SIZES
-from modules import cluster_handler, host_handler
+from modules import cluster_handler, host_handler, host_scheduler
 
 logger = logging.getLogger(__name__)
 logger.setLevel(LOG_LEVEL)
@@ -24,6 +25,26 @@ bp_cluster_api = Blueprint('bp_cluster_api', __name__,
 front_rest_v2 = Blueprint('front_rest_v2', __name__,
                           url_prefix='/{}'.format("v2"))
 
+admission = Admission()
+
+
+def request_user(r):
+    """ Get the user to admit a request for, or its address if none
+
+    :param r: the request
+    :return: str
+    """
+    return request_get(r, "user_id") or r.remote_addr
+
+
+def request_scope(r):
+    """ Get the scope of the idempotency key of a request
+
+    :param r: the request
+    :return: tuple of (user_id, action)
+    """
+    return request_get(r, "user_id") or "", request_get(r, "action") or ""
+
 
 def cluster_start(r):
     """Start a cluster which should be in stopped status currently.
@@ -85,33 +106,13 @@ def cluster_apply(r):
         logger.warning("cluster_apply without user_id")
         return make_fail_response("cluster_apply without user_id")
 
-    allow_multiple, condition = request_get(r, "allow_multiple"), {}
-
-    consensus_plugin = request_get(r, "consensus_plugin")
-    consensus_mode = request_get(r, "consensus_mode")
-    cluster_size = int(request_get(r, "size") or -1)
-    if consensus_plugin:
-        if consensus_plugin not in CONSENSUS_PLUGINS:
-            logger.warning("Invalid consensus_plugin")
-            return make_fail_response("Invalid consensus_plugin")
-        else:
-            condition["consensus_plugin"] = consensus_plugin
-
-    if consensus_mode:
-        if consensus_mode not in CONSENSUS_MODES:
-            logger.warning("Invalid consensus_mode")
-            return make_fail_response("Invalid consensus_mode")
-        else:
-            condition["consensus_mode"] = consensus_mode
-
-    if cluster_size >= 0:
-        if cluster_size not in CLUSTER_SIZES:
-            logger.warning("Invalid cluster_size")
-            return make_fail_response("Invalid cluster_size")
-        else:
-            condition["size"] = cluster_size
+    allow_multiple = request_get(r, "allow_multiple")
+    condition, error_msg = request_condition(r)
+    if error_msg:
+        logger.warning(error_msg)
+        return make_fail_response(error_msg)
 
-    logger.debug("condition={}".format(condition))
+    logger.debug("condition=%s", condition)
     c = cluster_handler.apply_cluster(user_id=user_id, condition=condition,
                                       allow_multiple=allow_multiple)
     if not c:
@@ -139,6 +140,8 @@ def cluster_release(r):
 
 @front_rest_v2.route('/cluster_op', methods=['GET', 'POST'])
 @bp_cluster_api.route('/cluster_op', methods=['GET', 'POST'])
+@idempotent(idempotency_store, request_scope)
+@admitted(admission, request_user)
 def cluster_actions():
     """Issue some operations on the cluster.
     Valid operations include: apply, release, start, stop, restart
@@ -153,7 +156,7 @@ def cluster_actions():
     """
     request_debug(r, logger)
     action = request_get(r, "action")
-    logger.info("cluster_op with action={}".format(action))
+    logger.info("cluster_op with action=%s", action)
     if action == "apply":
         return cluster_apply(r)
     elif action == "release":
@@ -170,6 +173,7 @@ def cluster_actions():
 
 @bp_cluster_api.route('/cluster/<cluster_id>', methods=['GET'])
 @front_rest_v2.route('/cluster/<cluster_id>', methods=['GET'])
+@conditional([cluster_handler.col_active.name])
 def cluster_query(cluster_id):
     """Query a json obj of a cluster
 
@@ -206,29 +210,36 @@ def cluster_create():
     """
     logger.info("/cluster action=" + r.method)
     request_debug(r, logger)
-    if not r.form["name"] or not r.form["host_id"] or not \
-            r.form["consensus_plugin"] or not r.form["size"]:
+    if not r.form["name"] or not r.form["consensus_plugin"] or not \
+            r.form["size"]:
         error_msg = "cluster post without enough data"
         logger.warning(error_msg)
         return make_fail_response(error=error_msg, data=r.form)
     else:
         name, host_id, consensus_plugin, consensus_mode, size = \
-            r.form['name'], r.form['host_id'], r.form['consensus_plugin'],\
+            r.form['name'], r.form.get('host_id'), r.form['consensus_plugin'],\
             r.form['consensus_mode'] or '', int(r.form[
                 "size"])
         if consensus_plugin not in CONSENSUS_PLUGINS:
-            logger.debug("Unknown consensus_plugin={}".format(
-                consensus_plugin))
+            logger.debug("Unknown consensus_plugin=%s",
+                         consensus_plugin)
             return make_fail_response()
         if consensus_plugin != CONSENSUS_PLUGINS[0] and consensus_mode \
                 not in CONSENSUS_MODES:
-            logger.debug("Invalid consensus, plugin={}, mode={}".format(
-                consensus_plugin, consensus_mode))
+            logger.debug("Invalid consensus, plugin=%s, mode=%s",
+                         consensus_plugin, consensus_mode)
             return make_fail_response()
 
         if size not in CLUSTER_SIZES:
-            logger.debug("Unknown cluster size={}".format(size))
+            logger.debug("Unknown cluster size=%s", size)
             return make_fail_response()
+        if not host_id:  # let the scheduler place it
+            host_id = host_scheduler.select(
+                (consensus_plugin, consensus_mode, size))
+            if not host_id:
+                error_msg = "No available host for cluster {}".format(name)
+                logger.warning(error_msg)
+                return make_fail_response(error=error_msg)
         if cluster_handler.create(name=name, host_id=host_id,
                                   consensus_plugin=consensus_plugin,
                                   consensus_mode=consensus_mode,
@@ -260,8 +271,8 @@ def cluster_delete():
         logger.warning(error_msg)
         return make_fail_response(error=error_msg, data=r.form)
     else:
-        logger.debug("cluster delete with id={0}, col_name={1}".format(
-            r.form["id"], r.form["col_name"]))
+        logger.debug("cluster delete with id=%s, col_name=%s",
+                     r.form["id"], r.form["col_name"])
         if r.form["col_name"] == "active":
             result = cluster_handler.delete(id=r.form["id"])
         else:
@@ -276,6 +287,7 @@ def cluster_delete():
 
 @bp_cluster_api.route('/clusters', methods=['GET', 'POST'])
 @front_rest_v2.route('/clusters', methods=['GET', 'POST'])
+@conditional([cluster_handler.col_active.name])
 def cluster_list():
     """List clusters with the filter
     e.g.,
@@ -292,12 +304,139 @@ def cluster_list():
         f.update(request_json_body(r))
     logger.info(f)
     result = cluster_handler.list(filter_data=f)
-    logger.error(result)
+    logger.debug("cluster_list got %s clusters", len(result))
     return make_ok_response(data=result)
 
 
+def apply_condition(params):
+    """ Get the apply condition from the parameters
+
+    :param params: dict of the parameters
+    :return: tuple of (condition, error message or None)
+    """
+    condition = {}
+    consensus_plugin = params.get("consensus_plugin")
+    consensus_mode = params.get("consensus_mode")
+    try:
+        cluster_size = int(params.get("size") or -1)
+    except (TypeError, ValueError):  # e.g., "abc" or a list in json
+        return condition, "Invalid cluster_size"
+    if consensus_plugin:
+        if consensus_plugin not in CONSENSUS_PLUGINS:
+            return condition, "Invalid consensus_plugin"
+        condition["consensus_plugin"] = consensus_plugin
+    if consensus_mode:
+        if consensus_mode not in CONSENSUS_MODES:
+            return condition, "Invalid consensus_mode"
+        condition["consensus_mode"] = consensus_mode
+    if cluster_size >= 0:
+        if cluster_size not in CLUSTER_SIZES:
+            return condition, "Invalid cluster_size"
+        condition["size"] = cluster_size
+    return condition, None
+
+
+def request_condition(r):
+    """ Get the apply condition from the parameters of a request
+
+    :param r: the request
+    :return: tuple of (condition, error message or None)
+    """
+    return apply_condition(dict(
+        (k, request_get(r, k))
+        for k in ("consensus_plugin", "consensus_mode", "size")))
+
+
+def batch_entries(body):
+    """ Get the entries of a batch apply
+
+    :param body: json body, {"entries": [{"user_id": xxx, ...}]}
+    :return: tuple of (list of (user_id, condition) or None if invalid,
+    list of error messages of the entries, or error message)
+    """
+    entries = body.get("entries") if isinstance(body, dict) else None
+    if not isinstance(entries, list) or not entries:
+        return None, "cluster_apply_batch without entries"
+    if len(entries) > APPLY_BATCH_MAX:
+        return None, "cluster_apply_batch over {} entries".format(
+            APPLY_BATCH_MAX)
+    result, errors = [], []
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get("user_id"):
+            result.append(None)
+            errors.append("entry without user_id")
+            continue
+        condition, error_msg = apply_condition(entry)
+        result.append(None if error_msg else (entry["user_id"], condition))
+        errors.append(error_msg or "")
+    return result, errors
+
+
+def batch_report(entries, errors, clusters):
+    """ Report the results of a batch apply
+
+    :param entries: list of (user_id, condition), None for invalid ones
+    :param errors: error messages of the entries
+    :param clusters: applied clusters of the valid entries in order
+    :return: dict of the total, succeeded, failed and entry results
+    """
+    clusters, results = iter(clusters), []
+    for entry, error_msg in zip(entries, errors):
+        c = next(clusters) if entry else {}
+        if entry and not c:
+            error_msg = "No available res for {}".format(entry[0])
+        results.append({"user_id": entry[0] if entry else "",
+                        "status": "OK" if c else "FAIL",
+                        "error": error_msg, "data": c})
+    succeeded = sum(1 for r in results if r["status"] == "OK")
+    return {"total": len(results), "succeeded": succeeded,
+            "failed": len(results) - succeeded, "results": results}
+
+
+@front_rest_v2.route('/cluster_apply_batch', methods=['POST'])
+@idempotent(idempotency_store, request_scope)
+def cluster_apply_batch():
+    """Apply clusters for many users in one call
+    e.g.,
+
+    POST /cluster_apply_batch
+    {
+        entries: [{user_id: xxx, consensus_plugin: pbft, size: 4}, ...],
+        allow_multiple: false
+    }
+
+    Return the result of each entry, OK if any succeeded. Each entry is
+    admitted as one operation of its user.
+    """
+    body = request_json_body(r) or {}
+    entries, errors = batch_entries(body)
+    if entries is None:
+        logger.warning(errors)
+        return make_fail_response(error=errors)
+    valid = [e for e in entries if e]
+    try:
+        retry_after = admission.enter_batch([e[0] for e in valid])
+    except ValueError as e:
+        logger.warning("cluster_apply_batch not admitted: %s", e)
+        return make_fail_response(error="cluster_apply_batch {}".format(e))
+    if retry_after:
+        return make_retry_response(retry_after)
+    try:
+        clusters = cluster_handler.apply_clusters(
+            valid, allow_multiple=body.get("allow_multiple")) \
+            if valid else []
+    finally:
+        admission.leave()
+    report = batch_report(entries, errors, clusters)
+    if not report["succeeded"]:
+        return make_fail_response(error="No cluster applied", data=report)
+    return make_ok_response(data=report)
+
+
 # will deprecate
 @front_rest_v2.route('/cluster_apply', methods=['GET', 'POST'])
+@idempotent(idempotency_store, request_scope)
+@admitted(admission, request_user)
 def cluster_apply_dep():
     """
     Return a Cluster json body.
@@ -310,36 +449,13 @@ def cluster_apply_dep():
         logger.warning(error_msg)
         return make_fail_response(error=error_msg)
 
-    allow_multiple, condition = request_get(r, "allow_multiple"), {}
-
-    consensus_plugin = request_get(r, "consensus_plugin")
-    consensus_mode = request_get(r, "consensus_mode")
-    cluster_size = int(request_get(r, "size") or -1)
-    if consensus_plugin:
-        if consensus_plugin not in CONSENSUS_PLUGINS:
-            error_msg = "Invalid consensus_plugin"
-            logger.warning(error_msg)
-            return make_fail_response(error=error_msg)
-        else:
-            condition["consensus_plugin"] = consensus_plugin
-
-    if consensus_mode:
-        if consensus_mode not in CONSENSUS_MODES:
-            error_msg = "Invalid consensus_mode"
-            logger.warning(error_msg)
-            return make_fail_response(error=error_msg)
-        else:
-            condition["consensus_mode"] = consensus_mode
-
-    if cluster_size >= 0:
-        if cluster_size not in CLUSTER_SIZES:
-            error_msg = "Invalid cluster_size"
-            logger.warning(error_msg)
-            return make_fail_response(error=error_msg)
-        else:
-            condition["size"] = cluster_size
+    allow_multiple = request_get(r, "allow_multiple")
+    condition, error_msg = request_condition(r)
+    if error_msg:
+        logger.warning(error_msg)
+        return make_fail_response(error=error_msg)
 
-    logger.debug("condition={}".format(condition))
+    logger.debug("condition=%s", condition)
     c = cluster_handler.apply_cluster(user_id=user_id, condition=condition,
                                       allow_multiple=allow_multiple)
     if not c:
@@ -352,6 +468,8 @@ def cluster_apply_dep():
 
 # will deprecate
 @front_rest_v2.route('/cluster_release', methods=['GET', 'POST'])
+@idempotent(idempotency_store, request_scope)
+@admitted(admission, request_user)
 def cluster_release_dep():
     """
     Return status.
@@ -0,0 +1,418 @@
+import asyncio
+import calendar
+import json
+import logging
+import math
+import os
+import sys
+import time
+import uuid
+
+from email.utils import formatdate
+from aiohttp import web
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from common import log_handler, LOG_LEVEL, \
+    CODE_OK, CODE_BAD_REQUEST, CODE_NOT_FOUND, CODE_TOO_MANY_REQUESTS, \
+    CODE_CONFLICT, json_dumps, ok_body, fail_body, Admission, \
+    idempotency_store, IDEMPOTENCY_WAIT
+from common.aio import aio_db, run_blocking
+from common.web import cache_validators
+from modules import cluster_handler
+from modules.cluster_aio import cluster_aio_handler
+from resources.cluster_api import apply_condition, batch_entries, \
+    batch_report
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+# same routes and bodies as front_rest_v2
+routes_v2 = web.RouteTableDef()
+
+admission = Admission()
+
+
+def _json_response(body, status):
+    return web.Response(text=json_dumps(body), status=status,
+                        content_type='application/json')
+
+
+def make_ok_response(error="", data={}, code=CODE_OK):
+    return _json_response(ok_body(error, data, code), CODE_OK)
+
+
+def make_fail_response(error="Invalid request", data={},
+                       code=CODE_BAD_REQUEST):
+    return _json_response(fail_body(error, data, code), CODE_BAD_REQUEST)
+
+
+def make_retry_response(retry_after, error="Too many requests"):
+    response = _json_response(fail_body(error, code=CODE_TOO_MANY_REQUESTS),
+                              CODE_TOO_MANY_REQUESTS)
+    response.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+    return response
+
+
+async def admitted(request, params, handler):
+    """ Run a handler if the request is admitted, as common.admitted
+
+    :param request: the request
+    :param params: request parameters
+    :param handler: coroutine function of the parameters
+    :return: response
+    """
+    retry_after = admission.enter(params.get("user_id") or request.remote)
+    if retry_after:
+        return make_retry_response(retry_after)
+    try:
+        return await handler(params)
+    finally:
+        admission.leave()
+
+
+async def wait_key(key_id, timeout=IDEMPOTENCY_WAIT):
+    """ Wait for the outcome of an idempotency key, as
+    IdempotencyStore.wait without blocking the loop
+
+    :param key_id: id of the key
+    :param timeout: max seconds to wait
+    :return: the doc of the key, or None if abandoned or its lease expired
+    """
+    col = aio_db[idempotency_store.col.name]
+    deadline, delay = time.time() + timeout, 0.05
+    while True:
+        doc = await col.find_one({"_id": key_id})
+        if doc and idempotency_store.expired(doc):
+            return None
+        if not doc or doc.get("status") == "done" or \
+                time.time() >= deadline:
+            return doc
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1.0)
+
+
+async def idempotent(request, params, handler):
+    """ Run a handler once for the idempotency key of the request, as
+    common.idempotent
+
+    :param request: the request
+    :param params: request parameters
+    :param handler: coroutine function of the parameters
+    :return: response
+    """
+    key = request.headers.get('Idempotency-Key') or \
+        params.get("idempotency_key")
+    if not key:
+        return await handler(params)
+    store = idempotency_store
+    key_id = store.scoped(key, request.path, params.get("user_id") or "",
+                          params.get("action") or "")
+    owner = uuid.uuid4().hex
+    doc = await run_blocking('db', store.begin, key_id, owner)
+    if doc and doc.get("status") == "running":
+        doc = await wait_key(key_id) or \
+            await run_blocking('db', store.begin, key_id, owner)
+    if doc:
+        if doc.get("status") == "done":
+            return web.Response(
+                text=doc.get("body"), status=doc.get("code"),
+                content_type='application/json',
+                headers={'Idempotent-Replayed': 'true'})
+        return make_fail_response(
+            "Request with the same key is still running", code=CODE_CONFLICT)
+    try:
+        response = await handler(params)
+    except Exception:
+        await run_blocking('db', store.abandon, key_id, owner)
+        raise
+    if response.status == CODE_TOO_MANY_REQUESTS or response.status >= 500:
+        await run_blocking('db', store.abandon, key_id, owner)
+    else:
+        await run_blocking('db', store.finish, key_id, owner,
+                           response.status, response.text)
+    return response
+
+
+def not_modified(request, etag, last_modified):
+    """ Check the conditional headers of the request, as common.conditional
+
+    :param request: the request
+    :param etag: current etag
+    :param last_modified: current last modified timestamp
+    :return: True if the client has the current version
+    """
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        tags = [t.strip() for t in if_none_match.split(',')]
+        tags = [t[2:] if t.startswith('W/') else t for t in tags]
+        return '*' in tags or '"{}"'.format(etag) in tags
+    since = request.if_modified_since
+    return bool(since) and last_modified < int(time.time()) and \
+        last_modified <= calendar.timegm(since.utctimetuple())
+
+
+async def conditional(request, col_names, handler):
+    """ Answer a conditional GET by 304 Not Modified while the collections
+    read are unchanged, without running the handler, as common.conditional
+
+    :param request: the request
+    :param col_names: collection names
+    :param handler: coroutine function to get the response
+    :return: response
+    """
+    validators = None
+    if request.method in ('GET', 'HEAD'):
+        validators = cache_validators(
+            col_names, request.path + '?' + request.query_string)
+    if not validators:
+        return await handler()
+    etag, last_modified = validators
+    if not_modified(request, etag, last_modified):
+        response = web.Response(status=304)
+    else:
+        response = await handler()
+        if response.status != 200:
+            return response
+    response.headers['ETag'] = 'W/"{}"'.format(etag)
+    response.headers['Last-Modified'] = formatdate(last_modified,
+                                                   usegmt=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+async def request_params(request):
+    """ Get the parameters from the query, then the form or json body
+
+    :param request: the request
+    :return: dict of the parameters, the query ones first
+    """
+    params = {}
+    if request.can_read_body:
+        if request.content_type in ('application/x-www-form-urlencoded',
+                                    'multipart/form-data'):
+            params.update(await request.post())
+        else:
+            try:
+                body = json.loads(await request.text())
+                if isinstance(body, dict):
+                    params.update(body)
+            except ValueError:
+                pass
+    params.update(request.query)
+    return params
+
+
+async def cluster_apply(params):
+    """Apply a cluster.
+
+    Return a Cluster json body.
+    """
+    user_id = params.get("user_id")
+    if not user_id:
+        logger.warning("cluster_apply without user_id")
+        return make_fail_response("cluster_apply without user_id")
+    condition, error_msg = apply_condition(params)
+    if error_msg:
+        logger.warning(error_msg)
+        return make_fail_response(error_msg)
+    logger.debug("condition=%s", condition)
+    c = await cluster_aio_handler.apply_cluster(
+        user_id=user_id, condition=condition,
+        allow_multiple=params.get("allow_multiple"))
+    if not c:
+        logger.warning("cluster_apply failed")
+        return make_fail_response("No available res for {}".format(user_id))
+    return make_ok_response(data=c)
+
+
+async def cluster_operate(params, action):
+    """Release, start, stop or restart a cluster.
+
+    :param params: request parameters
+    :param action: name of the operation
+    :return: response
+    """
+    cluster_id = params.get("cluster_id")
+    if not cluster_id:
+        logger.warning("No cluster_id is given")
+        return make_fail_response("No cluster_id is given")
+    if action == "release":
+        result = await cluster_aio_handler.release_cluster(cluster_id)
+    else:
+        result = await cluster_aio_handler.operate(action, cluster_id)
+    if result:
+        return make_ok_response()
+    return make_fail_response("cluster {} failed".format(action))
+
+
+@routes_v2.route('*', '/v2/cluster_op')
+async def cluster_actions(request):
+    """Issue some operations on the cluster, see front_rest_v2.
+
+    Return a json obj.
+    """
+    if request.method not in ('GET', 'POST'):
+        raise web.HTTPMethodNotAllowed(request.method, ['GET', 'POST'])
+    return await idempotent(
+        request, await request_params(request),
+        lambda params: admitted(request, params, cluster_op))
+
+
+async def cluster_op(params):
+    """Run an operation on the cluster by the action parameter.
+
+    :param params: request parameters
+    :return: response
+    """
+    action = params.get("action")
+    logger.info("cluster_op with action=%s", action)
+    if action == "apply":
+        return await cluster_apply(params)
+    elif action in ("release", "start", "stop", "restart"):
+        return await cluster_operate(params, action)
+    return make_fail_response(error="Unknown action type")
+
+
+@routes_v2.get('/v2/cluster/{cluster_id}')
+async def cluster_query(request):
+    """Query a json obj of a cluster
+
+    GET /cluster/xxxx
+
+    Return a json obj of the cluster.
+    """
+    cluster_id = request.match_info['cluster_id']
+
+    async def query():
+        result = await cluster_aio_handler.get_by_id(cluster_id)
+        if result:
+            return make_ok_response(data=result)
+        error_msg = "cluster not found with id=" + cluster_id
+        logger.warning(error_msg)
+        return make_fail_response(error=error_msg, code=CODE_NOT_FOUND)
+    return await conditional(
+        request, [cluster_handler.col_active.name], query)
+
+
+@routes_v2.route('*', '/v2/clusters')
+async def cluster_list(request):
+    """List clusters with the filter
+    e.g.,
+
+    GET /clusters?consensus_plugin=pbft
+
+    Return objs of the clusters.
+    """
+    if request.method == 'GET':
+        f = dict(request.query)
+    elif request.method == 'POST':
+        f = await request_params(request)
+    else:
+        raise web.HTTPMethodNotAllowed(request.method, ['GET', 'POST'])
+    logger.info(f)
+
+    async def query():
+        return make_ok_response(data=await cluster_aio_handler.list(f))
+    return await conditional(
+        request, [cluster_handler.col_active.name], query)
+
+
+async def cluster_apply_many(body):
+    """Apply clusters for the entries of a batch, see front_rest_v2.
+
+    :param body: json body
+    :return: response
+    """
+    entries, errors = batch_entries(body)
+    if entries is None:
+        logger.warning(errors)
+        return make_fail_response(error=errors)
+    valid = [e for e in entries if e]
+    try:
+        retry_after = admission.enter_batch([e[0] for e in valid])
+    except ValueError as e:
+        logger.warning("cluster_apply_batch not admitted: %s", e)
+        return make_fail_response(error="cluster_apply_batch {}".format(e))
+    if retry_after:
+        return make_retry_response(retry_after)
+    try:
+        clusters = await run_blocking(
+            'db', cluster_handler.apply_clusters, valid,
+            allow_multiple=body.get("allow_multiple")) if valid else []
+    finally:
+        admission.leave()
+    report = batch_report(entries, errors, clusters)
+    if not report["succeeded"]:
+        return make_fail_response(error="No cluster applied", data=report)
+    return make_ok_response(data=report)
+
+
+@routes_v2.post('/v2/cluster_apply_batch')
+async def cluster_apply_batch(request):
+    """Apply clusters for many users in one call, see front_rest_v2.
+
+    Return the result of each entry, OK if any succeeded.
+    """
+    try:
+        body = json.loads(await request.text())
+    except ValueError:
+        body = {}
+    body = body if isinstance(body, dict) else {}
+    return await idempotent(request, dict(request.query),
+                            lambda params: cluster_apply_many(body))
+
+
+# will deprecate
+@routes_v2.route('*', '/v2/cluster_apply')
+async def cluster_apply_dep(request):
+    """
+    Return a Cluster json body.
+    """
+    if request.method not in ('GET', 'POST'):
+        raise web.HTTPMethodNotAllowed(request.method, ['GET', 'POST'])
+    return await idempotent(
+        request, await request_params(request),
+        lambda params: admitted(request, params, cluster_apply))
+
+
+# will deprecate
+@routes_v2.route('*', '/v2/cluster_release')
+async def cluster_release_dep(request):
+    """
+    Return status.
+    """
+    if request.method not in ('GET', 'POST'):
+        raise web.HTTPMethodNotAllowed(request.method, ['GET', 'POST'])
+    query = dict(request.query)
+    return await idempotent(
+        request, await request_params(request),
+        lambda params: admitted(request, params,
+                                lambda p: cluster_release(p, query)))
+
+
+async def cluster_release(params, query):
+    """Release the cluster by id, or the clusters of the user.
+
+    :param params: request parameters
+    :param query: query parameters, returned if no id is given
+    :return: response
+    """
+    user_id, cluster_id = params.get("user_id"), params.get("cluster_id")
+    if not user_id and not cluster_id:
+        error_msg = "cluster_release without id"
+        logger.warning(error_msg)
+        return make_fail_response(error=error_msg, data=query)
+    if cluster_id:
+        result = await cluster_aio_handler.release_cluster(cluster_id)
+    else:
+        result = await cluster_aio_handler.release_cluster_for_user(user_id)
+    if not result:
+        error_msg = "cluster_release failed user_id={} cluster_id={}". \
+            format(user_id, cluster_id)
+        logger.warning(error_msg)
+        return make_fail_response(error=error_msg, data={
+            "user_id": user_id,
+            "cluster_id": cluster_id,
+        })
+    return make_ok_response()
@@ -9,7 +9,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from common import log_handler, LOG_LEVEL, \
     request_debug, \
     CONSENSUS_PLUGINS, CONSENSUS_MODES, CLUSTER_SIZES
-from modules import cluster_handler, host_handler
+from modules import cluster_handler, host_handler, retention_handler
 
 logger = logging.getLogger(__name__)
 logger.setLevel(LOG_LEVEL)
@@ -23,8 +23,8 @@ bp_cluster_view = Blueprint('bp_cluster_view', __name__,
 # Return a web page with cluster info
 @bp_cluster_view.route('/cluster/<cluster_id>', methods=['GET'])
 def cluster_info_show(cluster_id):
-    logger.debug("/ cluster_info/{}?released={} action={}".format(
-        cluster_id, r.args.get('released', '0'), r.method))
+    logger.debug("/ cluster_info/%s?released=%s action=%s",
+                 cluster_id, r.args.get('released', '0'), r.method)
     released = (r.args.get('released', '0') != '0')
     if not released:
         return render_template("cluster_info.html",
@@ -51,6 +51,8 @@ def clusters_show():
 
     if show_type == "inused":
         col_filter["user_id"] = {"$ne": ""}
+    elif col_name == "released":  # older ones are rolled up already
+        col_filter["release_ts"] = {"$gte": retention_handler.cutoff()}
 
     clusters = list(cluster_handler.list(filter_data=col_filter,
                                          col_name=col_name))
@@ -64,7 +66,7 @@ def clusters_show():
 
     hosts = list(host_handler.list())
     hosts_avail = list(filter(lambda e: e["status"] == "active" and len(
-        e["clusters"]) < e["capacity"], hosts))
+        e["clusters"]) < host_handler.capacity_of(e), hosts))
     return render_template("clusters.html", type=show_type, col_name=col_name,
                            items_count=total_items, items=clusters,
                            hosts_available=hosts_avail,
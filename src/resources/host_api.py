@@ -11,7 +11,7 @@ from common import log_handler, LOG_LEVEL, \
     CODE_CREATED, \
     request_debug
 
-from modules import host_handler
+from modules import host_handler, job_handler
 
 logger = logging.getLogger(__name__)
 logger.setLevel(LOG_LEVEL)
@@ -52,10 +52,14 @@ def host_create():
     else:
         schedulable = "false"
 
-    logger.debug("name={}, daemon_url={}, capacity={}"
-                 "fillup={}, schedulable={}, log={}/{}".
-                 format(name, daemon_url, capacity, autofill, schedulable,
-                        log_type, log_server))
+    if "autocapacity" in r.form and r.form["autocapacity"] == "on":
+        autocapacity = "true"
+    else:
+        autocapacity = "false"
+
+    logger.debug("name=%s, daemon_url=%s, capacity=%s, fillup=%s, "
+                 "schedulable=%s, log=%s/%s", name, daemon_url, capacity,
+                 autofill, schedulable, log_type, log_server)
     if not name or not daemon_url or not capacity or not log_type:
         error_msg = "host POST without enough data"
         logger.warning(error_msg)
@@ -65,6 +69,7 @@ def host_create():
                                      capacity=int(capacity),
                                      autofill=autofill,
                                      schedulable=schedulable,
+                                     autocapacity=autocapacity,
                                      log_level=log_level,
                                      log_type=log_type,
                                      log_server=log_server)
@@ -108,7 +113,7 @@ def host_delete():
         logger.warning(error_msg)
         return make_fail_response(error=error_msg, data=r.form)
     else:
-        logger.debug("host delete with id={0}".format(r.form["id"]))
+        logger.debug("host delete with id=%s", r.form["id"])
         if host_handler.delete(id=r.form["id"]):
             return make_ok_response()
         else:
@@ -130,21 +135,40 @@ def host_actions():
                                   data=r.form)
     else:
         if action == "fillup":
-            if host_handler.fillup(host_id):
-                logger.debug("fillup successfully")
-                return make_ok_response()
+            job_id = host_handler.fillup(host_id)
+            if job_id:
+                logger.debug("fillup job %s started", job_id)
+                return make_ok_response(data={"job_id": job_id})
             else:
                 error_msg = "Failed to fillup the host."
                 logger.warning(error_msg)
                 return make_fail_response(error=error_msg, data=r.form)
         elif action == "clean":
-            if host_handler.clean(host_id):
-                logger.debug("clean successfully")
-                return make_ok_response()
+            job_id = host_handler.clean(host_id)
+            if job_id:
+                logger.debug("clean job %s started", job_id)
+                return make_ok_response(data={"job_id": job_id})
             else:
                 error_msg = "Failed to clean the host."
                 logger.warning(error_msg)
                 return make_fail_response(error=error_msg, data=r.form)
+        elif action == "drain":
+            job_id = host_handler.drain(host_id)
+            if job_id:
+                logger.debug("drain job %s started", job_id)
+                return make_ok_response(data={"job_id": job_id})
+            else:
+                error_msg = "Failed to drain the host."
+                logger.warning(error_msg)
+                return make_fail_response(error=error_msg, data=r.form)
+        elif action == "undrain":
+            if host_handler.undrain(host_id):
+                logger.debug("undrain successfully")
+                return make_ok_response()
+            else:
+                error_msg = "Failed to undrain the host."
+                logger.warning(error_msg)
+                return make_fail_response(error=error_msg, data=r.form)
         elif action == "reset":
             if host_handler.reset(host_id):
                 logger.debug("reset successfully")
@@ -157,3 +181,32 @@ def host_actions():
     error_msg = "unknown host action={}".format(action)
     logger.warning(error_msg)
     return make_fail_response(error=error_msg, data=r.form)
+
+
+@bp_host_api.route('/rebalance', methods=['POST'])
+def host_rebalance():
+    request_debug(r, logger)
+    num_moved = host_handler.rebalance()
+    return make_ok_response(data={"moved": num_moved})
+
+
+@bp_host_api.route('/job/<job_id>', methods=['GET'])
+def job_query(job_id):
+    request_debug(r, logger)
+    result = job_handler.get_by_id(job_id)
+    if result:
+        return make_ok_response(data=result)
+    else:
+        error_msg = "job not found with id=" + job_id
+        logger.warning(error_msg)
+        return make_fail_response(error=error_msg, data=r.form)
+
+
+@bp_host_api.route('/jobs', methods=['GET'])
+def job_list():
+    request_debug(r, logger)
+    filter_data = {}
+    for k in ("host_id", "type", "status"):
+        if r.args.get(k):
+            filter_data[k] = r.args.get(k)
+    return make_ok_response(data=job_handler.list(filter_data))
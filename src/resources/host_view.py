@@ -40,6 +40,6 @@ def hosts_show():
 
 @bp_host_view.route('/host/<host_id>', methods=['GET'])
 def host_info(host_id):
-    logger.debug("/ host_info/{0} method={1}".format(host_id, r.method))
+    logger.debug("/ host_info/%s method=%s", host_id, r.method)
     return render_template("host_info.html", item=host_handler.get_by_id(
         host_id))
@@ -14,7 +14,7 @@ logger = logging.getLogger(__name__)
 logger.setLevel(LOG_LEVEL)
 logger.addHandler(log_handler)
 
-from modules import cluster_handler, host_handler
+from modules import counter_handler, host_handler
 
 bp_index = Blueprint('bp_index', __name__)
 
@@ -28,16 +28,15 @@ def show():
     hosts_active = list(filter(lambda e: e["status"] == "active", hosts))
     hosts_inactive = list(filter(lambda e: e["status"] != "active", hosts))
     hosts_free = list(filter(
-        lambda e: len(e["clusters"]) < e["capacity"], hosts_active))
+        lambda e: len(e["clusters"]) < host_handler.capacity_of(e),
+        hosts_active))
     hosts_available = hosts_free
-    clusters_active = len(list(cluster_handler.list(col_name="active")))
-    clusters_released = len(list(cluster_handler.list(col_name="released")))
-    clusters_free = len(list(cluster_handler.list(filter_data={"user_id": ""},
-                                                  col_name="active")))
-    clusters_inuse = clusters_active - clusters_free
-
-    clusters_temp = len(list(cluster_handler.list(filter_data={
-        "user_id": "/^__/"}, col_name="active")))
+    pool = counter_handler.get()
+    clusters_active = pool["active"]
+    clusters_released = pool["released"]
+    clusters_free = pool["free"]
+    clusters_inuse = pool["inuse"]
+    clusters_temp = pool["process"]
 
     return render_template("index.html", hosts=hosts,
                            hosts_free=hosts_free,
@@ -60,6 +59,6 @@ def show():
 
 @bp_index.route('/about', methods=['GET'])
 def about():
-    logger.info("path={}, method={}".format(r.path, r.method))
+    logger.info("path=%s, method=%s", r.path, r.method)
     return render_template("about.html", author=author, version=version,
                            homepage=homepage)
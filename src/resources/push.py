@@ -0,0 +1,70 @@
+import logging
+import os
+import sys
+
+from flask import Blueprint, Response, stream_with_context
+from flask import request as r
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from common import log_handler, LOG_LEVEL, Broadcaster, make_retry_response, \
+    PUSH_KEEPALIVE
+from modules import host_handler, cluster_handler, counter_handler
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_handler)
+
+HOST_FIELDS = ('id', 'name', 'status', 'type', 'schedulable', 'autofill',
+               'draining', 'effective_capacity')
+CLUSTER_FIELDS = ('id', 'name', 'user_id', 'host_id', 'status', 'health',
+                  'consensus_plugin', 'consensus_mode', 'size')
+
+
+def host_event(host_id):
+    """ Get the pushed state of a host
+
+    :param host_id: id of the host
+    :return: dict of the fields shown on dashboards, {} if gone
+    """
+    h = host_handler.get_by_id(host_id)
+    if not h:
+        return {}
+    result = dict((k, h.get(k, '')) for k in HOST_FIELDS)
+    result['clusters'] = len(h.get('clusters') or [])
+    return result
+
+
+def cluster_event(cluster_id):
+    """ Get the pushed state of an active cluster
+
+    :param cluster_id: id of the cluster
+    :return: dict of the fields shown on dashboards, {} if gone
+    """
+    c = cluster_handler.get_by_id(cluster_id)
+    return dict((k, c.get(k, '')) for k in CLUSTER_FIELDS) if c else {}
+
+
+broadcaster = Broadcaster()
+broadcaster.register(host_handler.col.name, "host", host_event)
+broadcaster.register(cluster_handler.col_active.name, "cluster",
+                     cluster_event)
+broadcaster.summary("counts", counter_handler.get)
+
+bp_push_api = Blueprint('bp_push_api', __name__, url_prefix='/api')
+
+
+@bp_push_api.route('/events', methods=['GET'])
+def events():
+    """ Stream the changes of hosts, active clusters and pool counts
+
+    :return: text/event-stream response, kept open, or 429 if too many
+    viewers, then the pages fall back to static
+    """
+    logger.debug("path=%s, method=%s", r.path, r.method)
+    q = broadcaster.listen()
+    if q is None:
+        return make_retry_response(PUSH_KEEPALIVE, error="Too many viewers")
+    return Response(stream_with_context(broadcaster.stream(q)),
+                    mimetype="text/event-stream",
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
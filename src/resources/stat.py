@@ -1,13 +1,17 @@
+import datetime
 import logging
 import os
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 
-from flask import Blueprint, jsonify, render_template
+from flask import Blueprint, render_template
 from flask import request as r
-from common import log_handler, LOG_LEVEL, CODE_OK, request_debug
+from common import log_handler, LOG_LEVEL, CODE_OK, request_debug, \
+    RELEASED_TTL_DAYS, conditional, json_response, make_fail_response
 from version import version
-from modules import host_handler, stat_handler
+from modules import host_handler, cluster_handler, stat_handler, \
+    retention_handler, demand_handler, counter_handler, series_handler
+from modules.series import RESOLUTIONS
 
 logger = logging.getLogger(__name__)
 logger.setLevel(LOG_LEVEL)
@@ -25,10 +29,36 @@ def health():
         'version': version
     }
 
-    return jsonify(result), CODE_OK
+    return json_response(result)
+
+
+def stat_cols(req):
+    """ Get the collections counted by a stat request
+
+    :param req: the request
+    :return: collection names, empty if the stat changes otherwise
+    """
+    return {
+        'host': [host_handler.col.name],
+        'cluster': [cluster_handler.col_active.name],
+    }.get(req.args.get('res'), [])
+
+
+def int_arg(name, default):
+    """ Get an int argument of the request
+
+    :param name: name of the argument
+    :param default: value if not given
+    :return: the int, or None if not an int
+    """
+    try:
+        return int(r.args.get(name, default))
+    except (TypeError, ValueError):
+        return None
 
 
 @bp_stat_api.route('/stat', methods=['GET'])
+@conditional(stat_cols)
 def get():
     request_debug(r, logger)
     res = r.args.get('res')
@@ -36,13 +66,43 @@ def get():
         result = stat_handler.hosts()
     elif res == 'cluster':
         result = stat_handler.clusters()
+    elif res == 'cache':
+        result = {'cache': [host_handler.cache.stats(),
+                            cluster_handler.cache.stats(),
+                            stat_handler.cache.stats()]}
+    elif res == 'series':
+        metrics = r.args.get('metrics', 'free,inuse').split(',')
+        seconds = int_arg('range', 3600)
+        if seconds is None or seconds <= 0:
+            logger.warning("Invalid range=%s", r.args.get('range'))
+            return make_fail_response(error="Invalid range")
+        # nothing is kept longer than the coarsest resolution
+        seconds = min(seconds, max(ttl for _, ttl in RESOLUTIONS.values()))
+        result = {'series': series_handler.query(
+            metrics, seconds=seconds, res=r.args.get('step'))}
+    elif res == 'span':
+        result = {'span': stat_handler.spans()}
+    elif res == 'counter':
+        result = {'pool': counter_handler.get(),
+                  'hosts': counter_handler.list('host'),
+                  'profiles': counter_handler.list('profile')}
+    elif res == 'demand':
+        result = {'demand': demand_handler.stats()}
+    elif res == 'usage':
+        days = int_arg('days', RELEASED_TTL_DAYS)
+        # no further back than year 1, out of the range of dates
+        if days is None or not 0 <= days < \
+                (datetime.date.today() - datetime.date.min).days:
+            logger.warning("Invalid days=%s", r.args.get('days'))
+            return make_fail_response(error="Invalid days")
+        result = {'usage': retention_handler.summary(days=days)}
     else:
         result = {
             'example': '/api/stat?res=host'
         }
 
     logger.debug(result)
-    return jsonify(result), CODE_OK
+    return json_response(result)
 
 
 bp_stat_view = Blueprint('bp_stat_view', __name__, url_prefix='/view')
@@ -50,7 +110,7 @@ bp_stat_view = Blueprint('bp_stat_view', __name__, url_prefix='/view')
 
 @bp_stat_view.route('/stat', methods=['GET'])
 def show():
-    logger.info("path={}, method={}".format(r.path, r.method))
+    logger.info("path=%s, method=%s", r.path, r.method)
     hosts = list(host_handler.list())
 
     return render_template("stat.html", hosts=hosts)
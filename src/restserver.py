@@ -1,7 +1,8 @@
 import os
 from flask import Flask
 
-from common import log_handler, LOG_LEVEL
+from common import log_handler, LOG_LEVEL, instrument_app, compress_app, \
+    trace_app, capture_app, traffic_capture
 from resources import front_rest_v2
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
@@ -15,6 +16,10 @@ app.logger.setLevel(LOG_LEVEL)
 
 # app.register_blueprint(front_rest_v1)
 app.register_blueprint(front_rest_v2)
+instrument_app(app)
+compress_app(app)
+trace_app(app)
+capture_app(app, traffic_capture)
 
 if __name__ == '__main__':
     app.run(
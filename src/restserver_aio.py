@@ -0,0 +1,107 @@
+import logging
+import os
+import time
+
+from aiohttp import web
+
+from common import log_handler, LOG_LEVEL, traffic_capture, \
+    COMPRESS_MIN_SIZE
+from common.metrics import REQUEST_LATENCY, metrics_data
+from resources.cluster_api_aio import routes_v2
+
+
+@web.middleware
+async def observe_latency(request, handler):
+    """ Observe the latency of each request by route, as instrument_app
+    """
+    start, status = time.time(), 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        REQUEST_LATENCY.labels(
+            resource.canonical if resource else "unknown", request.method,
+            status).observe(time.time() - start)
+
+
+@web.middleware
+async def compress(request, handler):
+    """ Compress large response bodies by gzip or deflate, as accepted, as
+    compress_app
+    """
+    response = await handler(request)
+    if not isinstance(response, web.Response) or response.status != 200 \
+            or 'Content-Encoding' in response.headers:
+        return response
+    vary = response.headers.get('Vary')
+    if not vary:
+        response.headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        response.headers['Vary'] = vary + ', Accept-Encoding'
+    if response.body is not None and \
+            len(response.body) >= COMPRESS_MIN_SIZE:
+        response.enable_compression()
+    return response
+
+
+@web.middleware
+async def capture_traffic(request, handler):
+    """ Capture the v2 requests with their outcomes, as capture_app
+    """
+    if not request.path.startswith('/v2/'):
+        return await handler(request)
+    start, status, data = time.time(), 500, None
+    try:
+        response = await handler(request)
+        status = response.status
+        if isinstance(response, web.Response):
+            data = response.body
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        params, body = dict(request.query), None
+        if request.content_type == 'application/json':
+            try:
+                body = await request.json()
+            except ValueError:
+                pass
+        elif request.method == 'POST':
+            params.update(await request.post())
+        resource = request.match_info.route.resource
+        key = request.headers.get('Idempotency-Key')
+        traffic_capture.record(
+            start, request.method, resource.canonical if resource else '',
+            request.path, params, body, key or params.get('idempotency_key'),
+            status, data if isinstance(data, bytes) else None)
+
+
+async def metrics(request):
+    body, content_type = metrics_data()
+    return web.Response(body=body, headers={'Content-Type': content_type})
+
+
+def make_app():
+    middlewares = [observe_latency, compress]
+    if traffic_capture.enabled:
+        middlewares.append(capture_traffic)
+    app = web.Application(middlewares=middlewares)
+    app.router.add_routes(routes_v2)
+    app.router.add_get('/metrics', metrics)
+    return app
+
+
+aiohttp_logger = logging.getLogger('aiohttp')
+aiohttp_logger.setLevel(LOG_LEVEL)
+aiohttp_logger.addHandler(log_handler)
+
+app = make_app()
+
+if __name__ == '__main__':
+    web.run_app(app, host='0.0.0.0', port=int(os.environ.get('PORT', 80)))
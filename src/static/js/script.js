@@ -69,7 +69,7 @@ $(document).ready(function () {
       success: function (response) {
         console.log(response);
         setTimeout(function () {
-          alertMsg('Success!', 'The host is fullfilled now.', 'success');
+          alertMsg('Success!', 'The host is being filled up, job ' + response.data.job_id, 'success');
         }, 1000);
 
         setTimeout("location.reload(true);", 2000);
@@ -94,7 +94,53 @@ $(document).ready(function () {
       },
       success: function (response) {
         console.log(response);
-        alertMsg('Success!', 'The host is clean now, autofill disabled.', 'success');
+        alertMsg('Success!', 'The host is being cleaned, autofill disabled, job ' + response.data.job_id, 'success');
+        setTimeout("location.reload(true);", 2000);
+      },
+      error: function (error) {
+        console.log(error);
+        alertMsg('Failed!', error.responseJSON.error, 'danger');
+        setTimeout("location.reload(true);", 2000);
+      }
+    });
+    e.preventDefault();
+  });
+  $('.host_action_drain').click(function (e) {
+    var id = $(this).data('id');
+    $.ajax({
+      url: "/api/host_op",
+      type: 'POST',
+      dataType: 'json',
+      data: {
+        "id": id,
+        "action": "drain"
+      },
+      success: function (response) {
+        console.log(response);
+        alertMsg('Success!', 'The host is being drained, job ' + response.data.job_id, 'success');
+        setTimeout("location.reload(true);", 2000);
+      },
+      error: function (error) {
+        console.log(error);
+        alertMsg('Failed!', error.responseJSON.error, 'danger');
+        setTimeout("location.reload(true);", 2000);
+      }
+    });
+    e.preventDefault();
+  });
+  $('.host_action_undrain').click(function (e) {
+    var id = $(this).data('id');
+    $.ajax({
+      url: "/api/host_op",
+      type: 'POST',
+      dataType: 'json',
+      data: {
+        "id": id,
+        "action": "undrain"
+      },
+      success: function (response) {
+        console.log(response);
+        alertMsg('Success!', 'The host is back to service.', 'success');
         setTimeout("location.reload(true);", 2000);
       },
       error: function (error) {
@@ -123,6 +169,8 @@ $(document).ready(function () {
         .find('[name="log_type"]').val(host.log_type).end()
         .find('[name="log_server"]').val(host.log_server).end()
         .find('[name="capacity"]').val(host.capacity).end()
+        .find('[name="fillup_concurrency"]').val(host.fillup_concurrency).end()
+        .find('[name="fillup_rate"]').val(host.fillup_rate).end()
         .find('[name="status"]').val(host.status).end()
         .find('[name="create_ts"]').val(host.create_ts).end()
         .find('[name="clusters"]').val(host.clusters.length).end();
@@ -135,6 +183,10 @@ $(document).ready(function () {
         $('#config_host_form').find('[name="autofill"]').prop('checked', true);
       else
         $('#config_host_form').find('[name="autofill"]').prop('checked', false);
+      if (host.autocapacity == "true")
+        $('#config_host_form').find('[name="autocapacity"]').prop('checked', true);
+      else
+        $('#config_host_form').find('[name="autocapacity"]').prop('checked', false);
       // Show the dialog
       bootbox
         .dialog({
@@ -241,6 +293,8 @@ $(document).ready(function () {
     var name = $form.find('[name="name"]').val();
     var status = $form.find('[name="status"]').val();
     var capacity = $form.find('[name="capacity"]').val();
+    var fillup_concurrency = $form.find('[name="fillup_concurrency"]').val();
+    var fillup_rate = $form.find('[name="fillup_rate"]').val();
     var type = $form.find('[name="type"]').val();
     if ($form.find('[name="schedulable"]').is(':checked')) {
       var schedulable = true
@@ -252,6 +306,11 @@ $(document).ready(function () {
     } else {
       var autofill = false
     }
+    if ($form.find('[name="autocapacity"]').is(':checked')) {
+      var autocapacity = true
+    } else {
+      var autocapacity = false
+    }
     var log_level = $form.find('[name="log_level"]').val();
     var log_type = $form.find('[name="log_type"]').val();
     var log_server = $form.find('[name="log_server"]').val();
@@ -265,12 +324,15 @@ $(document).ready(function () {
         "name": name,
         "status": status,
         "capacity": capacity,
+        "fillup_concurrency": fillup_concurrency,
+        "fillup_rate": fillup_rate,
         "log_level": log_level,
         "log_type": log_type,
         "log_server": log_server,
         "type": type,
         "autofill": autofill,
-        "schedulable": schedulable
+        "schedulable": schedulable,
+        "autocapacity": autocapacity
       }
     }).success(function (response) {
       // Get the cells
@@ -873,4 +935,125 @@ $('.chain_action_restart').on('click', function (e) {
       }]
     }]
   });
+
+  function request_pool_series() {
+    $.ajax({
+      url: '/api/stat?res=series&metrics=free,inuse,process,apply_rate,miss_rate&range=86400',
+      type: 'GET',
+      dataType: 'json',
+      success: function (response) {
+        $.each(chart_pool_series.series, function (i, series) {
+          series.setData(response.series[series.options.id] || []);
+        });
+
+        // call it again after 1 minute
+        setTimeout(request_pool_series, 60000);
+      },
+      cache: false
+    });
+  }
+
+  if ($('#stat_pool_series').length) {
+    var chart_pool_series = new Highcharts.Chart({
+      chart: {
+        renderTo: 'stat_pool_series',
+        type: 'spline',
+        zoomType: 'x',
+        events: {
+          load: request_pool_series
+        }
+      },
+      title: {
+        text: 'Pool Utilization'
+      },
+      xAxis: {
+        type: 'datetime'
+      },
+      yAxis: [{
+        title: {
+          text: 'Chains'
+        },
+        min: 0
+      }, {
+        title: {
+          text: 'Applies/min'
+        },
+        min: 0,
+        opposite: true
+      }],
+      plotOptions: {
+        spline: {
+          marker: {
+            enabled: false
+          }
+        }
+      },
+      series: [
+        {id: 'free', name: 'Free', data: []},
+        {id: 'inuse', name: 'In use', data: []},
+        {id: 'process', name: 'In process', data: []},
+        {id: 'apply_rate', name: 'Applies', yAxis: 1, dashStyle: 'shortdot', data: []},
+        {id: 'miss_rate', name: 'Misses', yAxis: 1, dashStyle: 'shortdot', data: []}
+      ]
+    });
+  }
+
+  // changes of hosts, chains and the pool counts pushed by the server
+  if (window.EventSource &&
+    $('[data-push-count], [data-push-host], [data-push-cluster]').length) {
+    var source = new EventSource('/api/events');
+
+    function colored(text, color) {
+      return $('<font>').attr('color', color).text(text);
+    }
+
+    source.addEventListener('counts', function (e) {
+      var counts = JSON.parse(e.data);
+      $('[data-push-count]').each(function () {
+        var key = $(this).data('push-count');
+        if (key in counts) {
+          $(this).text(counts[key]);
+        }
+      });
+    });
+
+    source.addEventListener('host', function (e) {
+      var change = JSON.parse(e.data);
+      var row = $('tr[data-push-host="' + change.id + '"]');
+      if (change.op === 'delete') {
+        row.css('opacity', 0.4);
+        return;
+      }
+      var h = change.doc;
+      if (h.draining === 'true') {
+        row.find('[data-push-field="status"]').html(colored('draining', 'orange'));
+      } else {
+        row.find('[data-push-field="status"]').html(
+          colored(h.status, h.status === 'active' ? 'green' : 'red'));
+      }
+      row.find('[data-push-field="clusters"]').text(h.clusters);
+      row.css('background-color', h.schedulable === 'false' ? 'lightgray' : '');
+    });
+
+    source.addEventListener('cluster', function (e) {
+      var change = JSON.parse(e.data);
+      var row = $('tr[data-push-cluster="' + change.id + '"]');
+      if (change.op === 'delete') {
+        row.css('opacity', 0.4);
+        return;
+      }
+      var c = change.doc;
+      row.find('[data-push-field="status"]').html(
+        colored(c.status, c.status === 'running' ? 'green' : 'red'));
+      row.find('[data-push-field="health"]').html(
+        colored(c.health, c.health === 'OK' ? 'green' : 'red'));
+      row.filter('[data-push-shade]').css(
+        'background-color', c.user_id ? 'lightgray' : '');
+    });
+
+    // some changes were missed, e.g., reconnected to mongo
+    source.addEventListener('reset', function () {
+      location.reload(true);
+    });
+  }
 });
@@ -3,8 +3,11 @@ import logging
 
 from threading import Thread
 
-from modules import host_handler, cluster_handler
-from common import LOG_LEVEL, log_handler, SYS_DELETER, SYS_USER
+from modules import host_handler, cluster_handler, retention_handler, \
+    capacity_handler, job_handler, counter_handler, series_handler
+from common import LOG_LEVEL, log_handler, SYS_DELETER, SYS_USER, \
+    RETENTION_CHECK_INTERVAL, COUNTER_SYNC_INTERVAL, WATCHDOG_CYCLE, \
+    CAPACITY_CHECK_INTERVAL, serve_metrics
 
 logger = logging.getLogger(__name__)
 logger.setLevel(LOG_LEVEL)
@@ -22,11 +25,11 @@ def chain_check_health(chain_id, retries=3, period=5):
     """
     chain = cluster_handler.get_by_id(chain_id)
     if not chain:
-        logger.warning("Not find chain {}".format(chain_id))
+        logger.warning("Not find chain %s", chain_id)
         return
     chain_user_id = chain.get("user_id")
     chain_name = chain.get("name")
-    logger.debug("Chain {}/{}: checking health".format(chain_name, chain_id))
+    logger.debug("Chain %s/%s: checking health", chain_name, chain_id)
 
     # we should never process in-processing chains unless deleting one
     if chain_user_id.startswith(SYS_USER):
@@ -36,8 +39,8 @@ def chain_check_health(chain_id, retries=3, period=5):
                 if cluster_handler.get_by_id(chain_id).get("user_id") != \
                         chain_user_id:
                     return
-            logger.info("Delete in-deleting chain {}/{}".format(
-                chain_name, chain_id))
+            logger.info("Delete in-deleting chain %s/%s",
+                        chain_name, chain_id)
             cluster_handler.delete(chain_id)
         return
 
@@ -47,11 +50,11 @@ def chain_check_health(chain_id, retries=3, period=5):
             return
         else:
             time.sleep(period)
-    logger.warning("Chain {}/{} is unhealthy!".format(chain_name, chain_id))
+    logger.warning("Chain %s/%s is unhealthy!", chain_name, chain_id)
     # only reset free chains
     if cluster_handler.get_by_id(chain_id).get("user_id") == "":
-        logger.info("Resetting free unhealthy chain {}/{}".format(
-            chain_name, chain_id))
+        logger.info("Resetting free unhealthy chain %s/%s",
+                    chain_name, chain_id)
         cluster_handler.reset_free_one(chain_id)
 
 
@@ -62,8 +65,8 @@ def host_check_chains(host_id):
     :param host_id:
     :return:
     """
-    logger.debug("Host {}/{}: checking chains".format(
-        host_handler.get_by_id(host_id).get('name'), host_id))
+    logger.debug("Host %s/%s: checking chains",
+                 host_handler.get_by_id(host_id).get('name'), host_id)
     clusters = cluster_handler.list(filter_data={"host_id": host_id,
                                                  "status": "running"})
     for c in clusters:  # concurrent health check is safe for multi-chains
@@ -72,21 +75,53 @@ def host_check_chains(host_id):
         t.join(timeout=15)
 
 
-def host_check_fillup(host_id):
+def host_check_capacity(host_id):
     """
-    Check one host.
+    Update the effective capacity of the host by its resources.
 
     :param host_id:
     :return:
     """
-    host = host_handler.get_by_id(host_id)
-    if host.get("autofill") == "true":
-        logger.info("Host {}/{}: checking auto-fillup".format(
-            host_handler.get_by_id(host_id).get('name'), host_id))
-        host_handler.fillup(host_id)
+    capacity = capacity_handler.observe(host_id)
+    logger.debug("Host %s: effective capacity=%s", host_id, capacity)
 
 
-def host_check(host_id, retries=3, period=3):
+def host_check_drain(host_id):
+    """
+    Keep draining the host until no cluster is left.
+
+    Free clusters left behind, e.g., by failed moves, are drained again.
+
+    :param host_id:
+    :return:
+    """
+    h = host_handler.get_by_id(host_id)
+    if h.get("draining") != "true":
+        return
+    if not h.get("clusters"):
+        logger.info("Host %s/%s: drained", h.get("name"), host_id)
+        return
+    if host_id in job_handler.busy_hosts("drain"):  # stale jobs not counted
+        return
+    if cluster_handler.count({"host_id": host_id, "user_id": ""}):
+        logger.info("Host %s/%s: draining free clusters",
+                    h.get("name"), host_id)
+        host_handler.drain(host_id)
+
+
+def pool_check_fillup():
+    """
+    Replenish the free clusters on all autofill hosts.
+
+    :return:
+    """
+    logger.info("Pool: checking auto-fillup")
+    num_new = host_handler.fillup_pool()
+    if num_new:
+        logger.info("Pool: creating %s clusters", num_new)
+
+
+def host_check(host_id, retries=3, period=3, capacity=True):
     """
     Run check on specific host.
     Check status and check each chain's health.
@@ -94,19 +129,46 @@ def host_check(host_id, retries=3, period=3):
     :param host_id: id of the checked host
     :param retries: how many retries before thnking it's inactive
     :param period: retry wait
+    :param capacity: whether to check the capacity too
     :return:
     """
     for _ in range(retries):
         if host_handler.refresh_status(host_id):  # host is active
-            logger.debug("Host {}/{} is active, start checking".format(
-                host_handler.get_by_id(host_id).get('name'), host_id))
+            logger.debug("Host %s/%s is active, start checking",
+                         host_handler.get_by_id(host_id).get('name'), host_id)
             host_check_chains(host_id)
-            time.sleep(period)
-            host_check_fillup(host_id)
+            if capacity:
+                host_check_capacity(host_id)
+            host_check_drain(host_id)
             break
         time.sleep(period)
 
 
+def released_check():
+    """
+    Roll up the expired released records.
+
+    :return:
+    """
+    try:
+        retention_handler.rollup()
+    except Exception as e:
+        logger.error("Error to roll up released records: %s", e)
+
+
+def counters_check():
+    """
+    Recount the pool counters in case of drifts.
+
+    :return:
+    """
+    try:
+        pool = counter_handler.sync()
+        logger.info("Pool counters: %s", pool)
+    except Exception as e:
+        logger.error("Error to sync the pool counters: %s", e)
+
+
 def watch_run(period=15):
     """
     Run the checking in period.
@@ -114,14 +176,32 @@ def watch_run(period=15):
     :param period: Wait period between two checking
     :return:
     """
+    serve_metrics()
+    sampler = Thread(target=series_handler.run)
+    sampler.daemon = True
+    sampler.start()
+    last_rollup, last_sync, last_capacity = 0, 0, 0
     while True:
+        start = time.time()
+        if time.time() - last_rollup >= RETENTION_CHECK_INTERVAL:
+            released_check()
+            last_rollup = time.time()
+        if time.time() - last_sync >= COUNTER_SYNC_INTERVAL:
+            counters_check()
+            last_sync = time.time()
+        capacity = time.time() - last_capacity >= CAPACITY_CHECK_INTERVAL
+        if capacity:
+            last_capacity = time.time()
         logger.info("Watchdog run checks with period = %d s", period)
         hosts = list(host_handler.list())
-        logger.info("Found {} hosts".format(len(hosts)))
+        logger.info("Found %s hosts", len(hosts))
         for h in hosts:  # operating on different host is safe
-            t = Thread(target=host_check, args=(h.get("id"),))
+            t = Thread(target=host_check, args=(h.get("id"),),
+                       kwargs={"capacity": capacity})
             t.start()
             t.join(timeout=2 * period)
+        pool_check_fillup()
+        WATCHDOG_CYCLE.observe(time.time() - start)
         time.sleep(period)
 
 
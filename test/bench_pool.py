@@ -0,0 +1,246 @@
+# Benchmark the hot functions of the cluster/host handlers at pool scale.
+# A scratch db on MONGO_URL is filled with synthetic pools of each size,
+# then each function is timed and its mongo round trips are counted. Results
+# can be saved as json and compared with those of another commit.
+# The hosts point to no daemon unless fake ones are given (see
+# test/fake_docker.py), then release_cluster_for_user only times the db work
+# around the failed compose calls.
+# Usage: MONGO_URL=mongodb://127.0.0.1:27017 \
+#        python test/bench_pool.py [--clusters 1000 10000 100000] \
+#        [--hosts 10 100 1000] [--rounds 10] [--daemon-net 127.1] \
+#        [--save results.json] [--compare results.json]
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from pymongo import monitoring
+
+os.environ.setdefault('MONGO_DB', 'bench_pool')
+os.environ.setdefault('STAT_CACHE_TTL', '0')  # measure the db work
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+
+class RoundTrips(monitoring.CommandListener):
+    """
+    Count the mongo commands sent by the benchmark thread, by command, so
+    the ones of the background threads, e.g., following the changelog, are
+    not counted.
+    """
+    def __init__(self):
+        self.commands = {}
+        self.thread_id = threading.current_thread().ident
+
+    def started(self, event):
+        if threading.current_thread().ident == self.thread_id:
+            self.commands[event.command_name] = \
+                self.commands.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+round_trips = RoundTrips()
+monitoring.register(round_trips)  # before the client of common is made
+
+from common import db, CONSENSUS_TYPES, CLUSTER_SIZES, CLUSTER_PORT_START, \
+    CLUSTER_PORT_STEP, PEER_SERVICE_PORTS, CA_SERVICE_PORTS
+from modules import cluster_handler, host_handler, stat_handler, \
+    counter_handler
+
+COLLECTIONS = ['host', 'cluster_active', 'cluster_released', 'counter']
+
+
+def make_pool(clusters_number, hosts_number, daemon_net='', applied=0.5,
+              seed=0):
+    """
+    Insert synthetic hosts and clusters, as made by the handlers.
+
+    :param clusters_number: number of clusters
+    :param hosts_number: number of hosts
+    :param daemon_net: first bytes of the ips of fake daemons, e.g., 127.1
+    :param applied: fraction of the clusters applied by users
+    :param seed: random seed
+    :return: None
+    """
+    rand = random.Random(seed)
+    for name in COLLECTIONS:
+        db[name].drop()
+    hosts = []
+    for i in range(hosts_number):
+        ip = '{}.{}.{}'.format(daemon_net, i // 254, i % 254 + 1) \
+            if daemon_net else '127.0.0.1'
+        hosts.append({
+            'id': 'h{}'.format(i), 'name': 'host{}'.format(i),
+            'daemon_url': 'tcp://{}:{}'.format(
+                ip, 2375 if daemon_net else 1),
+            'create_ts': datetime.datetime.now(), 'clusters': [],
+            'capacity': -(-clusters_number // hosts_number),
+            'status': 'active', 'type': 'single', 'log_level': 'INFO',
+            'log_type': 'local', 'log_server': '', 'autofill': 'false',
+            'schedulable': 'true', 'autocapacity': 'false',
+            'effective_capacity': 0, 'resources': {}, 'draining': 'false'})
+    clusters = []
+    for j in range(clusters_number):
+        h = hosts[j % hosts_number]
+        ip = h['daemon_url'].split(':')[1][2:]
+        start_port = CLUSTER_PORT_START + \
+            len(h['clusters']) % 1000 * CLUSTER_PORT_STEP
+        ports = dict((k, v - PEER_SERVICE_PORTS['rest'] + start_port)
+                     for k, v in list(PEER_SERVICE_PORTS.items()) +
+                     list(CA_SERVICE_PORTS.items()))
+        plugin, mode = rand.choice(CONSENSUS_TYPES)
+        user_id = 'u{}'.format(j) if rand.random() < applied else ''
+        c = {'id': 'c{}'.format(j), 'name': 'cluster{}'.format(j),
+             'user_id': user_id, 'host_id': h['id'],
+             'daemon_url': h['daemon_url'], 'consensus_plugin': plugin,
+             'consensus_mode': mode, 'create_ts': datetime.datetime.now(),
+             'apply_ts': datetime.datetime.now() if user_id else '',
+             'release_ts': '', 'duration': '', 'mapped_ports': ports,
+             'service_url': dict((k, '{}:{}'.format(ip, v))
+                                 for k, v in ports.items()),
+             'size': rand.choice(CLUSTER_SIZES),
+             'containers': ['{}_vp{}'.format(j, n) for n in range(4)],
+             'status': 'running', 'health': 'OK', 'spans': {}}
+        h['clusters'].append(c['id'])
+        clusters.append(c)
+    db.host.insert_many(hosts)
+    for k in range(0, len(clusters), 10000):
+        db.cluster_active.insert_many(clusters[k:k + 10000])
+    counter_handler.sync()
+    for handler in (cluster_handler, host_handler, stat_handler):
+        handler.cache.invalidate()
+
+
+def bench(name, func, rounds):
+    """
+    Time a function and count its round trips.
+
+    :param name: name of the benchmark
+    :param func: func(n) to run for the n-th round
+    :param rounds: how many rounds
+    :return: dict of the result
+    """
+    round_trips.commands.clear()
+    t = time.time()
+    for n in range(rounds):
+        func(n)
+    cost = (time.time() - t) / rounds
+    commands = dict((k, v / float(rounds))
+                    for k, v in round_trips.commands.items())
+    return {'func': name, 'ms': cost * 1000,
+            'round_trips': sum(commands.values()), 'commands': commands}
+
+
+def run(clusters_number, hosts_number, rounds, daemon_net=''):
+    """
+    Run all the benchmarks on one pool.
+
+    :return: list of the results
+    """
+    make_pool(clusters_number, hosts_number, daemon_net)
+    rand = random.Random(1)
+    host_ids = ['h{}'.format(i) for i in range(hosts_number)]
+    doc = db.cluster_active.find_one({}, {'_id': 0})
+    users = ['bench{}'.format(n) for n in range(rounds)]
+    benches = [
+        ('find_free_start_ports', lambda n: cluster_handler.
+         find_free_start_ports(rand.choice(host_ids), 1)),
+        ('apply_cluster', lambda n: cluster_handler.apply_cluster(
+            users[n])),
+        ('apply_cluster_again', lambda n: cluster_handler.apply_cluster(
+            users[n])),
+        ('list_user', lambda n: cluster_handler.list({'user_id': users[n]})),
+        ('list_host', lambda n: cluster_handler.list(
+            {'host_id': rand.choice(host_ids)})),
+        ('list_all', lambda n: cluster_handler.list()),
+        ('_serialize_x1000', lambda n: [cluster_handler._serialize(doc)
+                                        for _ in range(1000)]),
+        ('host_list', lambda n: host_handler.list({
+            'status': 'active', 'schedulable': 'true'})),
+        ('stat_clusters', lambda n: stat_handler.clusters()),
+        ('release_cluster_for_user', lambda n: cluster_handler.
+         release_cluster_for_user(users[n])),
+    ]
+    results = []
+    for name, func in benches:
+        r = bench(name, func, rounds)
+        r.update(clusters=clusters_number, hosts=hosts_number)
+        print("{:>7} {:>5} {:<26} {:>10.3f} {:>8.1f}".format(
+            clusters_number, hosts_number, name, r['ms'],
+            r['round_trips']))
+        results.append(r)
+    return results
+
+
+def compare(results, former):
+    """
+    Print the changes against the results of another commit.
+
+    :param results: list of the results
+    :param former: dict of the former run
+    :return: None
+    """
+    old = dict(((r['clusters'], r['hosts'], r['func']), r)
+               for r in former['results'])
+    print("vs {}".format(former.get('commit', '?')))
+    for r in results:
+        o = old.get((r['clusters'], r['hosts'], r['func']))
+        if o:
+            print("{:>7} {:>5} {:<26} {:>+9.1%} {:>+8.1f}".format(
+                r['clusters'], r['hosts'], r['func'],
+                r['ms'] / o['ms'] - 1 if o['ms'] else 0,
+                r['round_trips'] - o['round_trips']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clusters', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--hosts', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--daemon-net', default='',
+                        help='first bytes of the ips of fake daemons')
+    parser.add_argument('--save', default='', help='file to save results')
+    parser.add_argument('--compare', default='',
+                        help='file of the results to compare with')
+    args = parser.parse_args()
+    print("{:>7} {:>5} {:<26} {:>10} {:>8}".format(
+        'pool', 'hosts', 'function', 'ms/call', 'trips'))
+    results = []
+    for clusters_number in args.clusters:
+        for hosts_number in args.hosts:
+            if hosts_number <= clusters_number:
+                results.extend(run(clusters_number, hosts_number,
+                                   args.rounds, args.daemon_net))
+    for name in COLLECTIONS:
+        db[name].drop()
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ''
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'commit': commit, 'time': time.time(),
+                       'rounds': args.rounds, 'results': results}, f,
+                      indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Benchmark the json responses against a large synthetic cluster list.
+# No db is needed, the clusters are made as serialized by the handler.
+# Usage: python test/bench_response.py [clusters_number] [rounds]
+
+from __future__ import print_function
+
+import datetime
+import os
+import sys
+import time
+
+from flask import Flask, jsonify
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+from common import CONSENSUS_TYPES, CLUSTER_SIZES, json_dumps, \
+    json_response, ok_body
+
+
+def make_clusters(clusters_number):
+    """
+    Make synthetic clusters as listed by the cluster handler.
+
+    :param clusters_number: number of clusters
+    :return: list of dict
+    """
+    now = datetime.datetime.now()
+    clusters = []
+    for i in range(clusters_number):
+        plugin, mode = CONSENSUS_TYPES[i % len(CONSENSUS_TYPES)]
+        size = CLUSTER_SIZES[i % len(CLUSTER_SIZES)]
+        clusters.append({
+            'id': 'c{:024d}'.format(i), 'name': 'cluster_{}'.format(i),
+            'user_id': 'u{}'.format(i) if i % 2 else '',
+            'host_id': 'h{}'.format(i // 100),
+            'consensus_plugin': plugin, 'consensus_mode': mode,
+            'daemon_url': 'tcp://10.0.0.{}:2375'.format(i % 250),
+            'create_ts': now, 'apply_ts': now if i % 2 else '',
+            'release_ts': '', 'duration': '',
+            'containers': ['c{}_vp{}'.format(i, n) for n in range(size)],
+            'size': size, 'status': 'running', 'health': 'OK',
+            'mapped_ports': dict(('vp{}_rest'.format(n), 7050 + n)
+                                 for n in range(size)),
+            'service_url': dict(('vp{}'.format(n), '10.0.0.1:{}'.format(
+                7050 + n)) for n in range(size)),
+            'spans': {'create': {'total': 1.5, 'phases': {'compose_up': 1.2}}},
+        })
+    return clusters
+
+
+def bench(name, func, rounds):
+    t = time.time()
+    for _ in range(rounds):
+        size = func()
+    cost = (time.time() - t) / rounds
+    print("{:<24} {:>10.1f} ms {:>10.1f} KB".format(
+        name, cost * 1000, size / 1024.0))
+
+
+if __name__ == '__main__':
+    clusters_number = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    body = ok_body(data=make_clusters(clusters_number))
+    app = Flask(__name__)
+    with app.app_context():
+        bench("flask jsonify", lambda: len(jsonify(body).get_data()),
+              rounds)
+        bench("json_dumps", lambda: len(json_dumps(body)), rounds)
+        bench("json_response streamed", lambda: sum(
+            len(c) for c in json_response(body).response), rounds)
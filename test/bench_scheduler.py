@@ -0,0 +1,77 @@
+# Benchmark the placement engine with synthetic hosts, no db is touched.
+# Usage: python test/bench_scheduler.py [hosts_number] [placements_number]
+
+from __future__ import print_function
+
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+from common import CONSENSUS_TYPES, CLUSTER_SIZES, SCHEDULER_STRATEGIES
+from modules.scheduler import HostScheduler
+
+PROFILES = [(p, m, s) for p, m in CONSENSUS_TYPES for s in CLUSTER_SIZES]
+
+
+def make_pool(hosts_number, seed=0):
+    """
+    Generate synthetic hosts and clusters.
+
+    :param hosts_number: number of hosts
+    :param seed: random seed
+    :return: hosts, clusters
+    """
+    rand = random.Random(seed)
+    hosts, clusters = [], []
+    for i in range(hosts_number):
+        capacity = rand.choice([10, 20, 50, 100])
+        h = {'id': 'h{}'.format(i), 'status': 'active', 'autofill': 'true',
+             'capacity': capacity, 'clusters': []}
+        for j in range(rand.randint(0, capacity - 1)):
+            p = rand.choice(PROFILES)
+            c = {'id': 'h{}_c{}'.format(i, j), 'host_id': h['id'],
+                 'consensus_plugin': p[0], 'consensus_mode': p[1],
+                 'size': p[2]}
+            h['clusters'].append(c['id'])
+            clusters.append(c)
+        hosts.append(h)
+    return hosts, clusters
+
+
+def bench(strategy, hosts, clusters, placements_number):
+    """
+    Time the selections with reservations over the pool.
+
+    :return: seconds of loading, seconds per placement
+    """
+    scheduler = HostScheduler(strategy=strategy)
+    start = time.time()
+    scheduler.load(hosts, clusters)
+    scheduler.loaded = True
+    load_time = time.time() - start
+    rand = random.Random(1)
+    start = time.time()
+    for i in range(placements_number):
+        profile = rand.choice(PROFILES)
+        host_id = scheduler.select(profile)
+        if not host_id:
+            break
+        scheduler.reserve(host_id, profile)
+        if i % 10 == 0:  # some creations fail
+            scheduler.record_result(host_id, profile, False)
+    return load_time, (time.time() - start) / placements_number
+
+
+if __name__ == '__main__':
+    hosts_number = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    placements_number = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    hosts, clusters = make_pool(hosts_number)
+    print("{} hosts, {} clusters, {} placements".format(
+        len(hosts), len(clusters), placements_number))
+    for strategy in SCHEDULER_STRATEGIES:
+        load_time, per_op = bench(strategy, hosts, clusters,
+                                  placements_number)
+        print("{:>14}: load {:.3f} s, {:.1f} us per placement".format(
+            strategy, load_time, per_op * 1e6))
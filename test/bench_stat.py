@@ -0,0 +1,88 @@
+# Benchmark the host/cluster stats against a large synthetic pool.
+# A scratch db on MONGO_URL is filled and dropped, default as `bench_stat`.
+# Usage: MONGO_URL=mongodb://127.0.0.1:27017 \
+#        python test/bench_stat.py [clusters_number] [rounds]
+
+from __future__ import print_function
+
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('MONGO_DB', 'bench_stat')
+os.environ.setdefault('STAT_CACHE_TTL', '0')  # measure the db work
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+from common import db, CONSENSUS_TYPES, CLUSTER_SIZES, HOST_TYPES, \
+    CONSENSUS_PLUGINS, CONSENSUS_MODES
+from modules import stat_handler
+
+
+def make_pool(clusters_number, per_host=100, seed=0):
+    """
+    Insert synthetic hosts and clusters.
+
+    :param clusters_number: number of clusters
+    :param per_host: clusters on each host
+    :param seed: random seed
+    :return: None
+    """
+    rand = random.Random(seed)
+    db.host.drop()
+    db.cluster_active.drop()
+    hosts, clusters = [], []
+    for i in range(0, clusters_number, per_host):
+        host_id = 'h{}'.format(i)
+        hosts.append({'id': host_id, 'type': rand.choice(HOST_TYPES),
+                      'status': rand.choice(['active', 'inactive'])})
+        for j in range(i, min(i + per_host, clusters_number)):
+            plugin, mode = rand.choice(CONSENSUS_TYPES)
+            clusters.append({
+                'id': 'c{}'.format(j), 'host_id': host_id,
+                'user_id': rand.choice(['', 'u{}'.format(j)]),
+                'consensus_plugin': plugin, 'consensus_mode': mode,
+                'size': rand.choice(CLUSTER_SIZES), 'containers': [],
+                'service_url': {}, 'mapped_ports': {}})
+    db.host.insert_many(hosts)
+    for k in range(0, len(clusters), 10000):
+        db.cluster_active.insert_many(clusters[k:k + 10000])
+
+
+def list_clusters():
+    """
+    Count the clusters by full lists, as before the aggregation.
+
+    :return: number of lists run
+    """
+    col, filters = db.cluster_active, [{}, {'user_id': ''}]
+    for plugin in CONSENSUS_PLUGINS:
+        if plugin == CONSENSUS_PLUGINS[0]:
+            filters.append({'consensus_plugin': plugin})
+        else:
+            filters.extend({'consensus_plugin': plugin,
+                            'consensus_mode': mode}
+                           for mode in CONSENSUS_MODES)
+    for f in filters:
+        len(list(col.find(f)))
+    return len(filters)
+
+
+def bench(name, func, rounds):
+    t = time.time()
+    for _ in range(rounds):
+        func()
+    cost = (time.time() - t) / rounds
+    print("{:<24} {:>10.1f} ms".format(name, cost * 1000))
+
+
+if __name__ == '__main__':
+    clusters_number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print("Filling {} clusters".format(clusters_number))
+    make_pool(clusters_number)
+    bench("clusters by lists", list_clusters, rounds)
+    bench("clusters by aggregation", stat_handler.clusters, rounds)
+    bench("hosts by aggregation", stat_handler.hosts, rounds)
+    print(stat_handler.clusters())
+    db.host.drop()
+    db.cluster_active.drop()
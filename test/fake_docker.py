@@ -0,0 +1,629 @@
+# Fake docker daemons and fabric peers, to run cello at scale offline.
+# Each fake host listens on its own loopback ip, e.g., 127.1.0.1:2375, for
+# the docker engine api used by the agent and compose: ping, version, info,
+# containers, images, networks, volumes and events. Started containers with
+# the peer rest port mapped serve `/network/peers` on the mapped port of the
+# same ip, listing the running peers of their project, so the health checks
+# of the watchdog pass once all peers are up.
+# Usage: python test/fake_docker.py [--hosts 100] [--net 127.1] \
+#        [--latency 0.01] [--pull-latency 1] [--failure 0.01] \
+#        [--register http://127.0.0.1:8080 --capacity 20 --autofill]
+# Raise the open files limit (ulimit -n) over the number of clusters.
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+
+import requests
+from aiohttp import web
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+from common import PEER_SERVICE_PORTS
+
+API_VERSION = '1.24'
+DAEMON_PORT = 2375
+PEER_PORT = '{}/tcp'.format(PEER_SERVICE_PORTS['rest'])
+PROJECT_LABEL = 'com.docker.compose.project'
+SERVICE_LABEL = 'com.docker.compose.service'
+
+
+def make_id(*parts):
+    return hashlib.sha256('|'.join(
+        [str(p) for p in parts] + [str(random.random())]).encode(
+        'utf-8')).hexdigest()
+
+
+def now_iso():
+    return datetime.datetime.utcnow().isoformat() + 'Z'
+
+
+def error(status, message):
+    return web.json_response({'message': message}, status=status)
+
+
+class FakeDaemon(object):
+    """
+    State and api of one fake docker host.
+    """
+    def __init__(self, ip, latency=0.0, pull_latency=0.0, failure=0.0,
+                 ncpu=8, mem_total=16 * 1024 ** 3):
+        self.ip = ip
+        self.latency, self.pull_latency = latency, pull_latency
+        self.failure = failure
+        self.ncpu, self.mem_total = ncpu, mem_total
+        self.containers = {}  # id -> container
+        self.images = {}  # repo:tag -> image
+        self.networks = {}  # id -> network
+        self.volumes = {}  # name -> volume
+        self.events = []
+        self.listeners = set()  # queues of the event streams
+        self.peers = {}  # host port -> (site, container id)
+        for name, driver in (('bridge', 'bridge'), ('host', 'host'),
+                             ('none', 'null')):
+            self._add_network(name, driver)
+
+    def routes(self):
+        """
+        Get the api routes, paths without the version prefix.
+
+        :return: list of (method, path regex, handler)
+        """
+        c, i, n, v = r'/containers/(?P<id>[^/]+)', r'/images/(?P<name>.+)', \
+            r'/networks/(?P<id>[^/]+)', r'/volumes/(?P<name>[^/]+)'
+        return [
+            ('GET', r'/_ping', self.ping),
+            ('GET', r'/version', self.version),
+            ('GET', r'/info', self.info),
+            ('GET', r'/events', self.stream_events),
+            ('GET', r'/containers/json', self.list_containers),
+            ('POST', r'/containers/create', self.create_container),
+            ('GET', c + r'/json', self.inspect_container),
+            ('GET', c + r'/stats', self.container_stats),
+            ('GET', c + r'/logs', self.container_logs),
+            ('POST', c + r'/(?P<action>start|stop|restart|kill|pause|'
+                         r'unpause)', self.container_action),
+            ('POST', c + r'/wait', self.wait_container),
+            ('POST', c + r'/rename', self.rename_container),
+            ('DELETE', c, self.remove_container),
+            ('GET', r'/images/json', self.list_images),
+            ('POST', r'/images/create', self.pull_image),
+            ('GET', i + r'/json', self.inspect_image),
+            ('DELETE', i, self.remove_image),
+            ('GET', r'/networks', self.list_networks),
+            ('POST', r'/networks/create', self.create_network),
+            ('POST', n + r'/(?P<action>connect|disconnect)',
+             self.connect_network),
+            ('GET', n, self.inspect_network),
+            ('DELETE', n, self.remove_network),
+            ('GET', r'/volumes', self.list_volumes),
+            ('POST', r'/volumes/create', self.create_volume),
+            ('GET', v, self.inspect_volume),
+            ('DELETE', v, self.remove_volume),
+        ]
+
+    def emit(self, kind, action, actor_id, attributes=None):
+        event = {'Type': kind, 'Action': action, 'status': action,
+                 'id': actor_id, 'time': int(time.time()),
+                 'timeNano': int(time.time() * 1e9),
+                 'Actor': {'ID': actor_id, 'Attributes': attributes or {}}}
+        if kind == 'container':
+            event['from'] = attributes.get('image', '')
+        self.events.append(event)
+        del self.events[:-1000]
+        for q in self.listeners:
+            q.put_nowait(event)
+
+    # system
+
+    async def ping(self, request, **kwargs):
+        return web.Response(text='OK')
+
+    async def version(self, request, **kwargs):
+        return web.json_response({
+            'Version': '1.12.6', 'ApiVersion': API_VERSION,
+            'MinAPIVersion': '1.12', 'Os': 'linux', 'Arch': 'amd64',
+            'KernelVersion': 'fake', 'GoVersion': 'go1.6'})
+
+    async def info(self, request, **kwargs):
+        running = sum(1 for c in self.containers.values()
+                      if c['State']['Running'])
+        return web.json_response({
+            'ID': self.ip, 'Name': 'fake-' + self.ip,
+            'ServerVersion': '1.12.6', 'Containers': len(self.containers),
+            'ContainersRunning': running,
+            'ContainersStopped': len(self.containers) - running,
+            'Images': len(self.images), 'NCPU': self.ncpu,
+            'MemTotal': self.mem_total, 'OperatingSystem': 'fake'})
+
+    async def stream_events(self, request, **kwargs):
+        since = float(request.query.get('since') or 0)
+        until = request.query.get('until')
+        response = web.StreamResponse()
+        response.content_type = 'application/json'
+        await response.prepare(request)
+        for e in self.events:
+            if e['time'] >= since and (not until or e['time'] <= float(
+                    until)):
+                await response.write(json.dumps(e).encode() + b'\n')
+        if until:
+            return response
+        q = asyncio.Queue()
+        self.listeners.add(q)
+        try:
+            while True:
+                e = await q.get()
+                await response.write(json.dumps(e).encode() + b'\n')
+        finally:
+            self.listeners.discard(q)
+
+    # containers
+
+    def find_container(self, ref):
+        ref = ref.lstrip('/')
+        if ref in self.containers:
+            return self.containers[ref]
+        for c in self.containers.values():
+            if c['Name'] == '/' + ref or c['Id'].startswith(ref):
+                return c
+        return None
+
+    def _matches(self, c, filters):
+        labels = c['Config'].get('Labels') or {}
+        for f in filters.get('label', []):
+            k, _, v = f.partition('=')
+            if k not in labels or (v and labels[k] != v):
+                return False
+        names = filters.get('name', [])
+        if names and not any(re.search(n, c['Name']) for n in names):
+            return False
+        status = filters.get('status', [])
+        if status and c['State']['Status'] not in status:
+            return False
+        ids = filters.get('id', [])
+        if ids and not any(c['Id'].startswith(i) for i in ids):
+            return False
+        return True
+
+    def _summary(self, c):
+        return {
+            'Id': c['Id'], 'Names': [c['Name']], 'Image': c['Config'][
+                'Image'], 'ImageID': c['Image'], 'Command': '',
+            'Created': c['CreatedTs'], 'State': c['State']['Status'],
+            'Status': 'Up' if c['State']['Running'] else 'Exited (0)',
+            'Ports': [
+                {'PrivatePort': int(p.split('/')[0]), 'Type': 'tcp',
+                 'IP': '0.0.0.0', 'PublicPort': int(b[0]['HostPort'])}
+                for p, b in (c['HostConfig'].get('PortBindings') or
+                             {}).items() if b and b[0].get('HostPort')],
+            'Labels': c['Config'].get('Labels') or {},
+            'HostConfig': {'NetworkMode': c['HostConfig'].get(
+                'NetworkMode', 'default')},
+            'NetworkSettings': c['NetworkSettings'], 'Mounts': []}
+
+    async def list_containers(self, request, **kwargs):
+        filters = json.loads(request.query.get('filters') or '{}')
+        filters = dict((k, v if isinstance(v, list) else list(v))
+                       for k, v in filters.items())
+        show_all = request.query.get('all') in ('1', 'true', 'True')
+        return web.json_response([
+            self._summary(c) for c in self.containers.values()
+            if (show_all or c['State']['Running']) and
+            self._matches(c, filters)])
+
+    async def create_container(self, request, **kwargs):
+        config = await request.json()
+        name = request.query.get('name') or make_id()[:12]
+        if self.find_container(name):
+            return error(409, 'Conflict. The name "/{}" is already in '
+                              'use'.format(name))
+        image = self._find_image(config.get('Image', ''))
+        if not image:
+            return error(404, 'No such image: {}'.format(config.get(
+                'Image')))
+        host_config = config.pop('HostConfig', None) or {}
+        networking = config.pop('NetworkingConfig', None) or {}
+        cid = make_id(self.ip, name)
+        mode = host_config.get('NetworkMode') or 'bridge'
+        networks = dict(networking.get('EndpointsConfig') or {}) or {
+            mode: {}}
+        c = {
+            'Id': cid, 'Name': '/' + name, 'Created': now_iso(),
+            'CreatedTs': int(time.time()), 'Image': image['Id'],
+            'Config': dict(config, Hostname=config.get('Hostname') or
+                           cid[:12]),
+            'HostConfig': host_config, 'Mounts': [],
+            'State': {'Status': 'created', 'Running': False, 'Paused': False,
+                      'Restarting': False, 'OOMKilled': False,
+                      'Dead': False, 'Pid': 0, 'ExitCode': 0, 'Error': '',
+                      'StartedAt': '0001-01-01T00:00:00Z',
+                      'FinishedAt': '0001-01-01T00:00:00Z'},
+            'NetworkSettings': {'Ports': {}, 'Networks': dict(
+                (net, dict(conf or {}, NetworkID=net,
+                           IPAddress='', Gateway=''))
+                for net, conf in networks.items())},
+            'RestartCount': 0, 'Driver': 'overlay2', 'Path': '', 'Args': [],
+        }
+        self.containers[cid] = c
+        self.emit('container', 'create', cid, {
+            'name': name, 'image': config.get('Image', '')})
+        return web.json_response({'Id': cid, 'Warnings': None}, status=201)
+
+    async def inspect_container(self, request, id, **kwargs):
+        c = self.find_container(id)
+        if not c:
+            return error(404, 'No such container: {}'.format(id))
+        return web.json_response(dict(
+            (k, v) for k, v in c.items() if k != 'CreatedTs'))
+
+    async def container_stats(self, request, id, **kwargs):
+        c = self.find_container(id)
+        if not c:
+            return error(404, 'No such container: {}'.format(id))
+        up = c['State']['Running']
+        total = int((time.time() - c['CreatedTs']) * 1e7) if up else 0
+        system = int(time.time() * 1e9) * self.ncpu
+        return web.json_response({
+            'read': now_iso(),
+            'memory_stats': {'usage': 64 * 1024 ** 2 if up else 0,
+                             'limit': self.mem_total},
+            'cpu_stats': {'cpu_usage': {'total_usage': total},
+                          'system_cpu_usage': system,
+                          'online_cpus': self.ncpu},
+            'precpu_stats': {'cpu_usage': {'total_usage': int(total * 0.99)},
+                             'system_cpu_usage': system - int(1e9) *
+                             self.ncpu}})
+
+    async def container_logs(self, request, id, **kwargs):
+        if not self.find_container(id):
+            return error(404, 'No such container: {}'.format(id))
+        return web.Response(body=b'')
+
+    async def container_action(self, request, id, action, **kwargs):
+        c = self.find_container(id)
+        if not c:
+            return error(404, 'No such container: {}'.format(id))
+        state = c['State']
+        if action in ('start', 'restart', 'unpause'):
+            if action == 'start' and state['Running']:
+                return web.Response(status=304)
+            state.update(Status='running', Running=True, Paused=False,
+                         Pid=random.randint(100, 65535), StartedAt=now_iso())
+            await self._serve_peer(c)
+        elif action == 'pause':
+            state.update(Status='paused', Paused=True)
+        else:
+            if not state['Running'] and action == 'stop':
+                return web.Response(status=304)
+            state.update(Status='exited', Running=False, Pid=0,
+                         FinishedAt=now_iso(),
+                         ExitCode=137 if action == 'kill' else 0)
+            await self._stop_peer(c)
+        self.emit('container', action, c['Id'], {
+            'name': c['Name'][1:], 'image': c['Config'].get('Image', '')})
+        return web.Response(status=204)
+
+    async def wait_container(self, request, id, **kwargs):
+        c = self.find_container(id)
+        if not c:
+            return error(404, 'No such container: {}'.format(id))
+        return web.json_response({'StatusCode': c['State']['ExitCode']})
+
+    async def rename_container(self, request, id, **kwargs):
+        c = self.find_container(id)
+        if not c:
+            return error(404, 'No such container: {}'.format(id))
+        c['Name'] = '/' + request.query.get('name', '')
+        return web.Response(status=204)
+
+    async def remove_container(self, request, id, **kwargs):
+        c = self.find_container(id)
+        if not c:
+            return error(404, 'No such container: {}'.format(id))
+        if c['State']['Running']:
+            if request.query.get('force') not in ('1', 'true', 'True'):
+                return error(409, 'You cannot remove a running container')
+            await self._stop_peer(c)
+        del self.containers[c['Id']]
+        self.emit('container', 'destroy', c['Id'], {
+            'name': c['Name'][1:], 'image': c['Config'].get('Image', '')})
+        return web.Response(status=204)
+
+    # peers
+
+    async def _serve_peer(self, c):
+        """
+        Serve the peer rest api on the mapped port of the container.
+        """
+        bindings = (c['HostConfig'].get('PortBindings') or {}).get(PEER_PORT)
+        if not bindings or not bindings[0].get('HostPort'):
+            return
+        port = int(bindings[0]['HostPort'])
+        c['NetworkSettings']['Ports'] = {PEER_PORT: [
+            {'HostIp': '0.0.0.0', 'HostPort': str(port)}]}
+        if port in self.peers:
+            self.peers[port] = (self.peers[port][0], c['Id'])
+            return
+        site = web.TCPSite(self.runner, self.ip, port)
+        await site.start()
+        self.peers[port] = (site, c['Id'])
+
+    async def _stop_peer(self, c):
+        for port, (site, cid) in list(self.peers.items()):
+            if cid == c['Id']:
+                del self.peers[port]
+                await site.stop()
+
+    async def network_peers(self, request, port):
+        """
+        List the running peers of the project of the container on a port.
+        """
+        c = self.containers.get(self.peers[port][1])
+        project = (c['Config'].get('Labels') or {}).get(PROJECT_LABEL)
+        peers = [{'ID': {'name': (p['Config'].get('Labels') or {}).get(
+            SERVICE_LABEL, p['Name'][1:])}, 'address': '{}:{}'.format(
+            self.ip, PEER_SERVICE_PORTS['grpc']), 'type': 1}
+            for p in self.containers.values()
+            if p['State']['Running'] and project and
+            (p['Config'].get('Labels') or {}).get(PROJECT_LABEL) == project]
+        return web.json_response({'peers': peers})
+
+    # images
+
+    def _find_image(self, ref):
+        if not ref:
+            return None
+        if ref in self.images:
+            return self.images[ref]
+        if ':' not in ref.split('/')[-1] and ref + ':latest' in self.images:
+            return self.images[ref + ':latest']
+        for image in self.images.values():
+            if image['Id'] == ref or image['Id'].startswith(
+                    'sha256:' + ref) or image['Id'].startswith(ref):
+                return image
+        return None
+
+    async def list_images(self, request, **kwargs):
+        return web.json_response([
+            {'Id': i['Id'], 'RepoTags': i['RepoTags'], 'ParentId': '',
+             'Created': i['CreatedTs'], 'Size': i['Size'],
+             'VirtualSize': i['Size'], 'Labels': {}, 'RepoDigests': []}
+            for i in self.images.values()])
+
+    async def pull_image(self, request, **kwargs):
+        name = request.query.get('fromImage', '')
+        tag = request.query.get('tag') or 'latest'
+        if ':' in name.split('/')[-1]:
+            name, tag = name.rsplit(':', 1)
+        ref = '{}:{}'.format(name, tag)
+        if self.pull_latency:
+            await asyncio.sleep(self.pull_latency * random.uniform(0.5, 1.5))
+        if ref not in self.images:
+            self.images[ref] = {
+                'Id': 'sha256:' + make_id(ref), 'RepoTags': [ref],
+                'Created': now_iso(), 'CreatedTs': int(time.time()),
+                'Size': 200 * 1024 ** 2, 'Config': {'Labels': {}},
+                'ContainerConfig': {}, 'Architecture': 'amd64',
+                'Os': 'linux', 'RepoDigests': []}
+            self.emit('image', 'pull', ref, {'name': ref})
+        lines = [{'status': 'Pulling from {}'.format(name), 'id': tag},
+                 {'status': 'Digest: sha256:' + self.images[ref]['Id'][7:]},
+                 {'status': 'Status: Downloaded newer image for ' + ref}]
+        return web.Response(body=b''.join(
+            json.dumps(line).encode() + b'\r\n' for line in lines),
+            content_type='application/json')
+
+    async def inspect_image(self, request, name, **kwargs):
+        image = self._find_image(name)
+        if not image:
+            return error(404, 'No such image: {}'.format(name))
+        return web.json_response(dict(
+            (k, v) for k, v in image.items() if k != 'CreatedTs'))
+
+    async def remove_image(self, request, name, **kwargs):
+        image = self._find_image(name)
+        if not image:
+            return error(404, 'No such image: {}'.format(name))
+        for ref in image['RepoTags']:
+            self.images.pop(ref, None)
+        self.emit('image', 'delete', image['Id'], {'name': name})
+        return web.json_response([{'Deleted': image['Id']}])
+
+    # networks and volumes
+
+    def _add_network(self, name, driver):
+        nid = make_id(self.ip, name)
+        self.networks[nid] = {
+            'Name': name, 'Id': nid, 'Scope': 'local', 'Driver': driver,
+            'EnableIPv6': False, 'Internal': False, 'Containers': {},
+            'Options': {}, 'Labels': {},
+            'IPAM': {'Driver': 'default', 'Options': {}, 'Config': []}}
+        return nid
+
+    def find_network(self, ref):
+        for n in self.networks.values():
+            if n['Name'] == ref or n['Id'].startswith(ref):
+                return n
+        return None
+
+    async def list_networks(self, request, **kwargs):
+        filters = json.loads(request.query.get('filters') or '{}')
+        names = filters.get('name', [])
+        return web.json_response([
+            n for n in self.networks.values()
+            if not names or n['Name'] in names])
+
+    async def create_network(self, request, **kwargs):
+        body = await request.json()
+        if self.find_network(body.get('Name', '')):
+            return error(409, 'network with name {} already exists'.format(
+                body.get('Name')))
+        nid = self._add_network(body.get('Name', ''),
+                                body.get('Driver') or 'bridge')
+        self.networks[nid]['Labels'] = body.get('Labels') or {}
+        self.emit('network', 'create', nid, {'name': body.get('Name')})
+        return web.json_response({'Id': nid, 'Warning': ''}, status=201)
+
+    async def inspect_network(self, request, id, **kwargs):
+        n = self.find_network(id)
+        if not n:
+            return error(404, 'network {} not found'.format(id))
+        return web.json_response(n)
+
+    async def connect_network(self, request, id, action, **kwargs):
+        n = self.find_network(id)
+        if not n:
+            return error(404, 'network {} not found'.format(id))
+        body = await request.json()
+        c = self.find_container(body.get('Container', ''))
+        if not c:
+            return error(404, 'No such container')
+        networks = c['NetworkSettings']['Networks']
+        if action == 'connect':
+            networks[n['Name']] = dict(body.get('EndpointConfig') or {},
+                                       NetworkID=n['Id'])
+        else:
+            networks.pop(n['Name'], None)
+        return web.Response(status=200)
+
+    async def remove_network(self, request, id, **kwargs):
+        n = self.find_network(id)
+        if not n:
+            return error(404, 'network {} not found'.format(id))
+        del self.networks[n['Id']]
+        self.emit('network', 'destroy', n['Id'], {'name': n['Name']})
+        return web.Response(status=204)
+
+    async def list_volumes(self, request, **kwargs):
+        return web.json_response({'Volumes': list(self.volumes.values()),
+                                  'Warnings': None})
+
+    async def create_volume(self, request, **kwargs):
+        body = await request.json()
+        name = body.get('Name') or make_id()
+        self.volumes.setdefault(name, {
+            'Name': name, 'Driver': body.get('Driver') or 'local',
+            'Mountpoint': '/var/lib/docker/volumes/{}/_data'.format(name),
+            'Labels': body.get('Labels') or {}, 'Scope': 'local'})
+        return web.json_response(self.volumes[name], status=201)
+
+    async def inspect_volume(self, request, name, **kwargs):
+        if name not in self.volumes:
+            return error(404, 'no such volume: {}'.format(name))
+        return web.json_response(self.volumes[name])
+
+    async def remove_volume(self, request, name, **kwargs):
+        if self.volumes.pop(name, None) is None:
+            return error(404, 'no such volume: {}'.format(name))
+        return web.Response(status=204)
+
+
+class FakeHosts(object):
+    """
+    Serve many fake daemons, each on its own loopback ip.
+    """
+    def __init__(self, daemons):
+        self.daemons = dict((d.ip, d) for d in daemons)
+        self.routes = {}  # ip -> compiled routes
+        for d in daemons:
+            self.routes[d.ip] = [(m, re.compile('^' + p + '$'), h)
+                                 for m, p, h in d.routes()]
+        self.app = web.Application(client_max_size=64 * 1024 ** 2)
+        self.app.router.add_route('*', '/{path:.*}', self.handle)
+        self.runner = web.AppRunner(self.app)
+
+    async def start(self):
+        await self.runner.setup()
+        for d in self.daemons.values():
+            d.runner = self.runner
+            await web.TCPSite(self.runner, d.ip, DAEMON_PORT).start()
+
+    async def handle(self, request):
+        ip, port = request.transport.get_extra_info('sockname')[:2]
+        d = self.daemons[ip]
+        if port != DAEMON_PORT:
+            if request.path == '/network/peers' and port in d.peers:
+                return await d.network_peers(request, port)
+            return error(404, 'not found')
+        if d.latency:
+            await asyncio.sleep(d.latency * random.uniform(0.5, 1.5))
+        path = re.sub(r'^/v[0-9.]+', '', request.path)
+        if request.method in ('POST', 'DELETE') and d.failure and \
+                random.random() < d.failure:
+            return error(500, 'fake daemon failure')
+        for method, pattern, handler in self.routes[ip]:
+            m = pattern.match(path)
+            if m and method == request.method:
+                return await handler(request, **m.groupdict())
+        return error(404, 'page not found')
+
+
+def host_ips(net, number):
+    """
+    Get the loopback ips of the fake hosts.
+
+    :param net: first two bytes of the ips, e.g., 127.1
+    :param number: number of hosts
+    :return: list of ips
+    """
+    return ['{}.{}.{}'.format(net, i // 254, i % 254 + 1)
+            for i in range(number)]
+
+
+def register(url, ips, capacity, autofill):
+    """
+    Add the fake hosts to cello by the dashboard api.
+    """
+    for n, ip in enumerate(ips):
+        data = {'name': 'fake{}'.format(n),
+                'daemon_url': 'tcp://{}:{}'.format(ip, DAEMON_PORT),
+                'capacity': capacity, 'log_type': 'local',
+                'log_server': '', 'log_level': 'INFO',
+                'schedulable': 'on'}
+        if autofill:
+            data['autofill'] = 'on'
+        r = requests.post(url.rstrip('/') + '/api/host', data=data)
+        print("register {} {}".format(data['daemon_url'], r.status_code))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', type=int, default=100)
+    parser.add_argument('--net', default='127.1')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='mean seconds of each api call')
+    parser.add_argument('--pull-latency', type=float, default=0,
+                        help='mean seconds of each image pull')
+    parser.add_argument('--failure', type=float, default=0,
+                        help='rate of the failed changes')
+    parser.add_argument('--register', default='',
+                        help='dashboard url to add the hosts to')
+    parser.add_argument('--capacity', type=int, default=20)
+    parser.add_argument('--autofill', action='store_true')
+    args = parser.parse_args()
+    ips = host_ips(args.net, args.hosts)
+    hosts = FakeHosts([FakeDaemon(ip, args.latency, args.pull_latency,
+                                  args.failure) for ip in ips])
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(hosts.start())
+    print("{} fake hosts at tcp://{}:{} .. tcp://{}:{}".format(
+        len(ips), ips[0], DAEMON_PORT, ips[-1], DAEMON_PORT))
+    if args.register:
+        loop.run_in_executor(None, register, args.register, ips,
+                             args.capacity, args.autofill)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
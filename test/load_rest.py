@@ -0,0 +1,105 @@
+# Load test the restserver, to compare the flask and asyncio ones.
+# Each url is loaded in turn by concurrent clients for some seconds, then
+# the requests/sec and latency percentiles are printed.
+# Usage: python test/load_rest.py http://127.0.0.1:80 http://127.0.0.1:8081 \
+#        [--op clusters|cluster|apply] [--concurrency 64] [--seconds 10]
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import aiohttp
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+from common import percentiles
+
+
+async def pick_cluster_id(session, url):
+    async with session.get(url + '/v2/clusters') as r:
+        clusters = (await r.json())['data']
+    return clusters[0]['id'] if clusters else 'none'
+
+
+def request_of(op, url, cluster_id):
+    """
+    Get the request to send for an operation.
+
+    :param op: clusters, cluster or apply
+    :param url: base url of the restserver
+    :param cluster_id: id of the cluster to query
+    :return: func(n) -> (method, url, params)
+    """
+    if op == 'cluster':
+        return lambda n: ('GET', url + '/v2/cluster/' + cluster_id, {})
+    if op == 'apply':  # a fixed set of users, mostly applied already
+        return lambda n: ('GET', url + '/v2/cluster_op',
+                          {'action': 'apply', 'user_id': 'load{}'.format(
+                              n % 100)})
+    return lambda n: ('GET', url + '/v2/clusters', {})
+
+
+async def worker(session, make_request, deadline, latencies, errors):
+    n = 0
+    while time.time() < deadline:
+        method, url, params = make_request(n)
+        n += 1
+        start = time.time()
+        try:
+            async with session.request(method, url, params=params) as r:
+                await r.read()
+                if r.status >= 500:
+                    errors.append(r.status)
+        except aiohttp.ClientError as e:
+            errors.append(e)
+        latencies.append(time.time() - start)
+
+
+async def load(url, op, concurrency, seconds):
+    """
+    Load one restserver.
+
+    :param url: base url of the restserver
+    :param op: clusters, cluster or apply
+    :param concurrency: number of concurrent clients
+    :param seconds: how long to load
+    :return: dict of the result
+    """
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        make_request = request_of(op, url, await pick_cluster_id(session, url))
+        latencies, errors = [], []
+        deadline = time.time() + seconds
+        await asyncio.gather(*[
+            worker(session, make_request, deadline, latencies, errors)
+            for _ in range(concurrency)])
+    result = dict((k, v * 1000) for k, v in percentiles(
+        latencies or [0], (50, 95, 99, 100)).items())
+    result.update(url=url, rps=len(latencies) / float(seconds),
+                  errors=len(errors))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('--op', default='clusters',
+                        choices=['clusters', 'cluster', 'apply'])
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    print("{:<32} {:>9} {:>9} {:>9} {:>9} {:>9} {:>7}".format(
+        'url', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'errors'))
+    for url in args.urls:
+        r = loop.run_until_complete(load(url.rstrip('/'), args.op,
+                                         args.concurrency, args.seconds))
+        print("{url:<32} {rps:>9.1f} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} "
+              "{p100:>9.1f} {errors:>7}".format(**r))
+
+
+if __name__ == '__main__':
+    main()
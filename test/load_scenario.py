@@ -0,0 +1,319 @@
+# Load test the v2 api of a restserver by realistic scenarios, end to end.
+# Run it against a restserver on a local mongo, with hosts of fake daemons
+# (see test/fake_docker.py) autofilled with clusters. For each scenario the
+# requests/sec, latency percentiles and failure/error rates are printed by
+# operation, with the mongo commands run by the server (from its /metrics).
+# Results can be saved as a baseline, and later runs compared against it.
+# Usage: python test/load_scenario.py http://127.0.0.1:80 \
+#        [--scenario churn burst poll admin] [--admin-url http://...:8080] \
+#        [--concurrency 32] [--seconds 20] [--save baseline.json] \
+#        [--baseline baseline.json] [--tolerance 0.2]
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+
+import aiohttp
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+from common import percentiles
+
+SCENARIOS = ['churn', 'burst', 'poll', 'admin']
+MONGO_COUNT = re.compile(
+    r'^cello_mongo_seconds_count\{command="([^"]+)"\} ([0-9.e+]+)$', re.M)
+
+
+class Recorder(object):
+    """
+    Record the latency and outcome of the requests by operation.
+    """
+    def __init__(self):
+        self.ops = {}  # op -> {'latencies': [], 'fail': n, 'error': n, ...}
+
+    def add(self, op, latency, outcome):
+        """
+        :param op: name of the operation
+        :param latency: seconds
+        :param outcome: ok, fail (4xx), rejected (429) or error (5xx or
+        no response)
+        """
+        r = self.ops.setdefault(op, {'latencies': [], 'ok': 0, 'fail': 0,
+                                     'rejected': 0, 'error': 0})
+        r['latencies'].append(latency)
+        r[outcome] += 1
+
+    def report(self, seconds):
+        """
+        :param seconds: how long the requests were sent
+        :return: dict of op -> results
+        """
+        result = {}
+        for op, r in self.ops.items():
+            n = len(r['latencies'])
+            p = percentiles(r['latencies'], (50, 99, 100))
+            result[op] = {
+                'requests': n, 'rps': n / float(seconds),
+                'p50_ms': p['p50'] * 1000, 'p99_ms': p['p99'] * 1000,
+                'max_ms': p['p100'] * 1000,
+                'fail_rate': r['fail'] / float(n),
+                'rejected_rate': r['rejected'] / float(n),
+                'error_rate': r['error'] / float(n)}
+        return result
+
+
+class Client(object):
+    """
+    Send the requests of a scenario and record them.
+    """
+    def __init__(self, session, url, admin_url, recorder):
+        self.session, self.url, self.admin_url = session, url, admin_url
+        self.recorder = recorder
+
+    async def call(self, op, method, url, params=None):
+        """
+        Send a request.
+
+        :return: tuple of (outcome, json body if ok, otherwise None)
+        """
+        start, outcome, body = time.time(), 'error', None
+        try:
+            async with self.session.request(method, url,
+                                            params=params) as r:
+                data = await r.read()
+                if r.status < 400:
+                    outcome = 'ok'
+                    if r.status == 200 and data:
+                        body = json.loads(data.decode('utf-8'))
+                elif r.status == 429:
+                    outcome = 'rejected'
+                elif r.status < 500:
+                    outcome = 'fail'
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            pass
+        self.recorder.add(op, time.time() - start, outcome)
+        return outcome, body
+
+    async def apply(self, user_id):
+        _, body = await self.call('apply', 'GET', self.url + '/v2/cluster_op',
+                                  {'action': 'apply', 'user_id': user_id})
+        return ((body or {}).get('data') or {}).get('id')
+
+    async def release(self, user_id, cluster_id, retries=3):
+        for _ in range(retries):
+            outcome, _ = await self.call(
+                'release', 'GET', self.url + '/v2/cluster_op',
+                {'action': 'release', 'user_id': user_id,
+                 'cluster_id': cluster_id})
+            if outcome != 'rejected':
+                return
+            await asyncio.sleep(1)  # as told by Retry-After
+
+    async def list(self):
+        _, body = await self.call('list', 'GET', self.url + '/v2/clusters')
+        return [c['id'] for c in (body or {}).get('data') or []]
+
+    async def query(self, cluster_id):
+        await self.call('query', 'GET', self.url + '/v2/cluster/' +
+                        cluster_id)
+
+
+async def churn(client, n, deadline, rand):
+    """
+    Each client applies a cluster, holds it a little and releases it.
+    """
+    user_id = 'churn{}'.format(n)
+    while time.time() < deadline:
+        cluster_id = await client.apply(user_id)
+        if not cluster_id:
+            await asyncio.sleep(0.5)  # no free cluster, as a client would
+            continue
+        await asyncio.sleep(rand.uniform(0, 0.2))
+        await client.release(user_id, cluster_id)
+
+
+async def burst(client, n, deadline, rand, period=5.0):
+    """
+    All the clients apply at once every period, then release.
+    """
+    start, user_id = time.time(), 'burst{}'.format(n)
+    while True:
+        wave = start + period * (int((time.time() - start) / period) + 1)
+        if wave >= deadline:
+            return
+        await asyncio.sleep(wave - time.time())
+        cluster_id = await client.apply(user_id)
+        if cluster_id:
+            await asyncio.sleep(rand.uniform(0, period / 2))
+            await client.release(user_id, cluster_id)
+
+
+async def poll(client, n, deadline, rand):
+    """
+    The clients mostly list and query the clusters, with a few applies.
+    """
+    cluster_ids = await client.list() or ['none']
+    while time.time() < deadline:
+        x = rand.random()
+        if x < 0.5:
+            cluster_ids = await client.list() or cluster_ids
+        elif x < 0.95:
+            await client.query(rand.choice(cluster_ids))
+        else:
+            user_id = 'poll{}'.format(n)
+            cluster_id = await client.apply(user_id)
+            if cluster_id:
+                await client.release(user_id, cluster_id)
+
+
+async def admin(client, n, deadline, rand):
+    """
+    The clients mix the reads of the dashboard with cluster churn.
+    """
+    reads = [('stat_host', '/api/stat', {'res': 'host'}),
+             ('stat_cluster', '/api/stat', {'res': 'cluster'}),
+             ('stat_counter', '/api/stat', {'res': 'counter'}),
+             ('jobs', '/api/jobs', {})]
+    while time.time() < deadline:
+        if rand.random() < 0.7:
+            op, path, params = rand.choice(reads)
+            await client.call(op, 'GET', client.admin_url + path, params)
+            continue
+        user_id = 'admin{}'.format(n)
+        cluster_id = await client.apply(user_id)
+        if cluster_id:
+            await client.release(user_id, cluster_id)
+        else:
+            await asyncio.sleep(0.5)
+
+
+async def mongo_counts(session, url):
+    """
+    Get the numbers of mongo commands run by the server, by command.
+
+    :return: dict of command -> number, empty if no /metrics
+    """
+    try:
+        async with session.get(url + '/metrics') as r:
+            if r.status != 200:
+                return {}
+            text = await r.text()
+    except aiohttp.ClientError:
+        return {}
+    counts = {}
+    for command, n in MONGO_COUNT.findall(text):
+        counts[command] = counts.get(command, 0) + int(float(n))
+    return counts
+
+
+async def run(scenario, url, admin_url, concurrency, seconds, seed=0):
+    """
+    Run one scenario.
+
+    :return: dict of the results
+    """
+    recorder = Recorder()
+    connector = aiohttp.TCPConnector(limit=concurrency * 2)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=timeout) as session:
+        client = Client(session, url, admin_url, recorder)
+        before = await mongo_counts(session, url)
+        deadline = time.time() + seconds
+        func = globals()[scenario]
+        await asyncio.gather(*[
+            func(client, n, deadline, random.Random(seed + n))
+            for n in range(concurrency)])
+        after = await mongo_counts(session, url)
+    mongo = dict((k, v - before.get(k, 0)) for k, v in after.items()
+                 if v > before.get(k, 0))
+    return {'ops': recorder.report(seconds), 'mongo': mongo}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Find the regressions against a baseline.
+
+    :param results: dict of scenario -> results
+    :param baseline: the same of a former run
+    :param tolerance: fraction of rps and p99 allowed to get worse
+    :return: list of the regressions, as strs
+    """
+    regressions = []
+    for scenario, result in results.items():
+        base = baseline.get('scenarios', {}).get(scenario)
+        if not base:
+            continue
+        for op, r in result['ops'].items():
+            b = base['ops'].get(op)
+            if not b:
+                continue
+            name = '{}/{}'.format(scenario, op)
+            if r['rps'] < b['rps'] * (1 - tolerance):
+                regressions.append('{} rps {:.1f} < {:.1f}'.format(
+                    name, r['rps'], b['rps']))
+            if r['p99_ms'] > b['p99_ms'] * (1 + tolerance):
+                regressions.append('{} p99 {:.1f}ms > {:.1f}ms'.format(
+                    name, r['p99_ms'], b['p99_ms']))
+            if r['error_rate'] > b['error_rate'] + 0.01:
+                regressions.append('{} errors {:.1%} > {:.1%}'.format(
+                    name, r['error_rate'], b['error_rate']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('url')
+    parser.add_argument('--scenario', nargs='+', default=SCENARIOS[:3],
+                        choices=SCENARIOS)
+    parser.add_argument('--admin-url', default='',
+                        help='dashboard url, for the admin scenario')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--save', default='', help='file to save results')
+    parser.add_argument('--baseline', default='',
+                        help='file of the results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    if 'admin' in args.scenario and not args.admin_url:
+        parser.error('--admin-url is needed by the admin scenario')
+    loop = asyncio.get_event_loop()
+    results = {}
+    print("{:<20} {:>8} {:>9} {:>9} {:>9} {:>9} {:>7} {:>7}".format(
+        'scenario/op', 'req/s', 'p50 ms', 'p99 ms', 'max ms', 'fail',
+        '429', 'error'))
+    for scenario in args.scenario:
+        result = loop.run_until_complete(run(
+            scenario, args.url.rstrip('/'), args.admin_url.rstrip('/'),
+            args.concurrency, args.seconds))
+        results[scenario] = result
+        for op, r in sorted(result['ops'].items()):
+            print("{:<20} {rps:>8.1f} {p50_ms:>9.1f} {p99_ms:>9.1f} "
+                  "{max_ms:>9.1f} {fail_rate:>7.1%} {rejected_rate:>7.1%} "
+                  "{error_rate:>7.1%}".format(scenario + '/' + op, **r))
+        print("{:<20} {}".format(scenario + '/mongo', ' '.join(
+            '{}={}'.format(k, v) for k, v in sorted(
+                result['mongo'].items())) or '-'))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'time': time.time(), 'url': args.url,
+                       'concurrency': args.concurrency,
+                       'seconds': args.seconds, 'scenarios': results}, f,
+                      indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+# Replay the v2 requests captured by a restserver against a test deployment.
+# Start the captured restserver with CAPTURE_FILE=/path/to/capture.log to
+# append each v2 request with its status, outcome and latency. The requests
+# are re-issued in order at the captured pace, or --speed times faster (0 as
+# fast as possible), the clusters applied are mapped to the ones applied in
+# the replay for the later queries and releases, which wait for their apply
+# to return, then the latencies and outcomes are compared with the captured
+# ones by route.
+# Usage: python test/replay_traffic.py capture.log http://127.0.0.1:80 \
+#        [--speed 1] [--limit 10000] [--concurrency 256] [--save out.json]
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import aiohttp
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+from common import percentiles
+from common.capture import outcome_of
+
+
+def load(path, limit=0):
+    """
+    Load the captured requests, in the order they came.
+
+    :param path: capture file
+    :param limit: max requests to load, 0 for all
+    :return: list of records
+    """
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:  # cut by a crash
+                continue
+            if limit and len(records) >= limit:
+                break
+    records.sort(key=lambda r: r['t'])
+    return records
+
+
+class Replayer(object):
+    """
+    Re-issue the captured requests and record the outcomes.
+    """
+    def __init__(self, session, url, concurrency):
+        self.session, self.url = session, url
+        self.slots = asyncio.Semaphore(concurrency)
+        self.ids = {}  # captured cluster id -> replayed one
+        self.applied = {}  # captured cluster id -> future set by its apply
+        self.results = []  # (record, status, code, latency, lag)
+
+    def translate(self, r):
+        """
+        Map the captured cluster ids in a request to the replayed ones.
+
+        :return: path, params
+        """
+        path = '/'.join(self.ids.get(s, s) for s in r['p'].split('/'))
+        params = dict(r.get('q') or {})
+        if params.get('cluster_id') in self.ids:
+            params['cluster_id'] = self.ids[params['cluster_id']]
+        return path, params
+
+    def refs(self, r):
+        """
+        Get the captured cluster ids a request refers to.
+
+        :return: set of ids
+        """
+        refs = set(r['p'].split('/'))
+        refs.add((r.get('q') or {}).get('cluster_id'))
+        return refs
+
+    async def send(self, r, due, done=None):
+        """
+        Send a request once the applies it refers to have returned.
+
+        :param r: captured request
+        :param due: timestamp the request should be sent
+        :param done: future to set when the request returns, if it is
+            the first one of its captured cluster id
+        :return: None
+        """
+        try:
+            await self._send(r, due, done)
+        finally:
+            if done and not done.done():  # never leave the others waiting
+                done.set_result(None)
+
+    async def _send(self, r, due, done):
+        waits = [self.applied[i] for i in self.refs(r)
+                 if i in self.applied and self.applied[i] is not done]
+        if waits:  # outside the slots, as the applies need them
+            await asyncio.wait(waits)
+        async with self.slots:
+            lag = time.time() - due
+            path, params = self.translate(r)
+            kwargs = {'headers': {'Idempotency-Key': r['k']}} \
+                if r.get('k') else {}
+            if r['m'] == 'GET':
+                kwargs['params'] = params
+            elif r.get('b') is not None:
+                kwargs.update(params=params, json=r['b'])
+            else:
+                kwargs['data'] = params
+            start, status, code = time.time(), 0, None
+            try:
+                async with self.session.request(r['m'], self.url + path,
+                                                **kwargs) as response:
+                    data = await response.read()
+                    status = response.status
+                    code, cluster_id = outcome_of(data)
+                    if r.get('i') and cluster_id:
+                        self.ids[r['i']] = cluster_id
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            self.results.append((r, status, code, time.time() - start, lag))
+
+    async def replay(self, records, speed):
+        """
+        Send the requests at the captured pace divided by speed.
+
+        :param records: captured requests
+        :param speed: times faster than captured, 0 for no wait
+        :return: None
+        """
+        tasks, start = [], time.time()
+        t0 = records[0]['t'] if records else 0
+        for r in records:
+            due = start + (r['t'] - t0) / speed if speed else time.time()
+            if due > time.time():
+                await asyncio.sleep(due - time.time())
+            done = None
+            if r.get('i') and r['i'] not in self.applied:
+                done = self.applied[r['i']] = asyncio.Future()
+            tasks.append(asyncio.ensure_future(self.send(r, due, done)))
+        await asyncio.gather(*tasks)
+
+
+def compare(results):
+    """
+    Compare the replayed outcomes and latencies with the captured ones.
+
+    :param results: list of (record, status, code, latency, lag)
+    :return: dict of route -> comparison
+    """
+    routes = {}
+    for r, status, code, latency, lag in results:
+        d = routes.setdefault('{} {}'.format(r['m'], r['r'] or r['p']), {
+            'captured': [], 'replayed': [], 'lags': [], 'same': 0,
+            'changed': {}})
+        d['captured'].append(r['l'] / 1000.0)
+        d['replayed'].append(latency)
+        d['lags'].append(max(lag, 0))
+        if (status, code) == (r['s'], r.get('c', code)):
+            d['same'] += 1
+        else:
+            change = '{}/{} -> {}/{}'.format(r['s'], r.get('c', '-'),
+                                             status, code or '-')
+            d['changed'][change] = d['changed'].get(change, 0) + 1
+    result = {}
+    for route, d in routes.items():
+        n = len(d['captured'])
+        captured = percentiles(d['captured'], (50, 99))
+        replayed = percentiles(d['replayed'], (50, 99))
+        result[route] = {
+            'requests': n, 'same_outcome': d['same'] / float(n),
+            'captured_p50_ms': captured['p50'] * 1000,
+            'captured_p99_ms': captured['p99'] * 1000,
+            'replayed_p50_ms': replayed['p50'] * 1000,
+            'replayed_p99_ms': replayed['p99'] * 1000,
+            'max_lag_ms': max(d['lags']) * 1000, 'changed': d['changed']}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('capture')
+    parser.add_argument('url')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='times faster than captured, 0 for no wait')
+    parser.add_argument('--limit', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=256)
+    parser.add_argument('--save', default='', help='file to save results')
+    args = parser.parse_args()
+    records = load(args.capture, args.limit)
+    if not records:
+        sys.exit("No request in {}".format(args.capture))
+    print("Replaying {} requests of {:.1f}s at {}x".format(
+        len(records), records[-1]['t'] - records[0]['t'], args.speed))
+
+    async def run():
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            replayer = Replayer(session, args.url.rstrip('/'),
+                                args.concurrency)
+            await replayer.replay(records, args.speed)
+            return replayer.results
+
+    results = compare(asyncio.get_event_loop().run_until_complete(run()))
+    print("{:<32} {:>7} {:>6} {:>17} {:>17} {:>8}".format(
+        'route', 'reqs', 'same', 'captured p50/p99', 'replayed p50/p99',
+        'lag ms'))
+    for route, r in sorted(results.items()):
+        print("{:<32} {requests:>7} {same_outcome:>6.1%} "
+              "{captured_p50_ms:>8.1f}/{captured_p99_ms:<8.1f} "
+              "{replayed_p50_ms:>8.1f}/{replayed_p99_ms:<8.1f} "
+              "{max_lag_ms:>8.1f}".format(route, **r))
+        for change, n in sorted(r['changed'].items()):
+            print("    {} x{}".format(change, n))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'capture': args.capture, 'speed': args.speed,
+                       'routes': results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()